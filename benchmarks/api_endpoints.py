@@ -0,0 +1,446 @@
+"""
+Benchmark the API endpoints against synthetic data, and compare the results with a baseline.
+
+Seeds users and File rows at the requested scale into a throwaway SQLite database, then drives
+signup, login, upload, listing (cached and uncached), download-link generation and download
+over two transports:
+
+    client  Django's test client, in-process and one request at a time: the view stack alone.
+    server  Django's threaded HTTP server on localhost, with --concurrency client threads. It
+            opens a fresh database connection for every HTTP connection, as runserver does.
+
+Each endpoint reports latency percentiles, throughput and database queries per request. The
+results are written as JSON:
+
+    python benchmarks/api_endpoints.py --files 100000 --requests 200 --output results.json
+    python benchmarks/api_endpoints.py --files 100000 --save-baseline benchmarks/baseline.json
+    python benchmarks/api_endpoints.py --files 100000 --baseline benchmarks/baseline.json
+
+An endpoint regresses when its median latency grows by more than --tolerance, or when it makes
+more queries per request than in the baseline. The exit status is then 1. Latency is only
+comparable between runs on the same machine at the same scale. Query counts are comparable
+anywhere.
+
+Seeding is driven by --seed, so runs at the same scale see the same rows. Throttles stay in the
+request path but never trigger. Passwords use the configured hashers, so signup and login cost
+what they cost in production.
+"""
+import argparse
+import http.client
+import io
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from typing import NamedTuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'file_sharing_system.settings')
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.contrib.auth.hashers import make_password  # noqa: E402
+from django.core.files.uploadedfile import SimpleUploadedFile  # noqa: E402
+from django.core.servers.basehttp import ThreadedWSGIServer, WSGIRequestHandler  # noqa: E402
+from django.core.wsgi import get_wsgi_application  # noqa: E402
+from django.db import connection, connections  # noqa: E402
+from django.db.backends.signals import connection_created  # noqa: E402
+from django.test import Client, override_settings  # noqa: E402
+from django.utils import timezone  # noqa: E402
+from rest_framework.settings import api_settings  # noqa: E402
+
+from sharing_app.models import File, User  # noqa: E402
+from sharing_app.serializers import FileUploadSerializer  # noqa: E402
+from sharing_app.throttling import TokenBucketRateThrottle  # noqa: E402
+from sharing_app.tokens import tokens_for_user  # noqa: E402
+from sharing_app.utils import name_metadata  # noqa: E402
+
+HOST = 'localhost'
+PASSWORD = 'Bench-passw0rd!'
+BATCH_SIZE = 5000
+EXTENSIONS = ('docx', 'pptx', 'xlsx')
+ENDPOINTS = ('signup', 'login', 'upload', 'list', 'list_cached', 'link', 'download')
+WORD_NAMESPACE = 'http://schemas.openxmlformats.org/wordprocessingml/2006/main'
+CONTENT_TYPES_XML = (
+    '<?xml version="1.0" encoding="UTF-8"?>'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Override PartName="/word/document.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>'
+    '</Types>'
+)
+
+
+class Call(NamedTuple):
+    method: str
+    path: str
+    body: bytes = b''
+    content_type: str = 'application/octet-stream'
+    token: str = None
+    expected: int = 200
+
+
+class QueryCounter:
+    """
+    Counts queries on every connection in every thread, including server request threads.
+    """
+    def __init__(self):
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        with self.lock:
+            self.count += 1
+        return execute(sql, params, many, context)
+
+    def install(self):
+        for conn in connections.all():
+            self.attach(conn)
+        connection_created.connect(self.on_connect, weak=False)
+
+    def on_connect(self, sender, connection, **kwargs):
+        self.attach(connection)
+
+    def attach(self, conn):
+        if self not in conn.execute_wrappers:
+            conn.execute_wrappers.append(self)
+
+
+def docx_bytes(text, padding=0):
+    # A minimal Word document; padding is stored uncompressed to reach a target size
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr('[Content_Types].xml', CONTENT_TYPES_XML)
+        archive.writestr(
+            'word/document.xml',
+            f'<w:document xmlns:w="{WORD_NAMESPACE}"><w:body><w:p><w:r><w:t>{text}</w:t></w:r></w:p></w:body></w:document>',
+        )
+        if padding:
+            archive.writestr('word/media/padding.bin', os.urandom(padding), compress_type=zipfile.ZIP_STORED)
+    return buffer.getvalue()
+
+
+def json_call(method, path, data, token=None, expected=200):
+    return Call(method, path, json.dumps(data).encode(), 'application/json', token, expected)
+
+
+def multipart_call(path, filename, content, token, expected=201):
+    boundary = uuid.uuid4().hex
+    body = (
+        f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+        f'Content-Type: application/octet-stream\r\n\r\n'
+    ).encode() + content + f'\r\n--{boundary}--\r\n'.encode()
+    return Call('POST', path, body, f'multipart/form-data; boundary={boundary}', token, expected)
+
+
+def seed(files, users, download_size, rng):
+    """
+    Creates `users` users (a tenth of them ops users) and `files` File rows spread over the ops
+    users, plus one real upload to download. Returns what the endpoint calls need.
+    """
+    password = make_password(PASSWORD)  # Hashed once; every seeded user shares it
+    ops_count = max(1, users // 10)
+    User.objects.bulk_create(
+        [
+            User(username=f'ops{i}', email=f'ops{i}@bench.test', password=password, user_type='ops_user', is_verified=True)
+            for i in range(ops_count)
+        ] + [
+            User(username=f'client{i}', email=f'client{i}@bench.test', password=password, user_type='client_user', is_verified=True)
+            for i in range(max(1, users - ops_count))
+        ],
+        batch_size=BATCH_SIZE,
+    )
+    ops_ids = list(User.objects.filter(user_type='ops_user').values_list('pk', flat=True))
+
+    field = File._meta.get_field('file')
+    now = timezone.now()
+    batch = []
+    for i in range(files):
+        digest = '%064x' % rng.getrandbits(256)
+        extension = rng.choice(EXTENSIONS)
+        original_name = f'document-{i}.{extension}'
+        batch.append(File(
+            file=field.generate_filename(None, f'{digest}.{extension}'),  # Never read; only listed and linked
+            sha256=digest,
+            original_name=original_name,
+            size=rng.randint(10_000, 50_000_000),
+            upload_date=now - timedelta(seconds=i),
+            uploaded_by_id=rng.choice(ops_ids),
+            **name_metadata(original_name),
+        ))
+        if len(batch) == BATCH_SIZE:
+            File.objects.bulk_create(batch)
+            batch = []
+    File.objects.bulk_create(batch)
+
+    ops_user = User.objects.get(email='ops0@bench.test')
+    serializer = FileUploadSerializer(data={'file': SimpleUploadedFile('download.docx', docx_bytes('download', download_size))})
+    serializer.is_valid(raise_exception=True)
+    download = serializer.save(uploaded_by=ops_user)
+    return {
+        'ops_user': ops_user,
+        'client_user': User.objects.get(email='client0@bench.test'),
+        'file_ids': list(File.objects.values_list('pk', flat=True)[:10000]),
+        'download_id': download.pk,
+    }
+
+
+def build_calls(endpoint, data, count, transport, rng):
+    ops_token = str(tokens_for_user(data['ops_user']).access_token)
+    client_token = str(tokens_for_user(data['client_user']).access_token)
+    tag = f'{transport}-{uuid.uuid4().hex[:8]}'  # Keeps signups and uploads unique across runs
+
+    if endpoint == 'signup':
+        return [
+            json_call('POST', '/api/signup/', {
+                'username': f'signup-{tag}-{i}', 'email': f'signup-{tag}-{i}@bench.test',
+                'password': PASSWORD, 'user_type': 'client_user',
+            }, expected=201)
+            for i in range(count)
+        ]
+    if endpoint == 'login':
+        return [json_call('POST', '/api/login/', {'email': 'client0@bench.test', 'password': PASSWORD})] * count
+    if endpoint == 'upload':
+        return [multipart_call('/api/upload/', f'upload-{i}.docx', docx_bytes(f'{tag}-{i}'), ops_token) for i in range(count)]
+    if endpoint == 'list':
+        # A distinct URL per request misses the listing cache every time
+        return [Call('GET', f'/api/files/?page_size=100&bench={tag}-{i}', token=client_token) for i in range(count)]
+    if endpoint == 'list_cached':
+        return [Call('GET', '/api/files/?page_size=100', token=client_token)] * count
+    if endpoint == 'link':
+        return [Call('POST', f'/api/files/{rng.choice(data["file_ids"])}/download/', token=client_token) for _ in range(count)]
+    if endpoint == 'download':
+        link = Client(SERVER_NAME=HOST).post(
+            f'/api/files/{data["download_id"]}/download/', HTTP_AUTHORIZATION=f'Bearer {client_token}'
+        ).json()['download_link']
+        return [Call('GET', link + '/', token=client_token)] * count
+    raise ValueError(f'Unknown endpoint {endpoint}')
+
+
+class InProcessTransport:
+    name = 'client'
+
+    def __init__(self):
+        self.client = Client(SERVER_NAME=HOST)
+
+    def send(self, call):
+        extra = {'HTTP_AUTHORIZATION': f'Bearer {call.token}'} if call.token else {}
+        response = self.client.generic(call.method, call.path, call.body, content_type=call.content_type, **extra)
+        if response.streaming:
+            for block in response.streaming_content:
+                pass
+        response.close()
+        return response.status_code
+
+
+class ServerTransport:
+    name = 'server'
+
+    def __init__(self, port):
+        self.port = port
+        self.local = threading.local()  # One keep-alive connection per client thread
+
+    def send(self, call):
+        conn = getattr(self.local, 'connection', None)
+        if conn is None:
+            conn = http.client.HTTPConnection(HOST, self.port)
+            conn.connect()
+            conn.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)  # No delayed-ACK stalls between small writes
+        headers = {'Content-Type': call.content_type}
+        if call.token:
+            headers['Authorization'] = f'Bearer {call.token}'
+        conn.request(call.method, call.path, body=call.body, headers=headers)
+        response = conn.getresponse()
+        response.read()
+        self.local.connection = None if response.will_close else conn
+        if response.will_close:
+            conn.close()
+        return response.status
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    disable_nagle_algorithm = True  # Headers and body go out as separate writes
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_server():
+    server = ThreadedWSGIServer((HOST, 0), QuietRequestHandler, ipv6=False)
+    server.set_app(get_wsgi_application())
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def percentile(values, fraction):
+    # Nearest rank on sorted values
+    return values[min(len(values) - 1, max(0, round(fraction * len(values)) - 1))]
+
+
+def measure(transport, calls, counter, concurrency):
+    def send(call):
+        started = time.perf_counter()
+        status = transport.send(call)
+        return time.perf_counter() - started, status == call.expected
+
+    queries = counter.count
+    started = time.perf_counter()
+    if concurrency > 1:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            outcomes = list(pool.map(send, calls))
+    else:
+        outcomes = [send(call) for call in calls]
+    elapsed = time.perf_counter() - started
+
+    latencies = sorted(seconds * 1000 for seconds, ok in outcomes)
+    return {
+        'requests': len(outcomes),
+        'errors': sum(1 for seconds, ok in outcomes if not ok),
+        'p50_ms': round(percentile(latencies, 0.50), 3),
+        'p90_ms': round(percentile(latencies, 0.90), 3),
+        'p99_ms': round(percentile(latencies, 0.99), 3),
+        'max_ms': round(latencies[-1], 3),
+        'mean_ms': round(sum(latencies) / len(latencies), 3),
+        'throughput_rps': round(len(outcomes) / elapsed, 1),
+        'queries_per_request': round((counter.count - queries) / len(outcomes), 2),
+    }
+
+
+def compare(results, baseline, tolerance):
+    """
+    Returns a line for each endpoint that got slower or made more queries than in `baseline`.
+    """
+    regressions = []
+    for transport, endpoints in results['results'].items():
+        for endpoint, stats in endpoints.items():
+            base = baseline['results'].get(transport, {}).get(endpoint)
+            if base is None:
+                continue
+            if stats['p50_ms'] > base['p50_ms'] * (1 + tolerance):
+                regressions.append(f"{transport}/{endpoint}: p50 {base['p50_ms']} ms -> {stats['p50_ms']} ms")
+            if stats['queries_per_request'] > base['queries_per_request']:
+                regressions.append(
+                    f"{transport}/{endpoint}: {base['queries_per_request']} -> {stats['queries_per_request']} queries per request"
+                )
+    return regressions
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_table(results):
+    print(f"{'endpoint':<22}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'req/s':>10}{'queries':>9}{'errors':>8}")
+    for transport, endpoints in results['results'].items():
+        for endpoint, stats in endpoints.items():
+            print(
+                f"{transport + '/' + endpoint:<22}{stats['p50_ms']:>10}{stats['p90_ms']:>10}{stats['p99_ms']:>10}"
+                f"{stats['throughput_rps']:>10}{stats['queries_per_request']:>9}{stats['errors']:>8}"
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--files', type=int, default=1000, help='File rows to seed (1000 to 1000000).')
+    parser.add_argument('--users', type=int, default=100, help='Users to seed; a tenth are ops users.')
+    parser.add_argument('--requests', type=int, default=100, help='Requests per endpoint and transport.')
+    parser.add_argument('--endpoints', default=','.join(ENDPOINTS), help='Comma-separated subset of: ' + ', '.join(ENDPOINTS))
+    parser.add_argument('--transports', default='client,server', help='client, server or both.')
+    parser.add_argument('--concurrency', type=int, default=4, help='Client threads against the server.')
+    parser.add_argument('--download-size', type=int, default=1024 * 1024, help='Bytes in the downloaded file.')
+    parser.add_argument('--seed', type=int, default=1, help='Seed for the synthetic data.')
+    parser.add_argument('--output', help='Write the results to this JSON file.')
+    parser.add_argument('--baseline', help='Compare with the results in this JSON file.')
+    parser.add_argument('--save-baseline', help='Write the results to this JSON file as the new baseline.')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='Allowed growth in median latency (0.2 is 20%%).')
+    args = parser.parse_args()
+
+    endpoints = [name for name in args.endpoints.split(',') if name]
+    unknown = set(endpoints) - set(ENDPOINTS)
+    if unknown:
+        parser.error(f"unknown endpoints: {', '.join(sorted(unknown))}")
+    rng = random.Random(args.seed)
+
+    # Throttles still run, with limits no benchmark reaches
+    TokenBucketRateThrottle.THROTTLE_RATES = {scope: '1000000/s' for scope in api_settings.DEFAULT_THROTTLE_RATES}
+
+    with tempfile.TemporaryDirectory() as workdir:
+        # A file rather than memory, so server threads share the database the way workers do
+        connection.settings_dict['TEST']['NAME'] = os.path.join(workdir, 'benchmark.sqlite3')
+        old_name = connection.creation.create_test_db(verbosity=0)
+        try:
+            with override_settings(
+                MEDIA_ROOT=os.path.join(workdir, 'media'), FILE_DELIVERY_BACKEND='direct',
+                DEBUG=False, ALLOWED_HOSTS=[HOST],
+            ):
+                started = time.perf_counter()
+                data = seed(args.files, args.users, args.download_size, rng)
+                print(f'Seeded {args.users} users and {args.files} files in {time.perf_counter() - started:.1f}s')
+
+                counter = QueryCounter()
+                counter.install()
+                results = {
+                    'meta': {
+                        'files': args.files, 'users': args.users, 'requests': args.requests,
+                        'concurrency': args.concurrency, 'download_size': args.download_size, 'seed': args.seed,
+                        'revision': git_revision(), 'python': platform.python_version(), 'django': django.get_version(),
+                        'machine': platform.platform(), 'date': timezone.now().isoformat(),
+                    },
+                    'results': {},
+                }
+
+                server = start_server() if 'server' in args.transports else None
+                try:
+                    transports = []
+                    if 'client' in args.transports:
+                        transports.append((InProcessTransport(), 1))
+                    if server is not None:
+                        transports.append((ServerTransport(server.server_address[1]), args.concurrency))
+                    for transport, concurrency in transports:
+                        for endpoint in endpoints:
+                            calls = build_calls(endpoint, data, args.requests, transport.name, rng)
+                            stats = measure(transport, calls, counter, concurrency)
+                            results['results'].setdefault(transport.name, {})[endpoint] = stats
+                finally:
+                    if server is not None:
+                        server.shutdown()
+                        server.server_close()
+        finally:
+            connections.close_all()
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    print_table(results)
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, 'w') as output:
+                json.dump(results, output, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+        if (baseline['meta']['files'], baseline['meta']['users']) != (args.files, args.users):
+            print('Warning: the baseline was recorded at a different scale.')
+        regressions = compare(results, baseline, args.tolerance)
+        for line in regressions:
+            print('REGRESSION', line)
+        if regressions:
+            sys.exit(1)
+        print('No regressions against', args.baseline)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,151 @@
+"""
+Compare slow-client downloads through the async view under ASGI with the sync view under a
+fixed pool of WSGI worker threads.
+
+Each simulated client reads the response and pauses in proportion to the bytes received, as a
+client on a slow link would. Under WSGI every paused client holds a worker thread, so clients
+beyond the pool size queue. Under ASGI a paused client is a suspended coroutine.
+
+Runs in-process against a throwaway test database:
+
+    python benchmarks/asgi_slow_clients.py --clients 64 --workers 8 --size 1048576 --delay 0.01
+"""
+import argparse
+import asyncio
+import io
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'file_sharing_system.settings')
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.core.files.uploadedfile import SimpleUploadedFile  # noqa: E402
+from django.core.handlers.wsgi import WSGIHandler  # noqa: E402
+from django.db import connection  # noqa: E402
+from django.test import override_settings  # noqa: E402
+from rest_framework.test import APIClient  # noqa: E402
+
+from sharing_app.asgi import StreamingBodyASGIHandler  # noqa: E402
+from sharing_app.delivery import BLOCK_SIZE  # noqa: E402
+from sharing_app.models import User  # noqa: E402
+from sharing_app.serializers import FileUploadSerializer  # noqa: E402
+from sharing_app.tokens import tokens_for_user  # noqa: E402
+
+HOST = 'localhost'
+
+
+def seed(size):
+    ops_user = User.objects.create_user(username='ops', email='ops@example.com', password='x', user_type='ops_user')
+    client_user = User.objects.create_user(
+        username='client', email='client@example.com', password='x', user_type='client_user', is_verified=True
+    )
+    serializer = FileUploadSerializer(data={'file': SimpleUploadedFile('deck.pptx', os.urandom(size))})
+    serializer.is_valid(raise_exception=True)
+    file_instance = serializer.save(uploaded_by=ops_user)
+
+    client = APIClient(SERVER_NAME=HOST)
+    client.force_authenticate(user=client_user)
+    link = client.post(f'/api/files/{file_instance.pk}/download/').data['download_link']
+    return link.rsplit('/', 1)[-1], str(tokens_for_user(client_user).access_token)
+
+
+def run_asgi(signed_url, token, clients, delay):
+    application = StreamingBodyASGIHandler()  # As served by file_sharing_system.asgi
+    path = f'/api/async/files/download/{signed_url}/'
+
+    async def download():
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET',
+            'scheme': 'http', 'path': path, 'raw_path': path.encode(), 'query_string': b'',
+            'headers': [(b'host', HOST.encode()), (b'authorization', f'Bearer {token}'.encode())],
+            'client': ('127.0.0.1', 0), 'server': (HOST, 80),
+        }
+        received = 0
+        requested = False
+
+        async def receive():
+            nonlocal requested
+            if requested:
+                await asyncio.Event().wait()  # The client stays connected until the response ends
+            requested = True
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+        async def send(message):
+            nonlocal received
+            if message['type'] == 'http.response.body':
+                received += len(message.get('body', b''))
+                await asyncio.sleep(delay * len(message.get('body', b'')) / BLOCK_SIZE)  # Slow link
+
+        await application(scope, receive, send)
+        return received
+
+    async def main():
+        return await asyncio.gather(*(download() for _ in range(clients)))
+
+    return asyncio.run(main())
+
+
+def run_wsgi(signed_url, token, clients, delay, workers):
+    application = WSGIHandler()
+    path = f'/api/files/download/{signed_url}/'
+
+    def download():
+        environ = {
+            'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'SCRIPT_NAME': '', 'QUERY_STRING': '',
+            'SERVER_NAME': HOST, 'SERVER_PORT': '80', 'SERVER_PROTOCOL': 'HTTP/1.1', 'HTTP_HOST': HOST,
+            'HTTP_AUTHORIZATION': f'Bearer {token}', 'REMOTE_ADDR': '127.0.0.1',
+            'wsgi.input': io.BytesIO(), 'wsgi.errors': sys.stderr, 'wsgi.url_scheme': 'http',
+            'wsgi.version': (1, 0), 'wsgi.multithread': True, 'wsgi.multiprocess': False,
+            'wsgi.run_once': False,
+        }
+        body = application(environ, lambda status, headers, exc_info=None: None)
+        received = 0
+        try:
+            for block in body:
+                received += len(block)
+                time.sleep(delay * len(block) / BLOCK_SIZE)  # The worker thread waits on the client
+        finally:
+            body.close()
+        return received
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(lambda _: download(), range(clients)))
+
+
+def measure(label, run, expected):
+    started = time.perf_counter()
+    sizes = run()
+    elapsed = time.perf_counter() - started
+    assert all(size == expected for size in sizes), f'{label}: incomplete downloads'
+    print(f'{label:<6} {len(sizes)} clients in {elapsed:.2f}s ({len(sizes) / elapsed:.1f} downloads/s)')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--clients', type=int, default=64, help='Concurrent slow clients.')
+    parser.add_argument('--workers', type=int, default=8, help='WSGI worker threads.')
+    parser.add_argument('--size', type=int, default=1024 * 1024, help='File size in bytes.')
+    parser.add_argument('--delay', type=float, default=0.01, help='Seconds to receive each 64 KiB.')
+    args = parser.parse_args()
+
+    old_name = connection.creation.create_test_db(verbosity=0)
+    try:
+        with tempfile.TemporaryDirectory() as media_root, override_settings(
+            MEDIA_ROOT=media_root, FILE_DELIVERY_BACKEND='direct'
+        ):
+            signed_url, token = seed(args.size)
+            measure('wsgi', lambda: run_wsgi(signed_url, token, args.clients, args.delay, args.workers), args.size)
+            measure('asgi', lambda: run_asgi(signed_url, token, args.clients, args.delay), args.size)
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+if __name__ == '__main__':
+    main()
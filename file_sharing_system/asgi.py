@@ -9,8 +9,12 @@ https://docs.djangoproject.com/en/5.1/howto/deployment/asgi/
 
 import os
 
-from django.core.asgi import get_asgi_application
+import django
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'file_sharing_system.settings')
+django.setup(set_prefix=False)
 
-application = get_asgi_application()
+from sharing_app.asgi import StreamingBodyASGIHandler  # noqa: E402 (needs the app registry)
+
+# Django's handler, except that views with stream_request_body read their body as it arrives
+application = StreamingBodyASGIHandler()
@@ -36,7 +36,10 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'sharing_app.middleware.ProfilingMiddleware',  # Above metrics, so saving a profile is not counted as request time
+    'sharing_app.middleware.MetricsMiddleware',  # Times everything below
     'django.middleware.security.SecurityMiddleware',
+    'sharing_app.middleware.DatabaseRoutingMiddleware',  # Lets reads in requests go to replicas
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -66,10 +69,57 @@ TEMPLATES = [
 WSGI_APPLICATION = 'file_sharing_system.wsgi.application'
 
 # Database
+# SQLite suits a single node: WAL lets readers run while a write commits, synchronous=NORMAL is
+# safe under WAL, and IMMEDIATE transactions take the write lock up front so concurrent writers
+# wait out `timeout` instead of failing with "database is locked".
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            'init_command': (
+                'PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL; PRAGMA temp_store=MEMORY; '
+                'PRAGMA cache_size=-20000; PRAGMA mmap_size=134217728'  # 20 MB page cache, 128 MB mapped
+            ),
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 20,  # Seconds to wait for the write lock
+        },
+    }
+}
+
+# MySQL primary (mysqlclient) instead, when a host is configured
+if os.environ.get('DATABASE_HOST'):
+    DATABASES['default'] = {
+        'ENGINE': 'django.db.backends.mysql',
+        'NAME': os.environ.get('DATABASE_NAME', 'file_sharing'),
+        'USER': os.environ.get('DATABASE_USER', ''),
+        'PASSWORD': os.environ.get('DATABASE_PASSWORD', ''),
+        'HOST': os.environ['DATABASE_HOST'],
+        'PORT': os.environ.get('DATABASE_PORT', ''),
+        'OPTIONS': {'charset': 'utf8mb4'},
+    }
+
+# Persistent connections: reused across requests, checked before reuse after an error or restart
+DATABASES['default']['CONN_MAX_AGE'] = int(os.environ.get('DATABASE_CONN_MAX_AGE', 600))
+DATABASES['default']['CONN_HEALTH_CHECKS'] = True
+
+# Read replica: a copy of 'default' kept in sync outside Django. DATABASE_REPLICA is its host
+# (MySQL) or file (SQLite). The alias is always declared so tests can stand one up, but reads only
+# go to it once it is listed in DATABASE_REPLICAS.
+DATABASES['replica'] = dict(DATABASES['default'])
+if os.environ.get('DATABASE_REPLICA'):
+    DATABASES['replica']['HOST' if os.environ.get('DATABASE_HOST') else 'NAME'] = os.environ['DATABASE_REPLICA']
+
+# Database routing settings
+DATABASE_ROUTERS = ['sharing_app.routers.PrimaryReplicaRouter']
+DATABASE_REPLICAS = ['replica'] if os.environ.get('DATABASE_REPLICA') else []  # Aliases that serve reads in requests
+DATABASE_REPLICA_STICKINESS = 10  # Seconds a user who wrote keeps reading the primary; must exceed replication lag
+
+# Cache settings (use a shared backend such as Redis when running several workers)
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get('DJANGO_CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('DJANGO_CACHE_LOCATION', ''),
     }
 }
 
@@ -104,15 +154,29 @@ EMAIL_HOST_PASSWORD = os.environ.get('EMAIL_HOST_PASSWORD')
 DEFAULT_FROM_EMAIL = EMAIL_HOST_USER
 BACKEND_URL = 'http://localhost:8000'
 
+# Email outbox settings (delivered by `manage.py send_queued_email`)
+EMAIL_OUTBOX_BATCH_SIZE = 100  # Messages sent per batch over one connection
+EMAIL_OUTBOX_MAX_ATTEMPTS = 5  # Give up on a message after this many failures
+EMAIL_OUTBOX_RETRY_DELAY = timedelta(minutes=1)  # First retry delay, doubled on each failure
+EMAIL_OUTBOX_MAX_RETRY_DELAY = timedelta(hours=1)  # Upper bound on the retry delay
+EMAIL_OUTBOX_LEASE = timedelta(minutes=5)  # How long a claimed message is hidden from other workers
+
 # REST Framework settings
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
         'rest_framework_simplejwt.authentication.JWTAuthentication',
     ],
+    # Token buckets in the cache (sharing_app.throttling): "N/period" allows bursts of N, refilled at N per period
+    'DEFAULT_THROTTLE_RATES': {
+        'login': '20/min',  # Per client IP
+        'login_account': '5/min',  # Per email address, from any IP
+        'download_link': '60/min',  # Per user
+        'download': '120/min',  # Per user; single files and archives
+    },
 }
 
 SIMPLE_JWT = {
-    'ACCESS_TOKEN_LIFETIME': timedelta(minutes=15),
+    'ACCESS_TOKEN_LIFETIME': timedelta(minutes=5),  # Short-lived: claims in the token are trusted until it expires
     'REFRESH_TOKEN_LIFETIME': timedelta(days=1),
     'ALGORITHM': 'HS256',
     'SIGNING_KEY': SECRET_KEY,
@@ -121,3 +185,91 @@ SIMPLE_JWT = {
 # Media settings
 MEDIA_URL = '/uploads/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'uploads')
+
+# Storage backends; 'uploads' holds File and Blob content in sharded directories
+STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+    'uploads': {
+        'BACKEND': 'sharing_app.storage.ShardedFileSystemStorage',
+        'OPTIONS': {'depth': 2, 'width': 2},  # uploads/ab/cd/<name>
+    },
+}
+
+# Keep uploads in an S3-compatible bucket instead (requires boto3)
+if os.environ.get('UPLOADS_S3_BUCKET'):
+    STORAGES['uploads'] = {
+        'BACKEND': 'sharing_app.storage.S3Storage',
+        'OPTIONS': {
+            'bucket': os.environ['UPLOADS_S3_BUCKET'],
+            'endpoint_url': os.environ.get('UPLOADS_S3_ENDPOINT_URL'),  # e.g. a MinIO server; unset for AWS
+            'region_name': os.environ.get('UPLOADS_S3_REGION'),
+            'access_key': os.environ.get('UPLOADS_S3_ACCESS_KEY'),
+            'secret_key': os.environ.get('UPLOADS_S3_SECRET_KEY'),
+            'max_workers': int(os.environ.get('UPLOADS_S3_MAX_WORKERS', 8)),  # Concurrent multipart parts
+        },
+    }
+
+# Hash uploads as they stream in so they can be stored by content digest
+FILE_UPLOAD_HANDLERS = [
+    'sharing_app.uploadhandlers.HashingMemoryFileUploadHandler',
+    'sharing_app.uploadhandlers.HashingTemporaryFileUploadHandler',
+]
+
+# Upload validation settings (checked by sharing_app.uploadhandlers.UploadGuardHandler while the body streams in)
+FILE_UPLOAD_MAX_SIZE = 500 * 1024 * 1024  # Largest upload in bytes, for users without their own upload_size_limit
+FILE_UPLOAD_SNIFF_SIZE = 64 * 1024  # Bytes at the start of an upload searched for the OOXML [Content_Types].xml part
+
+# Storage quota settings (reconciled by `manage.py reconcile_storage_usage`)
+STORAGE_QUOTA_DEFAULT = int(os.environ.get('STORAGE_QUOTA_DEFAULT', 10 * 1024 ** 3)) or None  # Bytes each user may store unless their StorageQuota sets a limit; None for no quota
+STORAGE_QUOTA_RECONCILE_BATCH_SIZE = 500  # Users recounted per transaction
+
+# File change feed settings (`/api/files/changes/`)
+FILE_CHANGES_PAGE_SIZE = 500  # Changes returned per request; clients repeat while "more" is true
+
+# Resumable upload settings
+UPLOAD_SESSION_DIR = os.path.join(BASE_DIR, 'upload_sessions')  # Partial uploads, kept out of MEDIA_ROOT
+UPLOAD_SESSION_LIFETIME = timedelta(hours=24)  # Idle sessions expire after this
+UPLOAD_CHUNK_MAX_SIZE = 16 * 1024 * 1024  # Largest chunk accepted in a single request
+
+# Download delivery settings
+FILE_DELIVERY_BACKEND = os.environ.get('FILE_DELIVERY_BACKEND', 'direct')  # 'direct', 'x-accel-redirect', 'x-sendfile' or 'redirect'
+FILE_DELIVERY_INTERNAL_PREFIX = '/protected/'  # nginx internal location aliased to MEDIA_ROOT
+FILE_DELIVERY_URL_EXPIRY = 60  # Seconds a presigned URL from the 'redirect' backend stays valid
+FILE_ARCHIVE_MAX_FILES = 500  # Most files in one streamed ZIP from /api/files/archive/
+FILE_DOWNLOAD_BANDWIDTH = int(os.environ.get('FILE_DOWNLOAD_BANDWIDTH', 0)) or None  # Bytes per second per user across their downloads; None for no cap
+
+# File listing settings
+FILE_LIST_PAGE_SIZE = 100  # Files per page when the client does not ask for a size
+FILE_LIST_MAX_PAGE_SIZE = 1000  # Upper bound on the page_size query parameter
+FILE_LIST_CACHE_TIMEOUT = 300  # Seconds a cached listing page is kept
+
+# Metrics settings (scraped from /metrics)
+METRICS_DIR = os.environ.get('METRICS_DIR')  # Snapshot directory shared by all processes on the host; unset for one process
+METRICS_FLUSH_INTERVAL = 5  # Seconds between snapshots a process writes to METRICS_DIR
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')  # Bearer token /metrics requires, when set
+
+# Request profiling settings (profiles are kept in the database; see `manage.py request_profiles`)
+PROFILING_ENABLED = os.environ.get('PROFILING_ENABLED', 'True') == 'True'  # False removes the middleware entirely
+PROFILING_TOKEN_MAX_AGE = 3600  # Seconds a signed X-Profile-Token header is accepted for
+PROFILING_SWITCH_REFRESH = 10  # Seconds each process keeps its copy of the published ProfilingSwitch
+PROFILING_BUFFER_SIZE = 100  # Newest profiles kept
+PROFILING_MAX_QUERIES = 200  # SQL statements kept per profile; all are counted
+PROFILING_REPORT_LINES = 60  # Functions listed in each profile's report
+
+# Maintenance settings (run by `manage.py maintenance`)
+MAINTENANCE_BATCH_SIZE = 500  # Rows deleted or storage names checked per batch
+MAINTENANCE_SCAN_LIMIT = 10000  # Storage names and rows visited per run before saving the cursor
+MAINTENANCE_MAX_OPS_PER_SECOND = 200  # Cap on storage calls and batch queries, to stay out of the way of requests
+MAINTENANCE_ORPHAN_GRACE = timedelta(hours=1)  # Unreferenced files younger than this may belong to an upload in progress
+
+# Full-text search settings (indexed by `manage.py index_files`)
+FILE_SEARCH_BACKEND = 'sharing_app.search.SQLiteFTSBackend'  # Any sharing_app.search.SearchBackend subclass
+FILE_SEARCH_MAX_TEXT_CHARS = 1_000_000  # Text kept per document
+FILE_SEARCH_RESULTS_LIMIT = 50  # Default and maximum number of results per query
+
+# Bulk user provisioning settings
+BULK_PROVISIONING_MAX_ROWS = 10000  # Largest batch accepted by /api/users/bulk/
+BULK_PROVISIONING_BATCH_SIZE = 1000  # Rows per bulk INSERT
+BULK_PROVISIONING_HASH_WORKERS = os.cpu_count() or 1  # Processes used to hash passwords
+BULK_PROVISIONING_POOL_THRESHOLD = 50  # Smaller batches are hashed in-process
@@ -1,6 +1,7 @@
 from django.contrib import admin
-from .models import User, File, VerificationToken
+from .models import User, File, VerificationToken, OutgoingEmail, MaintenanceCursor, ProfilingSwitch, RequestProfile, StorageQuota
 from django.contrib.auth.admin import UserAdmin
+from django.utils.html import format_html, format_html_join
 
 class CustomUserAdmin(UserAdmin):
     list_display = ('username', 'email', 'is_verified', 'user_type')  # Add user_type here
@@ -12,7 +13,54 @@ class CustomUserAdmin(UserAdmin):
         (None, {'fields': ('user_type',)}),  # Add user_type to add_fieldsets
     )
 
+class StorageQuotaAdmin(admin.ModelAdmin):
+    list_display = ('user', 'used_bytes', 'file_count', 'limit_bytes')
+    search_fields = ('user__email',)
+    readonly_fields = ('used_bytes', 'file_count')  # Kept by uploads and deletes; fix drift with reconcile_storage_usage
+
+class ProfilingSwitchAdmin(admin.ModelAdmin):
+    list_display = ('__str__', 'enabled', 'sample_rate', 'path_prefix', 'updated_at')
+
+    def has_add_permission(self, request):
+        return not ProfilingSwitch.objects.filter(pk=1).exists()  # Only the first row is read
+
+    def save_model(self, request, obj, form, change):
+        obj.pk = 1
+        super().save_model(request, obj, form, change)
+
+class RequestProfileAdmin(admin.ModelAdmin):
+    list_display = ('created_at', 'method', 'path', 'status_code', 'duration_ms', 'query_count', 'query_ms', 'trigger')
+    list_filter = ('trigger', 'method', 'view_name')
+    search_fields = ('path',)
+    exclude = ('queries', 'report', 'stats')
+    readonly_fields = (
+        'created_at', 'method', 'path', 'view_name', 'status_code', 'trigger', 'duration_ms',
+        'query_count', 'query_ms', 'query_list', 'report_text',
+    )
+
+    def has_add_permission(self, request):
+        return False  # Only written by the profiling middleware
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    @admin.display(description='Queries')
+    def query_list(self, obj):
+        return format_html(
+            '<pre>{}</pre>',
+            format_html_join('\n', '{} ms [{}] {}', ((ms, alias, sql) for alias, sql, ms in obj.queries)),
+        )
+
+    @admin.display(description='Report')
+    def report_text(self, obj):
+        return format_html('<pre>{}</pre>', obj.report)
+
 # Register your models here
 admin.site.register(User, CustomUserAdmin)  # Use CustomUserAdmin for User model
 admin.site.register(File)
 admin.site.register(VerificationToken)
+admin.site.register(OutgoingEmail)
+admin.site.register(MaintenanceCursor)
+admin.site.register(ProfilingSwitch, ProfilingSwitchAdmin)
+admin.site.register(RequestProfile, RequestProfileAdmin)
+admin.site.register(StorageQuota, StorageQuotaAdmin)
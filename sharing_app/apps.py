@@ -4,3 +4,15 @@ from django.apps import AppConfig
 class SharingAppConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'sharing_app'
+
+    def ready(self):
+        from django.core import checks
+        from django.db.backends.signals import connection_created
+        from django.db.models.signals import post_migrate
+
+        from . import signals  # noqa: F401 - registers signal handlers
+        from .metrics import install_query_counter
+        from .search import check_search_backend, create_search_table
+        connection_created.connect(install_query_counter)
+        post_migrate.connect(create_search_table, sender=self)
+        checks.register(check_search_backend)
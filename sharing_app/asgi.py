@@ -0,0 +1,81 @@
+"""
+ASGI handler that lets chosen views read the request body while it is still arriving.
+
+Django's ASGIHandler receives the whole body into a temporary file before the view runs, so an
+upload could only be refused once the client had sent all of it. For views that set
+`stream_request_body = True`, StreamingBodyASGIHandler gives the request a body that pulls
+`http.request` messages from the server as the parser reads it. Parsing is sync code running in
+a thread (sync_to_async), and each read waits on the event loop for the next message. A view
+that answers early leaves the rest unread, and the server discards it.
+
+Such a body can only be read from a thread, never on the event loop itself, so async middleware
+must not touch request.POST or request.body on these paths.
+"""
+import asyncio
+import io
+
+from asgiref.sync import async_to_sync
+from django.core.handlers.asgi import ASGIHandler
+from django.http import UnreadablePostError
+from django.urls import Resolver404, resolve
+
+
+class ReceivedBody(io.RawIOBase):
+    """
+    Request body read from the ASGI `receive` callable on demand.
+    """
+    def __init__(self, receive):
+        self.receive = receive
+        self.pending = b''
+        self.more_body = True
+        self.complete = asyncio.Event()  # Set once the last body message has arrived
+
+    def readable(self):
+        return True
+
+    async def next_chunk(self):
+        message = await self.receive()
+        if message['type'] == 'http.disconnect':
+            raise UnreadablePostError("Client disconnected while sending the request body.")
+        self.more_body = message.get('more_body', False)
+        if not self.more_body:
+            self.complete.set()
+        return message.get('body', b'')
+
+    def readinto(self, buffer):
+        while not self.pending and self.more_body:
+            self.pending = async_to_sync(self.next_chunk)()
+        size = min(len(buffer), len(self.pending))
+        buffer[:size] = self.pending[:size]
+        self.pending = self.pending[size:]
+        return size
+
+
+class StreamingBodyASGIHandler(ASGIHandler):
+    def streams_body(self, scope):
+        path = scope['path']
+        root_path = scope.get('root_path', '')
+        if root_path and path.startswith(root_path):
+            path = path[len(root_path):]
+        try:
+            view = resolve(path).func
+        except Resolver404:
+            return False
+        return getattr(getattr(view, 'view_class', None), 'stream_request_body', False)
+
+    async def handle(self, scope, receive, send):
+        if self.streams_body(scope):
+            receive = ReceivedBody(receive)
+        await super().handle(scope, receive, send)
+
+    async def read_body(self, receive):
+        if isinstance(receive, ReceivedBody):
+            return receive  # Read by the view, as it arrives
+        return await super().read_body(receive)
+
+    async def listen_for_disconnect(self, receive):
+        if isinstance(receive, ReceivedBody):
+            # Messages belong to the body until its last one has arrived
+            await receive.complete.wait()
+            receive = receive.receive
+        await super().listen_for_disconnect(receive)
@@ -0,0 +1,101 @@
+"""
+Native async versions of the upload and download endpoints for deployments served over ASGI
+(e.g. `uvicorn file_sharing_system.asgi:application`).
+
+A slow client on these views holds a coroutine rather than a worker thread. Downloads stream one
+block at a time through an async iterator, and the next block is read only after the previous
+one was sent. The upload view sets `stream_request_body`, so under StreamingBodyASGIHandler (see
+file_sharing_system/asgi.py) its body is parsed as it arrives: UploadGuardHandler refuses an
+upload from its Content-Length, file name or first bytes without receiving the rest.
+
+Authentication, permissions, throttling and error responses are DRF's, as on the sync views. They
+run in a thread, as does anything that reads the body. Lookups use the async ORM. Saving an
+upload still runs in a thread because blob deduplication needs a transaction, which the async
+ORM does not provide.
+"""
+from asgiref.sync import sync_to_async
+from django.utils import timezone
+from rest_framework import permissions, status
+from rest_framework.parsers import MultiPartParser
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from .delivery import decode_download_link, serve_file
+from .models import File
+from .serializers import FileUploadSerializer
+from .throttling import ScopedBucketThrottle, bandwidth_bucket
+from .tokens import ClaimsJWTAuthentication
+from .uploadhandlers import guard_upload
+from .views import IsOpsUser, upload_response_data
+
+
+class AsyncAPIView(APIView):
+    """
+    APIView whose handlers are coroutines. `initial` (authentication, permissions, throttles) and
+    exception handling are DRF's own, and the handler is awaited in between.
+    """
+    authentication_classes = [ClaimsJWTAuthentication]  # User type and verification come from the token
+    permission_classes = [permissions.IsAuthenticated]
+
+    async def dispatch(self, request, *args, **kwargs):
+        self.args = args
+        self.kwargs = kwargs
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        self.headers = self.default_response_headers
+        try:
+            await sync_to_async(self.initial)(request, *args, **kwargs)
+            handler = getattr(self, request.method.lower(), None)
+            if request.method.lower() not in self.http_method_names or handler is None:
+                handler = self.http_method_not_allowed
+            response = handler(request, *args, **kwargs)
+            if hasattr(response, '__await__'):
+                response = await response
+        except Exception as exc:
+            response = self.handle_exception(exc)
+        self.response = self.finalize_response(request, response, *args, **kwargs)
+        return self.response
+
+
+class AsyncFileUploadView(AsyncAPIView):
+    permission_classes = [permissions.IsAuthenticated, IsOpsUser]
+    parser_classes = [MultiPartParser]
+    http_method_names = ['post', 'options']
+    stream_request_body = True  # Parsed as it arrives under StreamingBodyASGIHandler
+
+    async def post(self, request):
+        # Parsing reads the body in chunks through the upload handlers, which check and hash it on the way
+        await sync_to_async(guard_upload)(request, request.user.id)
+        serializer = FileUploadSerializer(data={'file': (await sync_to_async(lambda: request.FILES)()).get('file')})
+        await sync_to_async(serializer.is_valid)(raise_exception=True)
+        file_instance = await sync_to_async(serializer.save)(uploaded_by_id=request.user.id)
+        return Response(upload_response_data(file_instance, request.user), status=status.HTTP_201_CREATED)
+
+
+class AsyncFileDownloadView(AsyncAPIView):
+    throttle_classes = [ScopedBucketThrottle]
+    throttle_scope = 'download'
+    http_method_names = ['get', 'options']
+
+    async def get(self, request, signed_url):
+        try:
+            data = decode_download_link(signed_url)
+            expiry_time, file_id = data['expiry_time'], data['file_id']
+        except (ValueError, KeyError):
+            return Response({"error": "Invalid download link."}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Check if the URL has expired
+        if timezone.now().timestamp() > expiry_time:
+            return Response({"error": "The download link has expired."}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Only allow verified client users to access the file
+        if request.user.user_type != 'client_user' or not request.user.is_verified:
+            return Response({"error": "Unauthorized access."}, status=status.HTTP_403_FORBIDDEN)
+
+        try:
+            instance = await File.objects.aget(pk=file_id)
+        except File.DoesNotExist:
+            return Response({"error": "File not found."}, status=status.HTTP_404_NOT_FOUND)
+
+        # Stat and open in a thread; the body is an async iterator
+        return await sync_to_async(serve_file)(request, instance, asynchronous=True, bandwidth=bandwidth_bucket(request.user))
@@ -0,0 +1,312 @@
+"""
+Sends the bytes of a download through the cheapest path available.
+
+`FILE_DELIVERY_BACKEND` picks the strategy once auth and link checks have passed:
+
+    'direct'            Django returns a FileResponse over the open file. WSGI servers that provide
+                        `wsgi.file_wrapper` (gunicorn, uWSGI, mod_wsgi) send it with os.sendfile,
+                        so the bytes never pass through Python.
+    'x-accel-redirect'  nginx. The response only carries headers; nginx serves the file from the
+                        internal location `FILE_DELIVERY_INTERNAL_PREFIX`, aliased to MEDIA_ROOT.
+    'x-sendfile'        Apache (mod_xsendfile) and lighttpd. The header carries the absolute path.
+    'redirect'          Object storage. A 302 to a presigned URL that expires after
+                        FILE_DELIVERY_URL_EXPIRY seconds; the client fetches the bytes from the
+                        store directly.
+
+Header-only responses can be checked with the Django test client; no proxy is needed.
+
+In 'direct' mode Django also answers conditional requests (ETag / Last-Modified, 304) and byte
+ranges (206, including multipart/byteranges). Each range is read starting at its offset. The
+front-end servers handle both natively for the offloaded modes.
+
+Async views pass `asynchronous=True` to get bodies as async iterators. Each block is read in a
+worker thread and the next read only starts after the previous block was sent, so a slow client
+holds one block of memory and no thread.
+
+Views pass `bandwidth`, the user's bucket from `throttling.bandwidth_bucket`, to cap the
+transfer rate. In 'direct' mode the body then streams through Python, paced block by block,
+instead of going out with sendfile. nginx is told the cap with X-Accel-Limit-Rate, which nginx
+applies to each connection.
+"""
+import asyncio
+import base64
+import json
+import mimetypes
+import os
+import re
+import time
+import uuid
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.http import FileResponse, HttpResponse, HttpResponseRedirect, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import content_disposition_header, http_date, parse_http_date_safe
+
+from . import metrics
+from .throttling import apaced, paced
+
+DIRECT = 'direct'
+X_ACCEL_REDIRECT = 'x-accel-redirect'
+X_SENDFILE = 'x-sendfile'
+REDIRECT = 'redirect'
+
+RANGE_RE = re.compile(r'^\s*(\d*)\s*-\s*(\d*)\s*$')
+MAX_RANGES = 16  # More ranges than this is treated as abuse and answered with the full file
+BLOCK_SIZE = 64 * 1024
+
+
+def download_name(file_instance):
+    # Name offered to the client; storage names are content digests
+    return file_instance.original_name or os.path.basename(file_instance.file.name)
+
+
+def decode_download_link(signed_url):
+    # Payload written by FileDownloadView.post; raises ValueError for anything malformed
+    data = json.loads(base64.urlsafe_b64decode(signed_url).decode())
+    if not isinstance(data, dict):
+        raise ValueError("Download link payload must be an object.")
+    return data
+
+
+def serve_file(request, file_instance, asynchronous=False, bandwidth=None):
+    backend = settings.FILE_DELIVERY_BACKEND
+    filename = download_name(file_instance)
+    metrics.inc('downloads_total', backend=backend)
+
+    if backend == DIRECT:
+        return direct_response(request, file_instance, filename, asynchronous, bandwidth)
+
+    if backend == X_ACCEL_REDIRECT:
+        response = offload_response(filename)
+        response['X-Accel-Redirect'] = quote(settings.FILE_DELIVERY_INTERNAL_PREFIX + file_instance.file.name)
+        if bandwidth is not None:
+            response['X-Accel-Limit-Rate'] = str(bandwidth.rate)
+        return response
+
+    if backend == X_SENDFILE:
+        response = offload_response(filename)
+        response['X-Sendfile'] = file_instance.file.path
+        return response
+
+    if backend == REDIRECT:
+        storage = file_instance.file.storage
+        if not hasattr(storage, 'presigned_url'):
+            raise ImproperlyConfigured("FILE_DELIVERY_BACKEND 'redirect' needs a storage that can presign URLs.")
+        url = storage.presigned_url(file_instance.file.name, expire=settings.FILE_DELIVERY_URL_EXPIRY, filename=filename)
+        response = HttpResponseRedirect(url)
+        response['Cache-Control'] = 'private, no-store'  # The URL is a short-lived credential
+        return response
+
+    raise ImproperlyConfigured(f"Unknown FILE_DELIVERY_BACKEND '{backend}'.")
+
+
+class MeteredFileResponse(FileResponse):
+    """
+    FileResponse that records the download when the server closes it. With sendfile the bytes
+    never pass through Python, so the transfer is timed from creation to close.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.started = time.perf_counter()
+        self.recorded = False
+
+    def close(self):
+        super().close()
+        if not self.recorded:
+            self.recorded = True
+            metrics.record_download(int(self.get('Content-Length', 0)), time.perf_counter() - self.started)
+
+
+def offload_response(filename):
+    # Empty response whose headers tell the front-end server what to send
+    content_type, encoding = mimetypes.guess_type(filename)
+    response = HttpResponse(content_type=content_type or 'application/octet-stream')
+    response['Content-Disposition'] = content_disposition_header(True, filename)
+    del response['Content-Length']  # Filled in by the front-end server from the real file
+    return response
+
+
+def direct_response(request, file_instance, filename, asynchronous=False, bandwidth=None):
+    storage = file_instance.file.storage
+    name = file_instance.file.name
+    # Recorded at upload; rows that predate the metadata columns fall back to a stat
+    size = file_instance.size if file_instance.size is not None else storage.size(name)
+    last_modified = int((file_instance.storage_mtime or storage.get_modified_time(name)).timestamp())
+
+    # Validators shared by every response for this file, including 304s
+    validators = HttpResponse()
+    validators['ETag'] = file_etag(file_instance, size, last_modified)
+    validators['Last-Modified'] = http_date(last_modified)
+    validators['Accept-Ranges'] = 'bytes'
+    conditional = get_conditional_response(
+        request, etag=validators['ETag'], last_modified=last_modified, response=validators
+    )
+    if conditional is not validators:
+        return conditional
+
+    ranges = None
+    if if_range_matches(request, validators['ETag'], last_modified):
+        ranges = parse_ranges(request.META.get('HTTP_RANGE', ''), size)
+
+    content_type = file_instance.content_type or mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    range_reader, multipart_reader, pace, meter = (
+        (aread_range, aread_multipart, apaced, metrics.ametered) if asynchronous
+        else (read_range, read_multipart, paced, metrics.metered)
+    )
+
+    def body(blocks):
+        return meter(blocks if bandwidth is None else pace(blocks, bandwidth))
+
+    if ranges is None and (asynchronous or bandwidth is not None):
+        # Streamed block by block: sendfile can be neither awaited nor paced
+        response = StreamingHttpResponse(body(range_reader(storage.open(name, 'rb'), 0, size - 1)), content_type=content_type)
+        response['Content-Length'] = str(size)
+        response['Content-Disposition'] = content_disposition_header(True, filename)
+    elif ranges is None:
+        response = MeteredFileResponse(storage.open(name, 'rb'), as_attachment=True, filename=filename)
+    elif not ranges:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+    elif len(ranges) == 1:
+        start, end = ranges[0]
+        response = StreamingHttpResponse(body(range_reader(storage.open(name, 'rb'), start, end)), status=206, content_type=content_type)
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+        response['Content-Length'] = str(end - start + 1)
+    else:
+        boundary = uuid.uuid4().hex
+        parts = [(part_header(boundary, content_type, start, end, size), start, end) for start, end in ranges]
+        closing = f'--{boundary}--\r\n'.encode()
+        response = StreamingHttpResponse(
+            body(multipart_reader(storage.open(name, 'rb'), parts, closing)), status=206,
+            content_type=f'multipart/byteranges; boundary={boundary}',
+        )
+        response['Content-Length'] = str(
+            sum(len(header) + end - start + 1 + 2 for header, start, end in parts) + len(closing)
+        )
+
+    if response.status_code == 206:
+        response['Content-Disposition'] = content_disposition_header(True, filename)
+    for header in ('ETag', 'Last-Modified', 'Accept-Ranges'):
+        response[header] = validators[header]
+    return response
+
+
+def file_etag(file_instance, size, last_modified):
+    # Strong validator: changes whenever the row, the length or the stored bytes' mtime changes
+    return f'"{file_instance.pk:x}-{size:x}-{last_modified:x}"'
+
+
+def if_range_matches(request, etag, last_modified):
+    # A Range is only honoured if the client's copy is still current (RFC 9110 13.1.5)
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if not if_range:
+        return True
+    if if_range.startswith('"'):
+        return if_range == etag
+    return parse_http_date_safe(if_range) == last_modified
+
+
+def parse_ranges(header, size):
+    """
+    Parses a `Range: bytes=...` header into sorted, merged (start, end) pairs with inclusive ends.
+    Returns None when the header is absent or malformed (serve the whole file) and [] when no
+    range can be satisfied (416).
+    """
+    units, _, spec = header.partition('=')
+    if units.strip().lower() != 'bytes' or not spec:
+        return None
+
+    ranges = []
+    for part in spec.split(','):
+        match = RANGE_RE.match(part)
+        if not match or match.groups() == ('', ''):
+            return None
+        first, last = match.groups()
+        if not first:
+            # Suffix range: the last N bytes
+            start, end = max(size - int(last), 0), size - 1
+        elif last and int(last) < int(first):
+            return None
+        else:
+            start, end = int(first), min(int(last), size - 1) if last else size - 1
+        if start <= end:
+            ranges.append((start, end))  # Ranges starting past the end cannot be satisfied
+
+    if len(ranges) > MAX_RANGES:
+        return None
+
+    # Merge overlapping or adjacent ranges so no byte is sent twice
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def copy_range(content, start, end):
+    # Seek straight to the range rather than reading through the prefix
+    content.seek(start)
+    remaining = end - start + 1
+    while remaining > 0:
+        block = content.read(min(BLOCK_SIZE, remaining))
+        if not block:
+            break
+        remaining -= len(block)
+        yield block
+
+
+def read_range(content, start, end):
+    with content:
+        yield from copy_range(content, start, end)
+
+
+def part_header(boundary, content_type, start, end, size):
+    return (
+        f'--{boundary}\r\nContent-Type: {content_type}\r\n'
+        f'Content-Range: bytes {start}-{end}/{size}\r\n\r\n'
+    ).encode()
+
+
+def read_multipart(content, parts, closing):
+    with content:
+        for header, start, end in parts:
+            yield header
+            yield from copy_range(content, start, end)
+            yield b'\r\n'
+        yield closing
+
+
+async def acopy_range(content, start, end):
+    # Blocking file I/O runs in a worker thread, one block at a time
+    await asyncio.to_thread(content.seek, start)
+    remaining = end - start + 1
+    while remaining > 0:
+        block = await asyncio.to_thread(content.read, min(BLOCK_SIZE, remaining))
+        if not block:
+            break
+        remaining -= len(block)
+        yield block
+
+
+async def aread_range(content, start, end):
+    try:
+        async for block in acopy_range(content, start, end):
+            yield block
+    finally:
+        await asyncio.to_thread(content.close)
+
+
+async def aread_multipart(content, parts, closing):
+    try:
+        for header, start, end in parts:
+            yield header
+            async for block in acopy_range(content, start, end):
+                yield block
+            yield b'\r\n'
+        yield closing
+    finally:
+        await asyncio.to_thread(content.close)
@@ -0,0 +1,28 @@
+from rest_framework.exceptions import ValidationError
+from rest_framework.filters import BaseFilterBackend
+
+
+class FileMetadataFilter(BaseFilterBackend):
+    """
+    Narrows the file list by `type` (extensions, comma-separated) and by `min_size` / `max_size`
+    in bytes. Both use the metadata recorded at upload, so they are plain indexed lookups.
+    """
+    type_query_param = 'type'
+    size_query_params = {'min_size': 'size__gte', 'max_size': 'size__lte'}
+
+    def filter_queryset(self, request, queryset, view):
+        params = request.query_params
+        types = [value.strip().lstrip('.').lower() for value in params.get(self.type_query_param, '').split(',')]
+        types = [value for value in types if value]
+        if types:
+            queryset = queryset.filter(extension__in=types)
+
+        for param, lookup in self.size_query_params.items():
+            if param not in params:
+                continue
+            try:
+                size = int(params[param])
+            except ValueError:
+                raise ValidationError({param: "Must be a whole number of bytes."})
+            queryset = queryset.filter(**{lookup: size})
+        return queryset
@@ -0,0 +1,79 @@
+"""
+Caches FileListView responses per audience.
+
+Every verified client user sees the same list, so they share one audience; each ops user is an
+audience of their own. Each audience has a version counter that `File` signals bump. The version
+is part of every cache key and ETag, so invalidation is a single increment and stale pages simply
+age out. Works with any Django cache backend: locmem for a single process, a shared backend
+(Redis, Memcached) when several workers must agree.
+"""
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+CLIENT_AUDIENCE = 'client'
+
+
+def audience_for(user):
+    # Mirrors the visibility rules in FileQuerySet.visible_to
+    if user.user_type == 'ops_user':
+        return ops_audience(user.pk)
+    if user.user_type == 'client_user' and user.is_verified:
+        return CLIENT_AUDIENCE
+    return None
+
+
+def ops_audience(user_id):
+    return f'ops:{user_id}'
+
+
+def version_key(audience):
+    return f'files:version:{audience}'
+
+
+def get_version(audience):
+    key = version_key(audience)
+    version = cache.get(key)
+    if version is None:
+        # Seed from the clock so a counter lost to eviction never repeats an old ETag
+        cache.add(key, time.time_ns(), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def changed_key(audience):
+    return f'files:changed:{audience}'
+
+
+def bump_version(audience):
+    try:
+        cache.incr(version_key(audience))
+    except ValueError:
+        get_version(audience)  # Counter was evicted; reseeding moves it past every old value
+    # Replicas may not have the change yet; pages built meanwhile must read the primary
+    cache.set(changed_key(audience), True, settings.DATABASE_REPLICA_STICKINESS)
+
+
+def recently_changed(audience):
+    return cache.get(changed_key(audience)) is not None
+
+
+def page_key(audience, version, request):
+    # Page URLs embed the host, so it is part of the key along with the query string
+    digest = hashlib.md5(request.build_absolute_uri().encode()).hexdigest()
+    return f'files:page:{audience}:{version}:{digest}'
+
+
+def page_etag(audience, version, request):
+    digest = hashlib.md5(request.build_absolute_uri().encode()).hexdigest()[:12]
+    return f'"{audience}-{version}-{digest}"'
+
+
+def get_page(key):
+    return cache.get(key)
+
+
+def set_page(key, data):
+    cache.set(key, data, settings.FILE_LIST_CACHE_TIMEOUT)
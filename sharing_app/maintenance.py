@@ -0,0 +1,219 @@
+"""
+Housekeeping that nothing in the request path does.
+
+    tokens    Deletes expired VerificationToken rows, in batches, through the expiry_date index.
+    orphans   Purges Blob rows left without references, then scans storage for files that no
+              File or Blob row refers to and deletes them.
+    dangling  Scans File and Blob rows for ones whose stored bytes are missing, and reports them.
+
+Scans are incremental. Each run visits at most MAINTENANCE_SCAN_LIMIT names or rows, starting
+after the position saved in its MaintenanceCursor, and wraps around once a pass is complete.
+Every storage call and batch query first waits on a RateLimiter, so a run never competes with
+requests for disk or database time. With dry_run nothing is deleted and cursors do not move.
+
+Dangling rows are never deleted: dropping metadata because bytes went missing needs a person to
+decide, and a restore from backup may bring the bytes back.
+"""
+import logging
+import time
+
+from django.conf import settings
+from django.utils import timezone
+
+from .models import Blob, File, MaintenanceCursor, VerificationToken
+
+logger = logging.getLogger(__name__)
+
+TASKS = ('tokens', 'orphans', 'dangling')
+
+
+class RateLimiter:
+    """
+    Spaces operations so no more than `rate` happen per second. A rate of 0 means no limit.
+    """
+    def __init__(self, rate, clock=time.monotonic, sleep=time.sleep):
+        self.interval = 1 / rate if rate else 0
+        self.clock = clock
+        self.sleep = sleep
+        self.next_at = 0
+
+    def wait(self):
+        if not self.interval:
+            return
+        now = self.clock()
+        if self.next_at > now:
+            self.sleep(self.next_at - now)
+            now = self.next_at
+        self.next_at = now + self.interval
+
+
+def batched(iterable, size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def upload_root():
+    return File._meta.get_field('file').upload_to.rstrip('/')
+
+
+def walk_storage(storage, path, after=''):
+    """
+    Yields file names under `path` in lexicographic order, starting after `after`. Directories
+    that lie wholly before `after` are not listed at all.
+    """
+    try:
+        dirs, files = storage.listdir(path)
+    except FileNotFoundError:
+        return
+    # A directory sorts as "name/" so its contents fall where their full names belong
+    entries = sorted([(f'{path}/{name}/', True) for name in dirs] + [(f'{path}/{name}', False) for name in files])
+    for name, is_dir in entries:
+        if not is_dir:
+            if name > after:
+                yield name
+        elif name > after or after.startswith(name):
+            yield from walk_storage(storage, name.rstrip('/'), after)
+
+
+class Maintenance:
+    """
+    Runs the maintenance tasks and collects what they found in `report`.
+    """
+    def __init__(self, dry_run=False, rate=None, batch_size=None, scan_limit=None, grace=None):
+        self.dry_run = dry_run
+        self.limiter = RateLimiter(settings.MAINTENANCE_MAX_OPS_PER_SECOND if rate is None else rate)
+        self.batch_size = batch_size or settings.MAINTENANCE_BATCH_SIZE
+        self.scan_limit = scan_limit or settings.MAINTENANCE_SCAN_LIMIT
+        self.grace = settings.MAINTENANCE_ORPHAN_GRACE if grace is None else grace
+        self.storage = File._meta.get_field('file').storage
+        self.report = {
+            'expired_tokens': 0,
+            'orphaned_files': [],  # (name, size)
+            'dangling_files': [],  # File pks
+            'dangling_blobs': [],  # Blob pks
+        }
+
+    def run(self, tasks=TASKS):
+        for task in tasks:
+            getattr(self, f'run_{task}')()
+        return self.report
+
+    def run_tokens(self):
+        expired = VerificationToken.objects.filter(expiry_date__lt=timezone.now())
+        self.limiter.wait()
+        if self.dry_run:
+            self.report['expired_tokens'] += expired.count()
+            return
+
+        # Small keyed deletes keep each write transaction, and the lock it holds, short
+        while True:
+            self.limiter.wait()
+            pks = list(expired.order_by('expiry_date').values_list('pk', flat=True)[:self.batch_size])
+            if not pks:
+                break
+            self.report['expired_tokens'] += VerificationToken.objects.filter(pk__in=pks).delete()[0]
+
+    def run_orphans(self):
+        self.purge_released_blobs()
+        cursor = self.cursor('orphans')
+        cutoff = timezone.now() - self.grace
+        names = walk_storage(self.storage, upload_root(), cursor.position)
+        visited = 0
+        for batch in batched(names, self.batch_size):
+            self.limiter.wait()
+            referenced = set(File.objects.filter(file__in=batch).values_list('file', flat=True))
+            referenced |= set(Blob.objects.filter(file__in=batch).values_list('file', flat=True))
+            for name in batch:
+                if name not in referenced:
+                    self.check_orphan(name, cutoff)
+            visited += len(batch)
+            cursor.position = batch[-1]
+            if visited >= self.scan_limit:
+                break
+        self.advance(cursor, finished=visited < self.scan_limit)
+
+    def purge_released_blobs(self):
+        # Normally purged once their last release commits; this catches a process that exited first
+        self.limiter.wait()
+        released = list(Blob.objects.filter(ref_count__lte=0).order_by('pk').values_list('pk', 'file', 'size')[:self.batch_size])
+        for pk, name, size in released:
+            if self.dry_run:
+                self.report['orphaned_files'].append((name, size))
+                continue
+            self.limiter.wait()
+            if Blob.objects.purge(pk):
+                self.report['orphaned_files'].append((name, size))
+                logger.info("Purged released blob %s (%d bytes).", name, size)
+
+    def check_orphan(self, name, cutoff):
+        self.limiter.wait()
+        if self.is_young(name, cutoff):
+            return
+        try:
+            size = self.storage.size(name)
+        except FileNotFoundError:
+            return
+        if not self.dry_run:
+            self.limiter.wait()
+            # The batch was checked before the waits; an upload may have claimed or reused it since
+            if self.is_referenced(name) or self.is_young(name, cutoff):
+                return
+            self.storage.delete(name)
+            logger.info("Deleted orphaned file %s (%d bytes).", name, size)
+        self.report['orphaned_files'].append((name, size))
+
+    def is_young(self, name, cutoff):
+        # Bytes are written before their row commits; young files may belong to an upload in progress
+        try:
+            return self.storage.get_modified_time(name) > cutoff
+        except FileNotFoundError:
+            return True  # Already gone; nothing to delete
+
+    def is_referenced(self, name):
+        return File.objects.filter(file=name).exists() or Blob.objects.filter(file=name).exists()
+
+    def run_dangling(self):
+        self.scan_rows(File, 'dangling_files')
+        self.scan_rows(Blob, 'dangling_blobs')
+
+    def scan_rows(self, model, key):
+        cursor = self.cursor(key)
+        after = int(cursor.position or 0)
+        rows = model.objects.order_by('pk').values_list('pk', 'file')
+        visited = 0
+        while visited < self.scan_limit:
+            self.limiter.wait()
+            batch = list(rows.filter(pk__gt=after)[:min(self.batch_size, self.scan_limit - visited)])
+            if not batch:
+                break
+            exists = {}  # Rows sharing a blob share a name; check each once
+            for pk, name in batch:
+                if name not in exists:
+                    self.limiter.wait()
+                    exists[name] = self.storage.exists(name)
+                if not exists[name]:
+                    self.report[key].append(pk)
+                    logger.warning("%s %s points at missing file %s.", model.__name__, pk, name)
+            visited += len(batch)
+            after = batch[-1][0]
+        cursor.position = str(after)
+        self.advance(cursor, finished=visited < self.scan_limit)
+
+    def cursor(self, name):
+        # Not created until a real run saves it, so dry runs leave no trace
+        return MaintenanceCursor.objects.filter(name=name).first() or MaintenanceCursor(name=name)
+
+    def advance(self, cursor, finished):
+        # A pass that reached the end starts over next time
+        if self.dry_run:
+            return
+        if finished:
+            cursor.position = ''
+            cursor.passes += 1
+        cursor.save()
@@ -0,0 +1,65 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from sharing_app import listing_cache
+from sharing_app.models import File
+from sharing_app.signals import invalidate_listings
+from sharing_app.utils import name_metadata
+
+METADATA_FIELDS = ['original_name', 'size', 'content_type', 'extension', 'storage_mtime']
+
+
+class Command(BaseCommand):
+    help = "Record size, type and modification time for files stored before File carried them."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help="Rows fetched and updated per round trip.")
+        parser.add_argument('--workers', type=int, default=8, help="Threads statting storage concurrently.")
+
+    def handle(self, *args, **options):
+        pending = File.objects.filter(
+            Q(size__isnull=True) | Q(storage_mtime__isnull=True) | Q(extension='') | Q(content_type='')
+        ).order_by('pk')
+        updated = missing = 0
+        uploaders = set()
+        last_pk = 0
+
+        # Storage calls are I/O bound (and network round trips on remote storage), so overlap them
+        with ThreadPoolExecutor(max_workers=options['workers']) as pool:
+            while True:
+                batch = list(pending.filter(pk__gt=last_pk)[:options['batch_size']])
+                if not batch:
+                    break
+                last_pk = batch[-1].pk
+
+                changed = []
+                for file_instance, stat in zip(batch, pool.map(self.stat, batch)):
+                    if stat is None:
+                        self.stderr.write(f"File {file_instance.pk}: {file_instance.file.name} is missing from storage, skipped.")
+                        missing += 1
+                        continue
+                    file_instance.size, file_instance.storage_mtime = stat
+                    file_instance.original_name = file_instance.original_name or os.path.basename(file_instance.file.name)
+                    for field, value in name_metadata(file_instance.original_name).items():
+                        setattr(file_instance, field, value)
+                    changed.append(file_instance)
+                    uploaders.add(file_instance.uploaded_by_id)
+
+                File.objects.bulk_update(changed, METADATA_FIELDS)
+                updated += len(changed)
+
+        # bulk_update sends no signals, so drop cached listings here
+        if uploaders:
+            invalidate_listings(listing_cache.CLIENT_AUDIENCE, *(listing_cache.ops_audience(pk) for pk in uploaders))
+        self.stdout.write(f"Updated {updated} file(s), {missing} missing from storage.")
+
+    def stat(self, file_instance):
+        storage = file_instance.file.storage
+        name = file_instance.file.name
+        try:
+            return storage.size(name), storage.get_modified_time(name)
+        except FileNotFoundError:
+            return None
@@ -0,0 +1,65 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F
+
+from sharing_app.models import Blob, File
+from sharing_app.utils import file_digest
+
+
+class Command(BaseCommand):
+    help = "Backfill content digests for existing uploads and collapse identical files onto shared blobs."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help="Rows fetched per database round trip.")
+        parser.add_argument('--dry-run', action='store_true', help="Only report what would change.")
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        hashed = duplicates = missing = reclaimed = 0
+        seen = {}  # digest -> storage name, for dry runs where no Blob rows are written
+
+        for file_instance in File.objects.filter(sha256='').iterator(chunk_size=options['batch_size']):
+            storage = file_instance.file.storage
+            name = file_instance.file.name
+            try:
+                with storage.open(name, 'rb') as content:
+                    digest = file_digest(content)
+                    size = content.size
+            except FileNotFoundError:
+                self.stderr.write(f"File {file_instance.pk}: {name} is missing from storage, skipped.")
+                missing += 1
+                continue
+            hashed += 1
+
+            if dry_run:
+                if digest in seen and seen[digest] != name:
+                    duplicates += 1
+                    reclaimed += size
+                seen.setdefault(digest, Blob.objects.filter(sha256=digest).values_list('file', flat=True).first() or name)
+                continue
+
+            with transaction.atomic():
+                if Blob.objects.filter(sha256=digest).update(ref_count=F('ref_count') + 1):
+                    # Same content is already stored: point this row at it and drop its own copy
+                    blob = Blob.objects.get(sha256=digest)
+                    # The row now points at other bytes; clear their mtime so delivery re-stats them
+                    File.objects.filter(pk=file_instance.pk).update(file=blob.file.name, sha256=digest, storage_mtime=None)
+                    if blob.file.name != name:
+                        duplicates += 1
+                        reclaimed += size
+                        transaction.on_commit(lambda name=name: self.delete_if_unreferenced(storage, name))
+                else:
+                    # First copy of this content: adopt the existing file in place as the blob
+                    Blob.objects.create(sha256=digest, file=name, size=size, ref_count=1)
+                    File.objects.filter(pk=file_instance.pk).update(sha256=digest)
+
+        prefix = "Would reclaim" if dry_run else "Reclaimed"
+        self.stdout.write(
+            f"Hashed {hashed} file(s), {missing} missing. "
+            f"{prefix} {reclaimed} bytes from {duplicates} duplicate(s)."
+        )
+
+    def delete_if_unreferenced(self, storage, name):
+        # Legacy rows may have shared a path; keep the bytes while anything still points at them
+        if not File.objects.filter(file=name).exists() and not Blob.objects.filter(file=name).exists():
+            storage.delete(name)
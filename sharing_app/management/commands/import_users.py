@@ -0,0 +1,34 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from sharing_app.provisioning import parse_csv, parse_jsonl, provision_users
+
+
+class Command(BaseCommand):
+    help = "Create users in bulk from a CSV or JSON Lines file with username, email, password and user_type."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="CSV (with a header row) or JSON Lines file.")
+        parser.add_argument('--format', choices=['csv', 'jsonl'], help="Defaults to the file extension.")
+        parser.add_argument('--workers', type=int, help="Processes used to hash passwords (default BULK_PROVISIONING_HASH_WORKERS).")
+
+    def handle(self, *args, **options):
+        file_format = options['format'] or os.path.splitext(options['path'])[1].lstrip('.').lower()
+        parsers = {'csv': parse_csv, 'jsonl': parse_jsonl, 'ndjson': parse_jsonl}
+        if file_format not in parsers:
+            raise CommandError("Cannot tell the file format; pass --format csv or --format jsonl.")
+
+        try:
+            with open(options['path'], encoding='utf-8') as f:
+                rows = parsers[file_format](f.read())
+        except OSError as e:
+            raise CommandError(str(e))
+
+        created, errors = provision_users(rows, workers=options['workers'])
+
+        # Per-row errors are reported but never stop the rest of the batch
+        for number, row_errors in errors:
+            details = '; '.join(f"{field}: {' '.join(str(m) for m in messages)}" for field, messages in row_errors.items())
+            self.stderr.write(f"Row {number}: {details}")
+        self.stdout.write(f"Created {len(created)} user(s); {len(errors)} row(s) rejected.")
@@ -0,0 +1,37 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+
+from sharing_app.search import get_backend, index_batch, pending_files
+
+
+class Command(BaseCommand):
+    help = "Extract text from new or changed uploads into the full-text search index."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100, help="Files indexed per transaction.")
+        parser.add_argument('--workers', type=int, default=4, help="Threads extracting text concurrently.")
+        parser.add_argument('--loop', action='store_true', help="Keep polling for new uploads instead of exiting.")
+        parser.add_argument('--interval', type=float, default=30.0, help="Seconds to wait between polls when idle.")
+
+    def handle(self, *args, **options):
+        backend = get_backend()
+        indexed = failed = 0
+
+        with ThreadPoolExecutor(max_workers=options['workers']) as pool:
+            while True:
+                # Keyset over pk so files that keep failing are not fetched again in the same pass
+                last_pk = 0
+                while True:
+                    batch = list(pending_files().filter(pk__gt=last_pk).order_by('pk')[:options['batch_size']])
+                    if not batch:
+                        break
+                    last_pk = batch[-1].pk
+                    failed += index_batch(batch, backend, map=pool.map)
+                    indexed += len(batch)
+                if not options['loop']:
+                    break
+                time.sleep(options['interval'])
+
+        self.stdout.write(f"Indexed {indexed} file(s), {failed} could not be read.")
@@ -0,0 +1,45 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from sharing_app.maintenance import TASKS, Maintenance
+
+
+class Command(BaseCommand):
+    help = "Purge expired verification tokens, delete orphaned stored files and report rows whose files are missing."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--task', action='append', choices=TASKS, help="Run only this task (repeatable; default all).")
+        parser.add_argument('--dry-run', action='store_true', help="Only report; delete nothing and keep scan positions.")
+        parser.add_argument('--max-ops', type=float, help="Storage calls and batch queries per second (default MAINTENANCE_MAX_OPS_PER_SECOND, 0 for no limit).")
+        parser.add_argument('--batch-size', type=int, help="Rows or names per batch (default MAINTENANCE_BATCH_SIZE).")
+        parser.add_argument('--scan-limit', type=int, help="Names or rows each scan visits per run (default MAINTENANCE_SCAN_LIMIT).")
+        parser.add_argument('--loop', action='store_true', help="Keep running, once every --interval seconds.")
+        parser.add_argument('--interval', type=float, default=3600.0, help="Seconds between runs with --loop.")
+
+    def handle(self, *args, **options):
+        while True:
+            maintenance = Maintenance(
+                dry_run=options['dry_run'],
+                rate=options['max_ops'],
+                batch_size=options['batch_size'],
+                scan_limit=options['scan_limit'],
+            )
+            self.write_report(maintenance.run(options['task'] or TASKS), options)
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
+
+    def write_report(self, report, options):
+        prefix = "Would delete" if options['dry_run'] else "Deleted"
+        orphaned = report['orphaned_files']
+        if options['verbosity'] > 1:
+            for name, size in orphaned:
+                self.stdout.write(f"  orphaned: {name} ({size} bytes)")
+        self.stdout.write(
+            f"{prefix} {report['expired_tokens']} expired token(s) and {len(orphaned)} orphaned file(s) "
+            f"({sum(size for name, size in orphaned)} bytes)."
+        )
+        for key, label in (('dangling_files', 'File'), ('dangling_blobs', 'Blob')):
+            if report[key]:
+                self.stdout.write(f"{label} rows with missing data: {', '.join(map(str, report[key]))}")
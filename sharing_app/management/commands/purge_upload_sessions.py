@@ -0,0 +1,43 @@
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from sharing_app.models import UploadSession
+
+
+class Command(BaseCommand):
+    help = "Delete expired resumable upload sessions and any partial data left on disk."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help="Only report what would be deleted.")
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+
+        # Expired sessions, together with their partial data
+        expired = UploadSession.objects.filter(expires_at__lt=timezone.now())
+        sessions = 0
+        for session in expired.iterator():
+            if not dry_run:
+                session.discard()
+            sessions += 1
+
+        # Partial files whose session row is gone (e.g. the row was deleted with its user), and
+        # chunks left behind by a worker that died while receiving them
+        orphans = 0
+        if os.path.isdir(settings.UPLOAD_SESSION_DIR):
+            cutoff = time.time() - settings.UPLOAD_SESSION_LIFETIME.total_seconds()
+            known = {str(pk) for pk in UploadSession.objects.values_list('id', flat=True)}
+            for entry in os.scandir(settings.UPLOAD_SESSION_DIR):
+                session_id, ext = os.path.splitext(entry.name)
+                if ext not in ('.part', '.chunk') or session_id in known or entry.stat().st_mtime > cutoff:
+                    continue
+                if not dry_run:
+                    os.remove(entry.path)
+                orphans += 1
+
+        prefix = "Would delete" if dry_run else "Deleted"
+        self.stdout.write(f"{prefix} {sessions} expired session(s) and {orphans} orphaned partial file(s).")
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from sharing_app.quotas import reconcile
+
+
+class Command(BaseCommand):
+    help = "Recount each user's stored bytes and files and fix usage counters that drifted."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, help="Users recounted per transaction (default STORAGE_QUOTA_RECONCILE_BATCH_SIZE).")
+        parser.add_argument('--dry-run', action='store_true', help="Report drift without fixing it.")
+
+    def handle(self, *args, **options):
+        corrected = reconcile(batch_size=options['batch_size'], dry_run=options['dry_run'])
+        if options['verbosity'] > 1:
+            for user_id, (used_before, count_before), (used_after, count_after) in corrected:
+                self.stdout.write(
+                    f"User {user_id}: {used_before} bytes in {count_before} file(s) -> {used_after} bytes in {count_after} file(s)"
+                )
+        verb = "Would correct" if options['dry_run'] else "Corrected"
+        self.stdout.write(f"{verb} {len(corrected)} user(s).")
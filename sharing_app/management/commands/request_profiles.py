@@ -0,0 +1,58 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from sharing_app.models import ProfilingSwitch, RequestProfile
+from sharing_app.profiling import make_token, publish_switch
+
+
+class Command(BaseCommand):
+    help = "List, show or export stored request profiles, or print a token that profiles a request."
+
+    def add_arguments(self, parser):
+        parser.add_argument('profile_id', nargs='?', type=int, help="Show this profile's report and queries.")
+        parser.add_argument('--limit', type=int, default=20, help="Profiles listed, newest first.")
+        parser.add_argument('--dump', metavar='PATH', help="Write the profile's pstats data to PATH (for pstats or snakeviz).")
+        parser.add_argument('--token', action='store_true', help="Print a value for the X-Profile-Token request header.")
+        parser.add_argument('--clear', action='store_true', help="Delete all stored profiles.")
+        parser.add_argument(
+            '--publish-switch', action='store_true', help="Publish the profiling switch to the cache again, e.g. after a flush."
+        )
+
+    def handle(self, *args, **options):
+        if options['token']:
+            self.stdout.write(make_token())
+        elif options['publish_switch']:
+            switch = ProfilingSwitch.objects.filter(pk=1).first()
+            publish_switch(switch)
+            self.stdout.write("Published the profiling switch." if switch else "No profiling switch saved; sampling is off.")
+        elif options['clear']:
+            deleted, _ = RequestProfile.objects.all().delete()
+            self.stdout.write(f"Deleted {deleted} profile(s).")
+        elif options['profile_id'] is not None:
+            self.show(options['profile_id'], options['dump'])
+        else:
+            for profile in RequestProfile.objects.order_by('-pk')[:options['limit']]:
+                self.stdout.write(
+                    f"{profile.pk:>6}  {profile.created_at:%Y-%m-%d %H:%M:%S}  {profile.status_code}  "
+                    f"{profile.duration_ms:8.1f} ms  {profile.query_count:4} queries  "
+                    f"{profile.method} {profile.path}  ({profile.trigger})"
+                )
+
+    def show(self, profile_id, dump):
+        try:
+            profile = RequestProfile.objects.get(pk=profile_id)
+        except RequestProfile.DoesNotExist:
+            raise CommandError(f"Profile {profile_id} does not exist (it may have been rotated out).")
+        if dump:
+            with open(dump, 'wb') as output:
+                output.write(profile.stats)
+            self.stdout.write(f"Wrote {dump}.")
+            return
+        self.stdout.write(
+            f"{profile.method} {profile.path} -> {profile.status_code} in {profile.duration_ms:.1f} ms, "
+            f"{profile.query_count} queries in {profile.query_ms:.1f} ms"
+        )
+        for alias, sql, ms in profile.queries:
+            self.stdout.write(f"  {ms:8.3f} ms  [{alias}] {sql}")
+        if profile.query_count > len(profile.queries):
+            self.stdout.write(f"  ... {profile.query_count - len(profile.queries)} more not kept")
+        self.stdout.write(profile.report)
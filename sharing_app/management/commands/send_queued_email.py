@@ -0,0 +1,33 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from sharing_app.outbox import OutboxWorker
+
+
+class Command(BaseCommand):
+    help = "Deliver queued email from the outbox in batches over one SMTP connection."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, help="Messages per batch (default EMAIL_OUTBOX_BATCH_SIZE).")
+        parser.add_argument('--loop', action='store_true', help="Keep polling instead of exiting when the outbox is empty.")
+        parser.add_argument('--interval', type=float, default=5.0, help="Seconds to wait between polls when idle.")
+
+    def handle(self, *args, **options):
+        worker = OutboxWorker(batch_size=options['batch_size'])
+        total_sent = total_failed = 0
+        try:
+            while True:
+                sent, failed = worker.run_batch()
+                total_sent += sent
+                total_failed += failed
+                if sent or failed:
+                    continue  # Drain the backlog before sleeping
+                if not options['loop']:
+                    break
+                worker.close()  # Do not hold an idle SMTP session while waiting
+                time.sleep(options['interval'])
+        finally:
+            worker.close()
+
+        self.stdout.write(f"Sent {total_sent} email(s), {total_failed} failed attempt(s).")
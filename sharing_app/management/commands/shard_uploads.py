@@ -0,0 +1,111 @@
+import os
+import shutil
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from sharing_app import listing_cache
+from sharing_app.maintenance import RateLimiter
+from sharing_app.models import Blob, File
+from sharing_app.signals import invalidate_listings
+
+
+class Command(BaseCommand):
+    help = "Move stored uploads into the sharded directory layout while the site keeps serving them."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=200, help="Files moved per transaction.")
+        parser.add_argument('--max-ops', type=float, default=100, help="Files moved per second at most (0 for no limit).")
+        parser.add_argument('--unlink-delay', type=float, default=5.0, help="Seconds old paths stay after commit, for requests already using them.")
+        parser.add_argument('--dry-run', action='store_true', help="Only report how many files would move.")
+
+    def handle(self, *args, **options):
+        self.storage = File._meta.get_field('file').storage
+        if not hasattr(self.storage, 'shard_name'):
+            raise CommandError("The uploads storage is not sharded; check STORAGES['uploads'].")
+        self.limiter = RateLimiter(options['max_ops'])
+        self.options = options
+        moved = missing = 0
+
+        # Blobs first; their File rows follow by digest. Then legacy rows that never got a blob.
+        for model, rows in (
+            (Blob, Blob.objects.order_by('pk').values_list('pk', 'file', 'sha256')),
+            (File, File.objects.filter(sha256='').order_by('pk').values_list('pk', 'file', 'sha256')),
+        ):
+            last_pk = 0
+            while True:
+                batch = list(rows.filter(pk__gt=last_pk)[:options['batch_size']])
+                if not batch:
+                    break
+                last_pk = batch[-1][0]
+                pending = [(pk, name, digest) for pk, name, digest in batch if self.storage.shard_name(name) != name]
+                batch_moved, batch_missing = self.move_batch(model, pending)
+                moved += batch_moved
+                missing += batch_missing
+
+        prefix = "Would move" if options['dry_run'] else "Moved"
+        self.stdout.write(f"{prefix} {moved} file(s) into sharded directories; {missing} missing from storage.")
+
+    def move_batch(self, model, pending):
+        if self.options['dry_run']:
+            return len(pending), 0
+
+        # 1. Give each file its new name alongside the old one
+        linked, missing = [], 0
+        for pk, name, digest in pending:
+            self.limiter.wait()
+            new_name = self.storage.shard_name(name)
+            try:
+                self.link(name, new_name)
+            except FileNotFoundError:
+                self.stderr.write(f"{model.__name__} {pk}: {name} is missing from storage, skipped.")
+                missing += 1
+                continue
+            linked.append((pk, name, new_name, digest))
+        if not linked:
+            return 0, missing
+
+        # 2. Point the rows at the new names; readers see either the old or the new name, and both work
+        uploaders = set()
+        with transaction.atomic():
+            for pk, name, new_name, digest in linked:
+                if model is Blob:
+                    Blob.objects.filter(pk=pk, file=name).update(file=new_name)
+                    files = File.objects.filter(sha256=digest, file=name)  # Uses the sha256 index
+                else:
+                    files = File.objects.filter(pk=pk, file=name)
+                uploaders.update(files.values_list('uploaded_by_id', flat=True))
+                files.update(file=new_name)
+        # update() sends no signals; listings embed file URLs
+        invalidate_listings(listing_cache.CLIENT_AUDIENCE, *(listing_cache.ops_audience(pk) for pk in uploaders))
+
+        # 3. Drop the old names once requests that looked them up before the commit have opened them
+        time.sleep(self.options['unlink_delay'])
+        for pk, name, new_name, digest in linked:
+            self.storage.delete(name)
+        return len(linked), missing
+
+    def link(self, name, new_name):
+        # A hard link moves nothing and keeps the inode, so mtimes and ETags stay the same
+        try:
+            source, target = self.storage.path(name), self.storage.path(new_name)
+        except NotImplementedError:
+            return self.copy(name, new_name)  # Object storage has no local paths
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        os.stat(source)  # Raises FileNotFoundError for rows whose bytes are gone
+        if os.path.exists(target):
+            return  # Linked by an earlier, interrupted run
+        try:
+            os.link(source, target)
+        except OSError:
+            shutil.copy2(source, target)  # Different file system, or no hard links
+
+    def copy(self, name, new_name):
+        # Through the storage API; the old name is deleted with the others after commit
+        if not self.storage.exists(name):
+            raise FileNotFoundError(name)
+        if self.storage.exists(new_name):
+            return  # Copied by an earlier, interrupted run
+        with self.storage.open(name) as content:
+            self.storage.save(new_name, content)
@@ -0,0 +1,357 @@
+"""
+In-process counters and histograms, exposed on /metrics in the Prometheus text format.
+
+Recording is a dict update under a lock. Nothing is sent anywhere while a request is served.
+
+    MetricsMiddleware   Latency, database queries and query time for each request, labelled by
+                        URL name. Queries are counted by an execute wrapper on every connection.
+    Explicit spans      Storage writes, streamed downloads (bytes and bytes/s) and SMTP sends.
+
+Under several processes (gunicorn workers, the outbox worker), each process writes a snapshot
+of its registry to METRICS_DIR at most every METRICS_FLUSH_INTERVAL seconds, and when it exits.
+/metrics adds up every snapshot in the directory, so counters and histogram buckets are totals
+over all processes. On each scrape, the snapshots of processes that have exited are folded into
+one retired snapshot and removed, so totals never go backwards and the directory holds one file
+per live process plus that one. Without METRICS_DIR, /metrics shows only the process that
+serves it.
+"""
+import atexit
+import glob
+import json
+import logging
+import os
+import re
+import threading
+import time
+import uuid
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.files import locks
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+THROUGHPUT_BUCKETS = tuple(2 ** power for power in range(16, 31, 2))  # 64 KiB/s to 1 GiB/s
+SNAPSHOT_NAME_RE = re.compile(r'^metrics-(\d+)-[0-9a-f]+\.json(\.tmp)?$')
+RETIRED_NAME = 'metrics-retired.json'
+
+# name: (type, help, buckets)
+METRICS = {
+    'http_request_duration_seconds': ('histogram', "Time until the view returned its response.", LATENCY_BUCKETS),
+    'http_request_queries': ('histogram', "Database queries per request.", QUERY_BUCKETS),
+    'http_request_db_seconds': ('histogram', "Time spent in database queries per request.", LATENCY_BUCKETS),
+    'upload_bytes_total': ('counter', "Bytes received in uploaded files.", None),
+    'upload_throughput_bytes_per_second': ('histogram', "Upload size over the time to receive and store it.", THROUGHPUT_BUCKETS),
+    'downloads_total': ('counter', "Downloads answered, by delivery backend.", None),
+    'download_bytes_total': ('counter', "Bytes sent by Django for downloads and archives.", None),
+    'download_throughput_bytes_per_second': ('histogram', "Bytes sent over the time to send them.", THROUGHPUT_BUCKETS),
+    'storage_operation_duration_seconds': ('histogram', "Time spent in storage calls.", LATENCY_BUCKETS),
+    'email_send_duration_seconds': ('histogram', "Time for one SMTP send, by result.", LATENCY_BUCKETS),
+}
+
+
+class Registry:
+    """
+    One process's metrics. Histogram buckets are stored per bucket and made cumulative on output.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}  # (name, labels) -> value
+        self.histograms = {}  # (name, labels) -> [bucket counts, sum, count]
+        self.flushed_at = time.monotonic()
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        buckets = METRICS[name][2]
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = [[0] * len(buckets), 0, 0]
+            index = bisect_left(buckets, value)  # Buckets are upper bounds, inclusive
+            if index < len(buckets):
+                histogram[0][index] += 1
+            histogram[1] += value
+            histogram[2] += 1
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'counters': [[name, dict(labels), value] for (name, labels), value in self.counters.items()],
+                'histograms': [
+                    [name, dict(labels), list(counts), total, count]
+                    for (name, labels), (counts, total, count) in self.histograms.items()
+                ],
+            }
+
+
+class ProcessMetrics:
+    """
+    The registry of the current process, replaced after a fork so workers never share one.
+    """
+    def __init__(self):
+        self.pid = None
+        self.registry = None
+        self.path = None
+
+    def get(self):
+        if self.pid != os.getpid():
+            self.pid = os.getpid()
+            self.registry = Registry()
+            self.path = None
+            if settings.METRICS_DIR:
+                self.path = os.path.join(settings.METRICS_DIR, f'metrics-{self.pid}-{uuid.uuid4().hex[:8]}.json')
+                atexit.register(self.flush)
+        return self.registry
+
+    def maybe_flush(self):
+        if self.path and time.monotonic() - self.registry.flushed_at >= settings.METRICS_FLUSH_INTERVAL:
+            self.flush()
+
+    def flush(self):
+        if not self.path or self.pid != os.getpid():
+            return
+        self.registry.flushed_at = time.monotonic()
+        try:
+            write_snapshot(self.path, self.registry.snapshot())
+        except OSError as e:
+            logger.warning("Could not write metrics snapshot %s: %s", self.path, e)
+
+
+def write_snapshot(path, snapshot):
+    temporary = f'{path}.tmp'
+    with open(temporary, 'w') as output:
+        json.dump(snapshot, output)
+    os.replace(temporary, path)  # Readers never see a half-written snapshot
+
+
+def read_snapshot(path):
+    try:
+        with open(path) as snapshot:
+            return json.load(snapshot)
+    except (OSError, ValueError):
+        return None  # Removed or being replaced
+
+
+def process_exists(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass  # Alive, but owned by another user
+    return True
+
+
+def retire_dead_snapshots(directory):
+    """
+    Folds the snapshots of processes that have exited into the retired snapshot and removes them.
+    """
+    with open(os.path.join(directory, 'metrics-retired.lock'), 'a') as lock_file:
+        locks.lock(lock_file, locks.LOCK_EX)  # Concurrent scrapes would fold the same snapshot in twice
+        try:
+            dead = sorted(
+                entry.name for entry in os.scandir(directory)
+                if (match := SNAPSHOT_NAME_RE.match(entry.name)) and not process_exists(int(match[1]))
+            )
+            if not dead:
+                return
+            retired_path = os.path.join(directory, RETIRED_NAME)
+            retired = read_snapshot(retired_path) or {'counters': [], 'histograms': []}
+            # Names folded in by a scrape that stopped before removing them are not counted again
+            folded = set(retired.get('folded', ()))
+            snapshots = [
+                read_snapshot(os.path.join(directory, name)) for name in dead
+                if name not in folded and not name.endswith('.tmp')
+            ]
+            merged = merge([retired, *filter(None, snapshots)])
+            merged['folded'] = dead
+            write_snapshot(retired_path, merged)
+            for name in dead:
+                try:
+                    os.remove(os.path.join(directory, name))
+                except FileNotFoundError:
+                    pass
+        finally:
+            locks.unlock(lock_file)
+
+
+process_metrics = ProcessMetrics()
+
+
+def inc(name, value=1, **labels):
+    process_metrics.get().inc(name, value, **labels)
+    process_metrics.maybe_flush()
+
+
+def observe(name, value, **labels):
+    process_metrics.get().observe(name, value, **labels)
+    process_metrics.maybe_flush()
+
+
+@contextmanager
+def span(name, **labels):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - started, **labels)
+
+
+class RequestStats:
+    __slots__ = ('queries', 'db_seconds', 'upload_bytes')
+
+    def __init__(self):
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.upload_bytes = 0
+
+
+request_stats = ContextVar('request_stats', default=None)
+
+
+def count_queries(execute, sql, params, many, context):
+    # Installed on every connection; only requests being measured pay for the timing
+    stats = request_stats.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.queries += 1
+        stats.db_seconds += time.perf_counter() - started
+
+
+def install_query_counter(sender, connection, **kwargs):
+    # connection_created receiver; the wrapper list outlives reconnects, so add it once
+    if count_queries not in connection.execute_wrappers:
+        connection.execute_wrappers.append(count_queries)
+
+
+def record_upload(size):
+    inc('upload_bytes_total', size)
+    stats = request_stats.get()
+    if stats is not None:
+        stats.upload_bytes += size  # Turned into bytes/s once the request's duration is known
+
+
+def record_download(size, seconds):
+    inc('download_bytes_total', size)
+    if size and seconds > 0:
+        observe('download_throughput_bytes_per_second', size / seconds)
+
+
+def metered(blocks):
+    # Counts a streamed body from the first block to the end of the transfer
+    sent, started = 0, time.perf_counter()
+    try:
+        for block in blocks:
+            sent += len(block)
+            yield block
+    finally:
+        record_download(sent, time.perf_counter() - started)
+
+
+async def ametered(blocks):
+    sent, started = 0, time.perf_counter()
+    try:
+        async for block in blocks:
+            sent += len(block)
+            yield block
+    finally:
+        record_download(sent, time.perf_counter() - started)
+
+
+def collect():
+    """
+    Returns the snapshots to report: every process's under METRICS_DIR, or this process's.
+    """
+    registry = process_metrics.get()
+    if not settings.METRICS_DIR:
+        return [registry.snapshot()]
+    process_metrics.flush()
+    try:
+        retire_dead_snapshots(settings.METRICS_DIR)
+    except OSError as e:
+        logger.warning("Could not retire metrics snapshots in %s: %s", settings.METRICS_DIR, e)
+    snapshots = []
+    for path in glob.glob(os.path.join(settings.METRICS_DIR, 'metrics-*.json')):
+        snapshot = read_snapshot(path)
+        if snapshot is not None:  # Otherwise its totals return on the next scrape
+            snapshots.append(snapshot)
+    return snapshots
+
+
+def escape(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def format_labels(labels, **extra):
+    pairs = [*sorted(labels.items()), *extra.items()]
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{escape(value)}"' for name, value in pairs) + '}'
+
+
+def add_up(snapshots):
+    counters, histograms = {}, {}
+    for snapshot in snapshots:
+        for name, labels, value in snapshot['counters']:
+            key = (name, tuple(sorted(labels.items())))
+            counters[key] = counters.get(key, 0) + value
+        for name, labels, counts, total, count in snapshot['histograms']:
+            key = (name, tuple(sorted(labels.items())))
+            merged = histograms.setdefault(key, [[0] * len(counts), 0, 0])
+            merged[0] = [a + b for a, b in zip(merged[0], counts)]
+            merged[1] += total
+            merged[2] += count
+    return counters, histograms
+
+
+def merge(snapshots):
+    """
+    Adds up `snapshots` into one snapshot.
+    """
+    counters, histograms = add_up(snapshots)
+    return {
+        'counters': [[name, dict(labels), value] for (name, labels), value in counters.items()],
+        'histograms': [
+            [name, dict(labels), counts, total, count] for (name, labels), (counts, total, count) in histograms.items()
+        ],
+    }
+
+
+def render(snapshots):
+    """
+    Adds up `snapshots` and returns them in the Prometheus text exposition format.
+    """
+    counters, histograms = add_up(snapshots)
+    lines = []
+    for name, (kind, help_text, buckets) in METRICS.items():
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        if kind == 'counter':
+            for (key_name, labels), value in sorted(counters.items()):
+                if key_name == name:
+                    lines.append(f'{name}{format_labels(dict(labels))} {value}')
+            continue
+        for (key_name, labels), (counts, total, count) in sorted(histograms.items()):
+            if key_name != name:
+                continue
+            labels, cumulative = dict(labels), 0
+            for bound, bucket_count in zip(buckets, counts):
+                cumulative += bucket_count
+                lines.append(f'{name}_bucket{format_labels(labels, le=bound)} {cumulative}')
+            lines.append(f'{name}_bucket{format_labels(labels, le="+Inf")} {count}')
+            lines.append(f'{name}_sum{format_labels(labels)} {total}')
+            lines.append(f'{name}_count{format_labels(labels)} {count}')
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,123 @@
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+
+from . import metrics, profiling
+from .routers import RoutingState, routing_state
+
+
+class DatabaseRoutingMiddleware:
+    """
+    Gives PrimaryReplicaRouter the request it is routing for, so reads can go to replicas.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        state = RoutingState(request)
+        token = routing_state.set(state)
+        try:
+            response = self.get_response(request)
+            state.finish()
+            return response
+        finally:
+            routing_state.reset(token)
+
+    async def __acall__(self, request):
+        # sync_to_async copies the context, so views running in threads share this state
+        state = RoutingState(request)
+        token = routing_state.set(state)
+        try:
+            response = await self.get_response(request)
+            state.finish()
+            return response
+        finally:
+            routing_state.reset(token)
+
+
+class MetricsMiddleware:
+    """
+    Records each request's latency, query count and query time under its URL name. Streamed
+    bodies are timed separately, so latency ends when the response is handed to the server.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        stats = metrics.RequestStats()
+        token = metrics.request_stats.set(stats)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            metrics.request_stats.reset(token)
+        self.record(request, response, stats, time.perf_counter() - started)
+        return response
+
+    async def __acall__(self, request):
+        stats = metrics.RequestStats()
+        token = metrics.request_stats.set(stats)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            metrics.request_stats.reset(token)
+        self.record(request, response, stats, time.perf_counter() - started)
+        return response
+
+    def record(self, request, response, stats, seconds):
+        # URL names keep the label set small; anything that did not resolve is counted together
+        match = request.resolver_match
+        labels = {
+            'endpoint': match.view_name if match else 'unmatched',
+            'method': request.method,
+            'status': str(response.status_code),
+        }
+        metrics.observe('http_request_duration_seconds', seconds, **labels)
+        metrics.observe('http_request_queries', stats.queries, endpoint=labels['endpoint'])
+        metrics.observe('http_request_db_seconds', stats.db_seconds, endpoint=labels['endpoint'])
+        if stats.upload_bytes:
+            metrics.observe('upload_throughput_bytes_per_second', stats.upload_bytes / seconds)
+
+
+class ProfilingMiddleware:
+    """
+    Runs requests picked by sharing_app.profiling under cProfile and stores the profile.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.PROFILING_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        trigger = profiling.trigger_for(request)
+        if trigger is None:
+            return self.get_response(request)
+        return profiling.profile_request(request, self.get_response, trigger)
+
+    async def __acall__(self, request):
+        # Views run in other threads, out of cProfile's sight; see sharing_app.profiling
+        return await self.get_response(request)
@@ -1,10 +1,18 @@
+from django.conf import settings
 from django.contrib.auth.models import AbstractUser, Group, Permission
 from django.core.exceptions import ValidationError
-from django.db import models
+from django.db import IntegrityError, models, transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
 from django.utils import timezone
 from datetime import timedelta
+import os
 import uuid
 
+from . import metrics
+from .storage import uploads_storage
+from .utils import file_digest
+
 class User(AbstractUser):
     email = models.EmailField(unique=True)  # Ensure email is unique
     USER_TYPE_CHOICES = (
@@ -14,6 +22,7 @@ class User(AbstractUser):
     user_type = models.CharField(max_length=20, choices=USER_TYPE_CHOICES)  # User type
     is_verified = models.BooleanField(default=False)  # Email verification status
     username = models.CharField(max_length=150, unique=False)  # Allow non-unique usernames
+    upload_size_limit = models.PositiveBigIntegerField(null=True, blank=True)  # Largest upload in bytes; None for FILE_UPLOAD_MAX_SIZE
 
     USERNAME_FIELD = 'email'  # Set the USERNAME_FIELD to email
     REQUIRED_FIELDS = ['username']  # Add any other required fields
@@ -34,23 +43,335 @@ class User(AbstractUser):
         verbose_name='user permissions',
     )
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        if not instance.get_deferred_fields():
+            instance._loaded_token_state = instance.token_state()  # Compared on save to detect stale JWT claims
+        return instance
+
+    def token_state(self):
+        # Everything that issued tokens depend on; a change means they must be revoked
+        return (self.user_type, self.is_verified, self.is_active, self.password)
+
+    @staticmethod
+    def upload_size_limit_for(user_id):
+        # Request users are built from token claims, so the limit is looked up by id
+        limit = User.objects.filter(pk=user_id).values_list('upload_size_limit', flat=True).first()
+        return settings.FILE_UPLOAD_MAX_SIZE if limit is None else limit
+
+class BlobManager(models.Manager):
+    def acquire(self, content):
+        # Take a reference on the blob holding `content`, writing it to storage only if the digest is new
+        digest = getattr(content, 'sha256', None) or file_digest(content)
+        if self.filter(sha256=digest).update(ref_count=F('ref_count') + 1):
+            return self.get(sha256=digest)
+
+        extension = os.path.splitext(content.name)[1].lower()
+        blob = self.model(sha256=digest, size=content.size, ref_count=1)
+        with metrics.span('storage_operation_duration_seconds', operation='save'):
+            blob.file.save(f'{digest}{extension}', content, save=False)
+        try:
+            with transaction.atomic():
+                blob.save()
+        except IntegrityError:
+            # A concurrent upload stored the same content first; share theirs
+            self.filter(sha256=digest).update(ref_count=F('ref_count') + 1)
+            existing = self.get(sha256=digest)
+            if existing.file.name != blob.file.name:
+                blob.file.storage.delete(blob.file.name)
+            return existing
+        return blob
+
+    def release(self, digest):
+        # Drop a reference; once the last one is gone and that has committed, the blob is purged
+        self.filter(sha256=digest).update(ref_count=F('ref_count') - 1)
+        for pk in self.filter(sha256=digest, ref_count__lte=0).values_list('pk', flat=True):
+            transaction.on_commit(lambda pk=pk: self.purge(pk))
+
+    def purge(self, pk):
+        """
+        Deletes an unreferenced blob's row and then its stored bytes, in one transaction. Until it
+        commits, the row delete holds the lock that acquire()'s reference update needs, so an
+        upload of the same content waits and then writes the bytes afresh instead of reusing a
+        file that is about to go. Returns the purged blob, or None if it was referenced again.
+        """
+        with transaction.atomic():
+            blob = self.select_for_update().filter(pk=pk, ref_count__lte=0).first()
+            # Conditional, for databases without row locks: a reference taken meanwhile keeps the row
+            if blob is None or not self.filter(pk=pk, ref_count__lte=0).delete()[0]:
+                return None
+            blob.file.storage.delete(blob.file.name)
+        return blob
+
+class Blob(models.Model):
+    sha256 = models.CharField(max_length=64, unique=True)  # Digest of the content, used as its storage key
+    file = models.FileField(upload_to='uploads/', storage=uploads_storage)  # Single stored copy of the content
+    size = models.BigIntegerField()  # Content length in bytes
+    ref_count = models.PositiveIntegerField(default=0)  # Number of File rows sharing this content; 0 until purged
+
+    objects = BlobManager()
+
+class FileQuerySet(models.QuerySet):
+    def visible_to(self, user):
+        # The files a user may list, search or download a link for
+        if user.user_type == 'ops_user':
+            return self.filter(uploaded_by_id=user.id)  # Ops Users see their own files
+        if user.user_type == 'client_user' and user.is_verified:
+            return self.all()  # Verified Client Users see all files
+        return self.none()  # If conditions are not met, return no files
+
 class File(models.Model):
-    file = models.FileField(upload_to='uploads/')  # Store uploaded files
+    file = models.FileField(upload_to='uploads/', storage=uploads_storage)  # Store uploaded files
     uploaded_by = models.ForeignKey(User, on_delete=models.CASCADE)  # Link to User model
     upload_date = models.DateTimeField(default=timezone.now)  # Auto-set upload date
+    sha256 = models.CharField(max_length=64, blank=True, db_index=True)  # Content digest, shared with its Blob
+    original_name = models.CharField(max_length=255, blank=True)  # Name as uploaded; storage names are digests
+    size = models.BigIntegerField(null=True, blank=True)  # Content length in bytes; null until backfilled
+    content_type = models.CharField(max_length=100, blank=True)  # MIME type derived from the original name
+    extension = models.CharField(max_length=16, blank=True)  # Lower-case, without the dot, e.g. "docx"
+    storage_mtime = models.DateTimeField(null=True, blank=True)  # Modification time of the stored bytes
+
+    objects = FileQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Keyset pagination of the file list, newest first
+            models.Index(fields=['-upload_date', '-id'], name='file_upload_date_id_idx'),
+            models.Index(fields=['uploaded_by', '-upload_date', '-id'], name='file_uploader_date_id_idx'),
+            # Sorting by size (scanned in either direction) and filtering by type
+            models.Index(fields=['-size', '-id'], name='file_size_id_idx'),
+            models.Index(fields=['uploaded_by', '-size', '-id'], name='file_uploader_size_id_idx'),
+            models.Index(fields=['extension', '-upload_date', '-id'], name='file_extension_date_id_idx'),
+        ]
+
+class FileChangeQuerySet(models.QuerySet):
+    def visible_to(self, user):
+        # Changes to the files FileQuerySet.visible_to lets the user list
+        if user.user_type == 'ops_user':
+            return self.filter(uploader_id=user.id)
+        if user.user_type == 'client_user' and user.is_verified:
+            return self.all()
+        return self.none()
+
+    def sequence_pending(self):
+        """
+        Gives committed changes that have no seq yet the next numbers, after every numbered one.
+        The counter row stays locked until this commits, so each seq is visible before a higher
+        one can be handed out, and a client's cursor never passes a change it has not seen.
+        """
+        if not self.filter(seq__isnull=True).exists():
+            return 0
+        with transaction.atomic():
+            counter, _ = FileChangeSequence.objects.select_for_update().get_or_create(pk=1)
+            pending = list(self.filter(seq__isnull=True).order_by('id'))
+            for change in pending:
+                counter.last += 1
+                change.seq = counter.last
+            self.bulk_update(pending, ['seq'])
+            counter.save(update_fields=['last'])
+        return len(pending)
+
+class FileChange(models.Model):
+    """
+    One entry in the file change feed: a File was added or deleted. `seq` only grows in the order
+    changes become visible, so a client that remembers the last seq it saw can fetch just what
+    changed since.
+    """
+    ADDED = 'add'
+    DELETED = 'delete'
+
+    seq = models.BigIntegerField(null=True, unique=True)  # None until sequence_pending() numbers it, after commit
+    file_id = models.BigIntegerField()  # Not a foreign key; tombstones outlive their File
+    uploader_id = models.BigIntegerField()  # Copied from the File, for visibility
+    action = models.CharField(max_length=6, choices=[(ADDED, 'Added'), (DELETED, 'Deleted')])
+    created_at = models.DateTimeField(default=timezone.now)
+
+    objects = FileChangeQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # An Ops User's changes after a cursor; other users read a range of the seq index
+            models.Index(fields=['uploader_id', 'seq'], name='filechange_uploader_seq_idx'),
+        ]
+
+class FileChangeSequence(models.Model):
+    """
+    The last seq given to a FileChange. Only the row with pk 1 is used; locking it orders numbering.
+    """
+    last = models.BigIntegerField(default=0)
+
+class StorageQuotaManager(models.Manager):
+    def within_limit(self, size):
+        # Rows whose limit still has room for `size` more bytes
+        explicit = models.Q(limit_bytes__isnull=False, used_bytes__lte=F('limit_bytes') - size)
+        if settings.STORAGE_QUOTA_DEFAULT is None:
+            return explicit | models.Q(limit_bytes__isnull=True)
+        return explicit | models.Q(limit_bytes__isnull=True, used_bytes__lte=settings.STORAGE_QUOTA_DEFAULT - size)
+
+    def charge(self, user_id, size):
+        # Count a new file against the user's quota; returns False, changing nothing, if it does not fit.
+        # The limit is part of the UPDATE, so concurrent uploads cannot both take the last free bytes.
+        def add():
+            return self.filter(self.within_limit(size), user_id=user_id).update(
+                used_bytes=F('used_bytes') + size, file_count=F('file_count') + 1,
+            )
+        if add():
+            return True
+        if self.filter(user_id=user_id).exists():
+            return False
+        self.get_or_create(user_id=user_id)  # The user's first file
+        return bool(add())
+
+    def release(self, user_id, size):
+        # Clamped at zero, so a counter that drifted low cannot break deletes
+        self.filter(user_id=user_id).update(
+            used_bytes=Greatest(F('used_bytes') - size, 0), file_count=Greatest(F('file_count') - 1, 0),
+        )
+
+class StorageQuota(models.Model):
+    """
+    A user's running total of stored bytes, kept in step with their File rows so checking it never
+    needs a SUM over their files. See sharing_app.quotas.
+    """
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='storage_quota')
+    used_bytes = models.PositiveBigIntegerField(default=0)  # Sum of File.size over the user's files
+    file_count = models.PositiveIntegerField(default=0)
+    limit_bytes = models.PositiveBigIntegerField(null=True, blank=True)  # None for STORAGE_QUOTA_DEFAULT
+
+    objects = StorageQuotaManager()
+
+    def __str__(self):
+        return f"{self.user_id}: {self.used_bytes} bytes in {self.file_count} file(s)"
+
+
+class SearchIndexEntry(models.Model):
+    """
+    Records which content of a File is in the full-text index, so indexing only visits new or changed files.
+    """
+    file = models.OneToOneField(File, on_delete=models.CASCADE, primary_key=True, related_name='search_entry')
+    sha256 = models.CharField(max_length=64, blank=True)  # Digest of the content that was indexed
+    indexed_at = models.DateTimeField(default=timezone.now)
+    error = models.CharField(max_length=255, blank=True)  # Why text extraction failed, if it did
 
 class VerificationToken(models.Model):
+    LIFETIME = timedelta(hours=24)  # How long a token stays valid
+
     user = models.OneToOneField(User, on_delete=models.CASCADE)  # Link to User
     token = models.UUIDField(default=uuid.uuid4, unique=True, editable=False, db_index=True)  # Unique token
     created_at = models.DateTimeField(default=timezone.now)  # Token creation timestamp
-    expiry_date = models.DateTimeField()  # Expiry date for the token
+    expiry_date = models.DateTimeField(db_index=True)  # Expiry date for the token; indexed for purging
 
     def save(self, *args, **kwargs):
         if not self.id:
             # Set expiry date to 24 hours from creation
-            self.expiry_date = timezone.now() + timedelta(hours=24)
+            self.expiry_date = self.created_at + self.LIFETIME
         super().save(*args, **kwargs)
 
     def is_expired(self):
         # Check if the token has expired
         return timezone.now() > self.expiry_date
+
+class UploadSession(models.Model):
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)  # Opaque session id
+    uploaded_by = models.ForeignKey(User, on_delete=models.CASCADE)  # Owner of the upload
+    file_name = models.CharField(max_length=255)  # Name the finished file will carry
+    total_size = models.BigIntegerField(null=True, blank=True)  # Declared size, if the client knows it
+    offset = models.BigIntegerField(default=0)  # Bytes received so far
+    chunk_count = models.PositiveIntegerField(default=0)  # Chunks received so far
+    created_at = models.DateTimeField(default=timezone.now)  # Session creation timestamp
+    expires_at = models.DateTimeField(db_index=True)  # Unfinished sessions are purged after this
+
+    def save(self, *args, **kwargs):
+        if not self.expires_at:
+            self.touch(save=False)
+        super().save(*args, **kwargs)
+
+    def touch(self, save=True):
+        # Push the expiry forward while the client keeps sending chunks
+        self.expires_at = timezone.now() + settings.UPLOAD_SESSION_LIFETIME
+        if save:
+            self.save(update_fields=['expires_at'])
+
+    def is_expired(self):
+        return timezone.now() > self.expires_at
+
+    @property
+    def part_path(self):
+        # Partial data lives outside MEDIA_ROOT so it is never served
+        return os.path.join(settings.UPLOAD_SESSION_DIR, f'{self.id}.part')
+
+    def discard(self):
+        # Remove the partial data along with the session row
+        try:
+            os.remove(self.part_path)
+        except FileNotFoundError:
+            pass
+        self.delete()
+
+class OutgoingEmail(models.Model):
+    STATUS_CHOICES = (
+        ('pending', 'Pending'),
+        ('sent', 'Sent'),
+        ('failed', 'Failed'),
+    )
+    to = models.EmailField()  # Single recipient
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveIntegerField(default=0)  # Delivery attempts so far
+    next_attempt_at = models.DateTimeField(default=timezone.now)  # Not picked up by a worker before this
+    last_error = models.TextField(blank=True)  # Error from the most recent failed attempt
+    created_at = models.DateTimeField(default=timezone.now)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # Workers poll for pending mail that is due
+            models.Index(fields=['status', 'next_attempt_at'], name='outgoing_email_due_idx'),
+        ]
+
+
+class MaintenanceCursor(models.Model):
+    """
+    Where an incremental maintenance scan stopped, so the next run carries on from there.
+    """
+    name = models.CharField(max_length=50, primary_key=True)  # Which scan this cursor belongs to
+    position = models.TextField(blank=True)  # Last item processed; empty at the start of a pass
+    passes = models.PositiveIntegerField(default=0)  # Completed passes over everything
+    updated_at = models.DateTimeField(auto_now=True)
+
+
+class ProfilingSwitch(models.Model):
+    """
+    Admin toggle for sampled request profiling. Only the row with pk 1 is read.
+    """
+    enabled = models.BooleanField(default=False)
+    sample_rate = models.FloatField(default=0.01)  # Fraction of matching requests profiled, 0 to 1
+    path_prefix = models.CharField(max_length=255, blank=True)  # Only profile paths starting with this; empty for all
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        state = f"{self.sample_rate:.0%} of {self.path_prefix or 'all requests'}" if self.enabled else "off"
+        return f"Request profiling: {state}"
+
+
+class RequestProfile(models.Model):
+    """
+    One profiled request. The newest PROFILING_BUFFER_SIZE are kept; older rows are deleted.
+    """
+    created_at = models.DateTimeField(default=timezone.now)
+    method = models.CharField(max_length=10)
+    path = models.TextField()
+    view_name = models.CharField(max_length=255, blank=True)  # URL name, when the path resolved
+    status_code = models.PositiveIntegerField()
+    trigger = models.CharField(max_length=10)  # 'header' or 'sampled'
+    duration_ms = models.FloatField()
+    query_count = models.PositiveIntegerField()
+    query_ms = models.FloatField()
+    queries = models.JSONField(default=list)  # [[alias, sql, ms], ...], up to PROFILING_MAX_QUERIES
+    report = models.TextField()  # pstats output, by cumulative time
+    stats = models.BinaryField()  # Marshalled pstats data, loadable with pstats.Stats
+
+    def __str__(self):
+        return f"{self.method} {self.path} ({self.duration_ms:.0f} ms)"
@@ -0,0 +1,128 @@
+"""
+Database-backed outbox for transactional email.
+
+Requests only insert an `OutgoingEmail` row. The `send_queued_email` worker delivers due rows in
+batches over a single SMTP connection that stays open between messages and batches. Failed sends
+are retried with exponential backoff until EMAIL_OUTBOX_MAX_ATTEMPTS is reached.
+"""
+import logging
+import time
+from smtplib import SMTPException, SMTPServerDisconnected
+
+from django.conf import settings
+from django.core.mail import BadHeaderError, EmailMessage, get_connection
+from django.db import transaction
+from django.urls import reverse
+from django.utils import timezone
+
+from . import metrics
+from .models import OutgoingEmail
+
+logger = logging.getLogger(__name__)
+
+
+def build_verification_email(user, token):
+    # Construct the verification link
+    verification_link = f"{settings.BACKEND_URL}{reverse('email-verification', args=[token])}"
+
+    return OutgoingEmail(
+        to=user.email,
+        subject="Verify Your Email",
+        body=f"Click the link to verify your email: {verification_link}",
+    )
+
+
+def queue_verification_email(user, token):
+    # Signup only writes a row; it never waits on SMTP
+    build_verification_email(user, token).save()
+
+
+def claim_batch(batch_size):
+    # Lease due messages so concurrent workers skip them; rows locked by another worker are passed over
+    now = timezone.now()
+    with transaction.atomic():
+        batch = list(
+            OutgoingEmail.objects.select_for_update(skip_locked=True)
+            .filter(status='pending', next_attempt_at__lte=now)
+            .order_by('next_attempt_at', 'id')[:batch_size]
+        )
+        OutgoingEmail.objects.filter(pk__in=[email.pk for email in batch]).update(
+            next_attempt_at=now + settings.EMAIL_OUTBOX_LEASE
+        )
+    return batch
+
+
+def retry_delay(attempts):
+    # Exponential backoff, capped so a long outage does not park mail for days
+    delay = settings.EMAIL_OUTBOX_RETRY_DELAY * (2 ** (attempts - 1))
+    return min(delay, settings.EMAIL_OUTBOX_MAX_RETRY_DELAY)
+
+
+class OutboxWorker:
+    """
+    Delivers queued email over one persistent connection. Call `close()` when done.
+    """
+    def __init__(self, batch_size=None):
+        self.batch_size = batch_size or settings.EMAIL_OUTBOX_BATCH_SIZE
+        self.connection = get_connection()
+
+    def run_batch(self):
+        # Returns (sent, failed) for one batch of due messages
+        batch = claim_batch(self.batch_size)
+        if not batch:
+            return 0, 0
+
+        try:
+            self.connection.open()  # No-op while the connection is already open
+        except (SMTPException, OSError) as e:
+            # Server unreachable: every leased message counts an attempt and backs off, and the worker carries on
+            logger.error(f"Could not connect to the mail server: {str(e)}")
+            self.connection.close()
+            for email in batch:
+                email.attempts += 1
+                self.record_failure(email, e)
+            return 0, len(batch)
+
+        sent = failed = 0
+        for email in batch:
+            if self.deliver(email):
+                sent += 1
+            else:
+                failed += 1
+        return sent, failed
+
+    def deliver(self, email):
+        message = EmailMessage(email.subject, email.body, settings.EMAIL_HOST_USER, [email.to], connection=self.connection)
+        email.attempts += 1
+        started = time.perf_counter()
+        try:
+            try:
+                message.send()
+            except SMTPServerDisconnected:
+                # The server dropped the idle connection; reconnect once and retry
+                self.connection.close()
+                self.connection.open()
+                message.send()
+        except (BadHeaderError, SMTPException, OSError) as e:
+            metrics.observe('email_send_duration_seconds', time.perf_counter() - started, result='failed')
+            logger.error(f"Failed to send email {email.pk} to {email.to}: {str(e)}")
+            self.record_failure(email, e)
+            return False
+
+        metrics.observe('email_send_duration_seconds', time.perf_counter() - started, result='sent')
+        email.status = 'sent'
+        email.sent_at = timezone.now()
+        email.save(update_fields=['attempts', 'status', 'sent_at'])
+        return True
+
+    def record_failure(self, email, error):
+        # Retry later with backoff, or give up for good
+        email.last_error = str(error)
+        if isinstance(error, BadHeaderError) or email.attempts >= settings.EMAIL_OUTBOX_MAX_ATTEMPTS:
+            email.status = 'failed'
+        else:
+            email.next_attempt_at = timezone.now() + retry_delay(email.attempts)
+        email.save(update_fields=['attempts', 'status', 'next_attempt_at', 'last_error'])
+
+    def close(self):
+        self.connection.close()
@@ -0,0 +1,94 @@
+import base64
+import binascii
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.pagination import BasePagination
+from rest_framework.utils.urls import replace_query_param
+
+
+class FileCursorPagination(BasePagination):
+    """
+    Keyset pagination over (sort field, id), newest first unless `ordering` says otherwise. The
+    cursor records the last row returned, so every page is a single index range scan no matter
+    how deep the client pages.
+    """
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    ordering_query_param = 'ordering'
+    ordering_fields = {'upload_date': parse_datetime, 'size': int}  # Sortable field -> cursor value parser
+    default_ordering = '-upload_date'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        page_size = self.get_page_size(request)
+        self.field, descending = self.get_ordering(request)
+        position = self.decode_cursor(request)
+
+        if self.field == 'size':
+            queryset = queryset.filter(size__isnull=False)  # Rows not yet backfilled have no place in the order
+        prefix = '-' if descending else ''
+        queryset = queryset.order_by(prefix + self.field, prefix + 'id')
+        if position is not None:
+            value, pk = position
+            beyond = 'lt' if descending else 'gt'
+            queryset = queryset.filter(
+                Q(**{f'{self.field}__{beyond}': value}) | Q(**{self.field: value, f'id__{beyond}': pk}),
+                **{f'{self.field}__{beyond}e': value},  # Lets the database bound the index scan on the leading column
+            )
+
+        # Fetch one extra row to learn whether another page follows
+        results = list(queryset[:page_size + 1])
+        self.next_position = None
+        if len(results) > page_size:
+            results = results[:page_size]
+            self.next_position = self.position_of(results[-1])
+        return results
+
+    def get_ordering(self, request):
+        ordering = request.query_params.get(self.ordering_query_param) or self.default_ordering
+        field = ordering.lstrip('-')
+        if field not in self.ordering_fields:
+            raise ValidationError({self.ordering_query_param: f"Sort by one of: {', '.join(self.ordering_fields)}."})
+        return field, ordering.startswith('-')
+
+    def position_of(self, row):
+        # Rows may be model instances or `.values()` dicts
+        if isinstance(row, dict):
+            return row[self.field], row['id']
+        return getattr(row, self.field), row.pk
+
+    def get_page_size(self, request):
+        try:
+            requested = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return settings.FILE_LIST_PAGE_SIZE
+        return max(1, min(requested, settings.FILE_LIST_MAX_PAGE_SIZE))
+
+    def get_next_link(self):
+        if self.next_position is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.next_position))
+
+    def encode_cursor(self, position):
+        value, pk = position
+        value = value.isoformat() if hasattr(value, 'isoformat') else value
+        return base64.urlsafe_b64encode(f'{value}|{pk}'.encode()).decode()
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            value, pk = base64.urlsafe_b64decode(encoded.encode()).decode().split('|')
+            value = self.ordering_fields[self.field](value)
+            pk = int(pk)
+        except (binascii.Error, UnicodeDecodeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        if value is None:
+            raise NotFound(self.invalid_cursor_message)
+        return value, pk
@@ -0,0 +1,31 @@
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser
+
+from .provisioning import parse_csv, parse_jsonl
+
+
+class TextRowsParser(BaseParser):
+    """
+    Base for parsers that turn a text body into a list of row dicts.
+    """
+    def parse(self, stream, media_type=None, parser_context=None):
+        encoding = (parser_context or {}).get('encoding', 'utf-8')
+        try:
+            text = stream.read().decode(encoding) if stream is not None else ''
+        except UnicodeDecodeError as e:
+            raise ParseError(f"Body is not valid {encoding}: {e}")
+        return self.parse_rows(text)
+
+
+class CSVRowsParser(TextRowsParser):
+    media_type = 'text/csv'
+
+    def parse_rows(self, text):
+        return parse_csv(text)
+
+
+class JSONLinesParser(TextRowsParser):
+    media_type = 'application/x-ndjson'
+
+    def parse_rows(self, text):
+        return parse_jsonl(text)
@@ -0,0 +1,183 @@
+"""
+Opt-in profiling of single requests, for finding out why an endpoint is slow in production.
+
+A request is profiled when it carries a valid X-Profile-Token header (a signed, expiring token
+from `manage.py request_profiles --token`), or when it is sampled by the ProfilingSwitch an admin
+turns on in the Django admin. Everything below ProfilingMiddleware then runs under cProfile, and
+each SQL statement on every database alias is recorded with its duration. Streamed bodies are
+sent after the profile ends.
+
+Profiles are RequestProfile rows, kept as a ring buffer of the newest PROFILING_BUFFER_SIZE, and
+the response names its profile in an X-Profile-Id header. Read them in the admin or with
+`manage.py request_profiles`.
+
+A request that is not profiled costs a header lookup and a clock read, and never a query.
+Saving or deleting the switch publishes it to the cache once the save commits, and each process
+re-reads it from there at most every PROFILING_SWITCH_REFRESH seconds. A missing entry means
+sampling is off, so with several workers the cache has to be shared, and after a flush the
+switch is published again with `manage.py request_profiles --publish-switch`. With
+PROFILING_ENABLED off the middleware is not installed at all. cProfile only follows the thread
+that started it, so requests served through the async middleware chain (ASGI) are never
+profiled.
+"""
+import cProfile
+import io
+import logging
+import marshal
+import pstats
+import random
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core import signing
+from django.core.cache import cache
+from django.db import DatabaseError, connections, transaction
+
+from .models import RequestProfile
+
+logger = logging.getLogger(__name__)
+
+TOKEN_SALT = 'sharing_app.profiling'
+TOKEN_VALUE = 'profile'
+SWITCH_KEY = 'profiling:switch'
+
+
+def make_token():
+    return signing.TimestampSigner(salt=TOKEN_SALT).sign(TOKEN_VALUE)
+
+
+def valid_token(token):
+    try:
+        value = signing.TimestampSigner(salt=TOKEN_SALT).unsign(token, max_age=settings.PROFILING_TOKEN_MAX_AGE)
+    except signing.BadSignature:  # Also raised for expired tokens
+        return False
+    return value == TOKEN_VALUE
+
+
+def switch_values(switch):
+    # What is published for a ProfilingSwitch: (enabled, sample_rate, path_prefix)
+    return (switch.enabled, switch.sample_rate, switch.path_prefix)
+
+
+class SwitchState:
+    """
+    This process's copy of the published ProfilingSwitch, or None when none is published.
+    """
+    def __init__(self):
+        self.switch = None
+        self.checked_at = None
+
+    def reset(self):
+        self.checked_at = None
+
+    def sampled(self, request):
+        now = time.monotonic()
+        if self.checked_at is None or now - self.checked_at >= settings.PROFILING_SWITCH_REFRESH:
+            self.checked_at = now
+            self.switch = cache.get(SWITCH_KEY)
+        if self.switch is None:
+            return False
+        enabled, sample_rate, path_prefix = self.switch
+        return enabled and request.path.startswith(path_prefix) and random.random() < sample_rate
+
+
+switch_state = SwitchState()
+
+
+def publish_switch(switch):
+    # After commit, so a rolled-back save is never published. Applies at once in this process;
+    # others sharing the cache pick it up within PROFILING_SWITCH_REFRESH
+    values = None if switch is None else switch_values(switch)
+
+    def publish():
+        if values is None:
+            cache.delete(SWITCH_KEY)
+        else:
+            cache.set(SWITCH_KEY, values, None)
+        switch_state.reset()
+    transaction.on_commit(publish)
+
+
+def trigger_for(request):
+    """
+    Returns why `request` should be profiled, 'header' or 'sampled', or None.
+    """
+    token = request.headers.get('X-Profile-Token')
+    if token and valid_token(token):
+        return 'header'
+    if switch_state.sampled(request):
+        return 'sampled'
+    return None
+
+
+class QueryLog:
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.entries = []
+
+    def wrapper(self, alias):
+        def record(execute, sql, params, many, context):
+            started = time.perf_counter()
+            try:
+                return execute(sql, params, many, context)
+            finally:
+                elapsed = time.perf_counter() - started
+                self.count += 1
+                self.seconds += elapsed
+                if len(self.entries) < settings.PROFILING_MAX_QUERIES:
+                    self.entries.append([alias, sql, round(elapsed * 1000, 3)])
+        return record
+
+
+def profile_request(request, get_response, trigger):
+    profiler = cProfile.Profile()
+    log = QueryLog()
+    with ExitStack() as stack:
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(log.wrapper(connection.alias)))
+        try:
+            profiler.enable()
+        except ValueError:
+            # Another profiler (a debugger, or a profiled worker) already owns the hook
+            return get_response(request)
+        started = time.perf_counter()
+        try:
+            response = get_response(request)
+        finally:
+            profiler.disable()
+        seconds = time.perf_counter() - started
+
+    profile = save_profile(request, response, trigger, profiler, log, seconds)
+    if profile is not None:
+        response['X-Profile-Id'] = str(profile.pk)
+    return response
+
+
+def save_profile(request, response, trigger, profiler, log, seconds):
+    report = io.StringIO()
+    stats = pstats.Stats(profiler, stream=report)
+    stats.sort_stats('cumulative').print_stats(settings.PROFILING_REPORT_LINES)
+    match = request.resolver_match
+    try:
+        profile = RequestProfile.objects.create(
+            method=request.method,
+            path=request.path,
+            view_name=match.view_name if match else '',
+            status_code=response.status_code,
+            trigger=trigger,
+            duration_ms=seconds * 1000,
+            query_count=log.count,
+            query_ms=log.seconds * 1000,
+            queries=log.entries,
+            report=report.getvalue(),
+            stats=marshal.dumps(stats.stats),
+        )
+        # Keep the ring bounded; ids only grow, so everything this far back is older
+        RequestProfile.objects.filter(pk__lte=profile.pk - settings.PROFILING_BUFFER_SIZE).delete()
+    except DatabaseError as e:
+        logger.warning("Could not store the profile of %s %s: %s", request.method, request.path, e)
+        return None
+    logger.info("Profiled %s %s as profile %s (%s).", request.method, request.path, profile.pk, trigger)
+    return profile
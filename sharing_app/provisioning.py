@@ -0,0 +1,168 @@
+"""
+Creates users in bulk from CSV or JSON Lines rows.
+
+A batch costs a fixed number of queries however many rows it has. Existing emails are found with
+one set-based lookup, and users, verification tokens and outgoing emails go in with bulk_create.
+Password hashing is the only per-row CPU cost, so it is spread across a process pool.
+"""
+import csv
+import io
+import json
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .models import User, VerificationToken, OutgoingEmail
+from .outbox import build_verification_email
+from .serializers import UserSignupSerializer
+
+EXISTING_EMAIL_CHUNK = 1000  # Keeps the IN (...) list under every backend's parameter limit
+
+
+class BulkUserSerializer(UserSignupSerializer):
+    """
+    Per-row field validation only. Email uniqueness is checked once for the whole batch.
+    """
+    class Meta(UserSignupSerializer.Meta):
+        extra_kwargs = {
+            'password': {'write_only': True},
+            'email': {'validators': []},  # Drop the per-row UniqueValidator query
+        }
+
+    def validate(self, data):
+        return data
+
+
+def parse_csv(text):
+    return list(csv.DictReader(io.StringIO(text)))
+
+
+def parse_jsonl(text):
+    # Malformed lines become rows that fail validation rather than aborting the batch
+    rows = []
+    for line in text.splitlines():
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except json.JSONDecodeError as e:
+            row = {'__error__': f"Invalid JSON: {e.msg}"}
+        rows.append(row)
+    return rows
+
+
+def hash_passwords(passwords, workers=None):
+    # PBKDF2 dominates the cost of a batch, so large batches fan out over processes
+    workers = settings.BULK_PROVISIONING_HASH_WORKERS if workers is None else workers
+    if workers <= 1 or len(passwords) < settings.BULK_PROVISIONING_POOL_THRESHOLD:
+        return [make_password(password) for password in passwords]
+    chunksize = max(1, len(passwords) // (workers * 4))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(make_password, passwords, chunksize=chunksize))
+
+
+def email_chunks(emails):
+    emails = list(emails)
+    for start in range(0, len(emails), EXISTING_EMAIL_CHUNK):
+        yield emails[start:start + EXISTING_EMAIL_CHUNK]
+
+
+def existing_emails(emails):
+    found = set()
+    for chunk in email_chunks(emails):
+        found.update(User.objects.filter(email__in=chunk).values_list('email', flat=True))
+    return found
+
+
+def validate_rows(rows):
+    # Returns ({email: validated row}, [(row number, errors)]); row numbers start at 1
+    valid, errors = {}, []
+    for number, row in enumerate(rows, start=1):
+        if not isinstance(row, dict):
+            errors.append((number, {'non_field_errors': ["Each row must be an object."]}))
+            continue
+        if '__error__' in row:
+            errors.append((number, {'non_field_errors': [row['__error__']]}))
+            continue
+        serializer = BulkUserSerializer(data=row)
+        if not serializer.is_valid():
+            errors.append((number, serializer.errors))
+        elif serializer.validated_data['email'] in valid:
+            errors.append((number, {'email': ["Duplicate email in this batch."]}))
+        else:
+            valid[serializer.validated_data['email']] = (number, serializer.validated_data)
+
+    for email in existing_emails(valid):
+        number, _ = valid.pop(email)
+        errors.append((number, {'email': [f"A user with the email '{email}' already exists."]}))
+    return valid, errors
+
+
+def provision_users(rows, workers=None):
+    """
+    Validates and creates users from parsed rows. Returns (created users, errors), where errors
+    is a list of (row number, field errors) sorted by row. Invalid rows never abort the batch.
+    """
+    valid, errors = validate_rows(rows)
+    entries = sorted(valid.values(), key=lambda entry: entry[0])
+    hashed = hash_passwords([data['password'] for _, data in entries], workers)
+    pending = [
+        (number, User(username=data['username'], email=data['email'], user_type=data['user_type'], password=password))
+        for (number, data), password in zip(entries, hashed)
+    ]
+
+    created = []
+    while pending:
+        try:
+            with transaction.atomic():
+                created = create_users([user for _, user in pending])
+            break
+        except IntegrityError:
+            # Someone signed up with some of these emails since the check; drop those rows and retry
+            taken = existing_emails(user.email for _, user in pending)
+            if not taken:
+                created = create_each(pending, errors)  # Not a committed signup; find the rows one by one
+                break
+            for number, user in pending:
+                if user.email in taken:
+                    errors.append((number, {'email': [f"A user with the email '{user.email}' already exists."]}))
+            pending = [(number, user) for number, user in pending if user.email not in taken]
+
+    return created, sorted(errors, key=lambda error: error[0])
+
+
+def create_each(pending, errors):
+    # Last resort after a conflict no lookup explains: one savepoint per row, so only the clashing rows fail
+    created = []
+    for number, user in pending:
+        try:
+            with transaction.atomic():
+                created.extend(create_users([user]))
+        except IntegrityError:
+            errors.append((number, {'non_field_errors': ["This user conflicts with an existing user."]}))
+    return created
+
+
+def create_users(users):
+    batch_size = settings.BULK_PROVISIONING_BATCH_SIZE
+    created = User.objects.bulk_create(users, batch_size=batch_size)
+    if created and created[0].pk is None:
+        # Backends that cannot return ids from bulk inserts (e.g. MySQL)
+        created = [
+            user for chunk in email_chunks(user.email for user in users)
+            for user in User.objects.filter(email__in=chunk)
+        ]
+
+    # Client users get a verification token and email, just as with a single signup
+    now = timezone.now()
+    tokens = VerificationToken.objects.bulk_create([
+        VerificationToken(user=user, created_at=now, expiry_date=now + VerificationToken.LIFETIME)
+        for user in created if user.user_type == 'client_user'
+    ], batch_size=batch_size)
+    OutgoingEmail.objects.bulk_create(
+        [build_verification_email(token.user, token.token) for token in tokens], batch_size=batch_size
+    )
+    return created
@@ -0,0 +1,94 @@
+"""
+Per-user storage quotas, checked without adding up anyone's files.
+
+Each user's StorageQuota row holds the bytes and number of files they store. An upload is
+charged by FileUploadSerializer, in the transaction that creates its File row and before any
+bytes are written to storage. The charge is one conditional F-expression UPDATE that matches
+nothing when the file does not fit, so concurrent uploads cannot overshoot the quota between
+check and charge. Deleting a File releases its bytes from a post_delete signal, in the
+transaction of the delete.
+
+Uploads are also checked up front through upload_allowance, so a file that cannot fit is
+refused before its bytes are read. Users are charged File.size for every file they upload, even
+when storage keeps one copy of identical content.
+
+Counters drift only through writes that skip these paths: File rows created directly (admin,
+shell, bulk_create), File.size changed by bulk_update (backfill_file_metadata), or raw
+SQL. `manage.py reconcile_storage_usage` recounts them in batches and fixes any difference.
+"""
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Sum
+from django.db.models.functions import Coalesce
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from .models import File, StorageQuota, User
+
+
+class QuotaExceeded(APIException):
+    """
+    Raised when a file does not fit in its uploader's quota. Shaped like a serializer error on `file`.
+    """
+    status_code = status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+    default_code = 'quota_exceeded'
+
+    def __init__(self, size):
+        super().__init__({'file': [f"A file of {size} bytes does not fit in your storage quota."]})
+
+
+def usage(user_id):
+    quota = StorageQuota.objects.filter(user_id=user_id).first() or StorageQuota(user_id=user_id)
+    limit = quota.limit_bytes if quota.limit_bytes is not None else settings.STORAGE_QUOTA_DEFAULT
+    return {
+        'used_bytes': quota.used_bytes,
+        'file_count': quota.file_count,
+        'limit_bytes': limit,
+        'available_bytes': None if limit is None else max(limit - quota.used_bytes, 0),
+    }
+
+
+def upload_allowance(user_id):
+    """
+    Returns the largest upload `user_id` may send now, and the message for one that is larger.
+    """
+    size_limit = User.upload_size_limit_for(user_id)
+    available = usage(user_id)['available_bytes']
+    if available is not None and available < size_limit:
+        return available, f"File does not fit in the {available} bytes left in your storage quota."
+    return size_limit, f"File is larger than the upload limit of {size_limit} bytes."
+
+
+def reconcile(batch_size=None, dry_run=False):
+    """
+    Recounts every user's usage from their File rows, one batch of users per transaction, and
+    fixes counters that drifted. Returns [(user_id, (bytes, files) before, (bytes, files) after)].
+    """
+    batch_size = batch_size or settings.STORAGE_QUOTA_RECONCILE_BATCH_SIZE
+    corrected = []
+    last_id = 0
+    while True:
+        user_ids = list(User.objects.filter(pk__gt=last_id).order_by('pk').values_list('pk', flat=True)[:batch_size])
+        if not user_ids:
+            return corrected
+        last_id = user_ids[-1]
+        with transaction.atomic():
+            # Locked, so uploads and deletes by these users wait until their counters are fixed
+            quotas = {quota.user_id: quota for quota in StorageQuota.objects.select_for_update().filter(user_id__in=user_ids)}
+            totals = {
+                row['uploaded_by_id']: (row['total'], row['count'])
+                for row in File.objects.filter(uploaded_by_id__in=user_ids).order_by().values('uploaded_by_id').annotate(
+                    total=Coalesce(Sum('size'), 0), count=Count('id'),
+                )
+            }
+            for user_id in user_ids:
+                quota = quotas.get(user_id)
+                before = (quota.used_bytes, quota.file_count) if quota else (0, 0)
+                after = totals.get(user_id, (0, 0))
+                if before == after:
+                    continue
+                corrected.append((user_id, before, after))
+                if not dry_run:
+                    StorageQuota.objects.update_or_create(
+                        user_id=user_id, defaults={'used_bytes': after[0], 'file_count': after[1]},
+                    )
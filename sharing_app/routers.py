@@ -0,0 +1,94 @@
+"""
+Sends reads to read replicas and writes to the primary ('default').
+
+Only reads made while serving a request are routed to DATABASE_REPLICAS. Management commands,
+workers and shells read the primary, because they usually read back rows they just wrote.
+Within a request, reads go back to the primary once any of these is true:
+
+  * the request has written (or locked rows with select_for_update) through the router
+  * the authenticated user wrote within the last DATABASE_REPLICA_STICKINESS seconds, so a user
+    who just uploaded sees their upload on the next request (read-your-writes)
+  * the code asked for it with `pin_to_primary()`, e.g. before a read whose result is cached
+
+Replicas are kept in sync outside Django (MySQL replication, LiteFS and the like) and lag by
+less than the stickiness window. Stickiness is keyed by the user id in the request's access
+token and kept in the cache, so every worker sharing the cache agrees.
+"""
+import random
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+from django.utils.functional import cached_property
+from rest_framework.exceptions import APIException
+
+routing_state = ContextVar('routing_state', default=None)
+
+
+def sticky_key(user_id):
+    return f'db:sticky:{user_id}'
+
+
+def stick_to_primary(user_id):
+    cache.set(sticky_key(user_id), True, settings.DATABASE_REPLICA_STICKINESS)
+
+
+def pin_to_primary():
+    # The rest of the current request reads the primary; does nothing outside a request
+    state = routing_state.get()
+    if state is not None:
+        state.pinned = True
+
+
+class RoutingState:
+    """
+    What the router knows about the request being served.
+    """
+    def __init__(self, request):
+        self.request = request
+        self.wrote = False
+        self.pinned = False
+
+    @cached_property
+    def user_id(self):
+        # Read from the access token, which needs no query; views authenticate it again as usual
+        from .tokens import ClaimsJWTAuthentication
+        try:
+            authenticated = ClaimsJWTAuthentication().authenticate(self.request)
+        except APIException:
+            return None
+        return authenticated[0].id if authenticated else None
+
+    @cached_property
+    def sticky(self):
+        return self.user_id is not None and cache.get(sticky_key(self.user_id)) is not None
+
+    def use_primary(self):
+        return self.wrote or self.pinned or self.sticky
+
+    def finish(self):
+        # A user who wrote reads the primary until replicas have caught up
+        if self.wrote and self.user_id is not None:
+            stick_to_primary(self.user_id)
+
+
+class PrimaryReplicaRouter:
+    def db_for_read(self, model, **hints):
+        state = routing_state.get()
+        if state is None or not settings.DATABASE_REPLICAS or state.use_primary():
+            return DEFAULT_DB_ALIAS
+        return random.choice(settings.DATABASE_REPLICAS)
+
+    def db_for_write(self, model, **hints):
+        state = routing_state.get()
+        if state is not None:
+            state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the primary's rows, so an object read from one may point at one from the other
+        databases = {DEFAULT_DB_ALIAS, *settings.DATABASE_REPLICAS}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
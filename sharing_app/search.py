@@ -0,0 +1,239 @@
+"""
+Full-text search over uploaded Office documents.
+
+Uploads are OOXML: zip archives of XML parts. Text is extracted by opening only the parts that
+hold document text and parsing each one incrementally, so neither the archive nor a whole part is
+ever held in memory. The text goes into a search backend; the default keeps an FTS5 table on the
+SQLite database, created by `migrate`. On databases the configured backend cannot use, searches
+fall back to matching file names, and the `sharing_app.W001` check says so at startup.
+
+`SearchIndexEntry` records the digest of the content each file was indexed from. The
+`index_files` command only visits files with no entry or a different digest, so a run after the
+first one touches only new or changed uploads.
+"""
+import logging
+import re
+import zipfile
+from xml.etree.ElementTree import ParseError, iterparse
+
+from django.conf import settings
+from django.core import checks
+from django.core.exceptions import EmptyResultSet, ImproperlyConfigured
+from django.db import connections, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import File, SearchIndexEntry
+
+logger = logging.getLogger(__name__)
+
+# Parts of each format that carry document text
+TEXT_PARTS = {
+    'docx': re.compile(r'word/(document|header\d*|footer\d*|footnotes|endnotes|comments)\.xml'),
+    'pptx': re.compile(r'ppt/(slides/slide|notesSlides/notesSlide)\d+\.xml'),
+    'xlsx': re.compile(r'xl/(sharedStrings|worksheets/sheet\d+)\.xml'),
+}
+TEXT_TAG = 't'  # Text runs are <w:t>, <a:t> and <t> in the Word, DrawingML and SpreadsheetML namespaces
+BREAK_TAGS = {'p', 'si'}  # Paragraphs and shared strings end a line
+
+
+def local_name(tag):
+    return tag.rpartition('}')[2]
+
+
+def part_text(part):
+    # Yield text runs from one XML part, discarding each element once it has been read
+    for event, element in iterparse(part, events=('end',)):
+        name = local_name(element.tag)
+        if name == TEXT_TAG and element.text:
+            yield element.text
+        elif name in BREAK_TAGS:
+            yield '\n'
+        element.clear()
+
+
+def extract_text(content, extension, max_chars=None):
+    """
+    Returns the text of an OOXML document read from the seekable file `content`, truncated to
+    `max_chars` (default FILE_SEARCH_MAX_TEXT_CHARS).
+    """
+    max_chars = max_chars or settings.FILE_SEARCH_MAX_TEXT_CHARS
+    pattern = TEXT_PARTS.get(extension)
+    if pattern is None:
+        return ''
+
+    pieces, length = [], 0
+    with zipfile.ZipFile(content) as archive:
+        for info in archive.infolist():
+            if not pattern.fullmatch(info.filename):
+                continue
+            with archive.open(info) as part:  # Decompressed on the fly as the parser reads
+                for text in part_text(part):
+                    pieces.append(text)
+                    length += len(text)
+                    if length >= max_chars:
+                        return ''.join(pieces)[:max_chars]
+    return ''.join(pieces)
+
+
+def extract_file(file_instance):
+    # Returns (text, error); failures are recorded rather than retried until the content changes
+    extension = file_instance.extension or file_instance.file.name.rpartition('.')[2].lower()
+    try:
+        with file_instance.file.storage.open(file_instance.file.name, 'rb') as content:
+            return extract_text(content, extension), ''
+    except (OSError, zipfile.BadZipFile, ParseError, RuntimeError) as e:
+        logger.warning("Could not extract text from file %s: %s", file_instance.pk, e)
+        return '', f"{type(e).__name__}: {e}"[:255]
+
+
+class SearchBackend:
+    """
+    Stores extracted text and answers ranked queries. `search` must only return files in
+    `visible`, a File queryset, and should apply that filter before limiting.
+    """
+    def __init__(self, using='default'):
+        self.using = using  # Database alias whose transactions index writes join
+
+    def index(self, documents):
+        # documents: iterable of (file_id, text)
+        raise NotImplementedError
+
+    def remove(self, file_ids):
+        raise NotImplementedError
+
+    def search(self, query, visible, limit):
+        # Returns [(file_id, score, snippet)], best match first
+        raise NotImplementedError
+
+
+class SQLiteFTSBackend(SearchBackend):
+    """
+    FTS5 table on an SQLite database, keyed by File id. Ranked with bm25; snippets come from FTS5.
+    """
+    table = 'sharing_app_file_fts'
+    highlight = ('[', ']')  # Plain markers around matched terms; snippets are document text, not HTML
+    snippet_tokens = 16
+
+    def __init__(self, using='default'):
+        super().__init__(using)
+        if connections[using].vendor != 'sqlite':
+            raise ImproperlyConfigured("SQLiteFTSBackend needs an SQLite database; set FILE_SEARCH_BACKEND.")
+
+    @classmethod
+    def create_table(cls, using):
+        with connections[using].cursor() as cursor:
+            cursor.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {cls.table} "
+                f"USING fts5(body, tokenize='porter unicode61 remove_diacritics 2')"
+            )
+
+    def cursor(self):
+        return connections[self.using].cursor()
+
+    def index(self, documents):
+        documents = list(documents)
+        with self.cursor() as cursor:
+            cursor.executemany(f"DELETE FROM {self.table} WHERE rowid = %s", [(pk,) for pk, text in documents])
+            cursor.executemany(f"INSERT INTO {self.table} (rowid, body) VALUES (%s, %s)", documents)
+
+    def remove(self, file_ids):
+        with self.cursor() as cursor:
+            cursor.executemany(f"DELETE FROM {self.table} WHERE rowid = %s", [(pk,) for pk in file_ids])
+
+    def search(self, query, visible, limit):
+        match = self.match_expression(query)
+        if not match:
+            return []
+        try:
+            visible_sql, visible_params = visible.values('id').query.sql_with_params()
+        except EmptyResultSet:
+            return []  # visible_to() returned none()
+        start, end = self.highlight
+        with self.cursor() as cursor:
+            cursor.execute(
+                f"SELECT rowid, -bm25({self.table}), "
+                f"snippet({self.table}, 0, %s, %s, '…', {self.snippet_tokens}) "
+                f"FROM {self.table} WHERE {self.table} MATCH %s AND rowid IN ({visible_sql}) "
+                f"ORDER BY bm25({self.table}) LIMIT %s",
+                [start, end, match, *visible_params, limit],
+            )
+            return cursor.fetchall()
+
+    def match_expression(self, query):
+        # Every word must appear; quoting keeps FTS5 operators in user input from being interpreted
+        terms = re.findall(r'\w+', query)
+        return ' '.join('"%s"' % term for term in terms)
+
+
+class FileNameSearchBackend(SearchBackend):
+    """
+    Matches query words against file names. Needs no index, so it works on any database; used
+    when the configured backend cannot run on this one.
+    """
+    def index(self, documents):
+        pass
+
+    def remove(self, file_ids):
+        pass
+
+    def search(self, query, visible, limit):
+        terms = re.findall(r'\w+', query)
+        if not terms:
+            return []
+        for term in terms:
+            visible = visible.filter(original_name__icontains=term)
+        rows = visible.order_by('-upload_date', '-id').values_list('id', 'original_name')[:limit]
+        return [(pk, 1.0, name) for pk, name in rows]
+
+
+def get_backend():
+    try:
+        return import_string(settings.FILE_SEARCH_BACKEND)()
+    except ImproperlyConfigured:
+        return FileNameSearchBackend()  # Reported once, by check_search_backend
+
+
+def check_search_backend(app_configs, **kwargs):
+    try:
+        import_string(settings.FILE_SEARCH_BACKEND)()
+    except ImproperlyConfigured as e:
+        return [checks.Warning(
+            f"{e} Until then, file search only matches file names.", id='sharing_app.W001',
+        )]
+    return []
+
+
+def create_search_table(sender, using='default', **kwargs):
+    # Run after migrate, as there are no migrations for virtual tables
+    backend_class = import_string(settings.FILE_SEARCH_BACKEND)
+    if issubclass(backend_class, SQLiteFTSBackend) and connections[using].vendor == 'sqlite':
+        backend_class.create_table(using)
+
+
+def pending_files():
+    # Files never indexed, or indexed from content they no longer have
+    return File.objects.filter(Q(search_entry__isnull=True) | ~Q(search_entry__sha256=F('sha256')))
+
+
+def index_batch(files, backend, map=map):
+    """
+    Extracts and indexes `files`, recording what was indexed. Returns the number of failures.
+    Pass a thread pool's `map` to overlap extraction of several files.
+    """
+    results = list(map(extract_file, files))
+
+    now = timezone.now()
+    with transaction.atomic(using=backend.using):
+        backend.index((file_instance.pk, text) for file_instance, (text, error) in zip(files, results))
+        SearchIndexEntry.objects.bulk_create(
+            [
+                SearchIndexEntry(file=file_instance, sha256=file_instance.sha256, indexed_at=now, error=error)
+                for file_instance, (text, error) in zip(files, results)
+            ],
+            update_conflicts=True,
+            unique_fields=['file'],
+            update_fields=['sha256', 'indexed_at', 'error'],
+        )
+    return sum(1 for text, error in results if error)
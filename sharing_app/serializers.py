@@ -1,6 +1,13 @@
+import os
+
 from rest_framework import serializers
-from .models import User, File
+from .models import User, File, UploadSession, Blob, StorageQuota
 from django.contrib.auth import authenticate
+from django.core.files.base import ContentFile
+from django.db import transaction
+from . import metrics
+from .quotas import QuotaExceeded
+from .utils import name_metadata
 
 class UserSignupSerializer(serializers.ModelSerializer):
     # Defining the allowable user types for signup
@@ -43,6 +50,40 @@ class FileUploadSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError("Only .pptx, .docx, and .xlsx files are allowed")
         return value
 
+    @transaction.atomic
+    def create(self, validated_data):
+        # Identical content is stored once; the new row shares the existing blob
+        upload = validated_data.pop('file')
+        # Charged before anything is stored; an upload that does not fit is rolled back here
+        uploader_id = validated_data.get('uploaded_by_id') or validated_data['uploaded_by'].pk
+        if not StorageQuota.objects.charge(uploader_id, upload.size):
+            raise QuotaExceeded(upload.size)
+        metrics.record_upload(upload.size)
+        blob = Blob.objects.acquire(upload)
+        original_name = os.path.basename(upload.name)
+        # Metadata is recorded once here so listings and downloads never have to stat the file
+        return File.objects.create(
+            file=blob.file.name, sha256=blob.sha256, original_name=original_name, size=blob.size,
+            storage_mtime=blob.file.storage.get_modified_time(blob.file.name),
+            **name_metadata(original_name), **validated_data
+        )
+
+class UploadSessionSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = UploadSession  # Specifying the model to serialize
+        fields = ['id', 'file_name', 'total_size', 'offset', 'chunk_count', 'expires_at']
+        read_only_fields = ['id', 'offset', 'chunk_count', 'expires_at']
+
+    def validate_file_name(self, value):
+        # Reject unsupported files before any bytes are sent, using the same rules as a direct upload
+        FileUploadSerializer().validate_file(ContentFile(b'', name=value))
+        return value
+
+    def validate_total_size(self, value):
+        if value is not None and value < 0:
+            raise serializers.ValidationError("Size cannot be negative.")
+        return value
+
 class UserLoginSerializer(serializers.Serializer):
     email = serializers.EmailField(required=True)  # Login using email
     password = serializers.CharField(required=True, write_only=True)  # Password is write-only
@@ -65,7 +106,49 @@ class FileListSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = File  # Specifying the model to serialize
-        fields = ['id', 'file', 'uploaded_by', 'upload_date']  # Fields to return in serialization
+        fields = [
+            'id', 'file', 'uploaded_by', 'upload_date',
+            'original_name', 'size', 'content_type', 'extension', 'storage_mtime',
+        ]  # Fields to return in serialization
+
+class FileListRowSerializer:
+    """
+    Produces exactly the rows FileListSerializer does, built straight from `.values()` dicts.
+    Skipping the per-row field machinery and model instantiation keeps large listings cheap.
+    """
+    fields = (
+        'id', 'file', 'uploaded_by__email', 'upload_date',
+        'original_name', 'size', 'content_type', 'extension', 'storage_mtime',
+    )  # Columns to fetch with .values()
+
+    def __init__(self, context):
+        self.storage = File._meta.get_field('file').storage
+        self.date_field = serializers.DateTimeField()
+        request = context.get('request')
+        # Same result as request.build_absolute_uri() for the site-relative URLs storage returns
+        self.url_prefix = request.build_absolute_uri('/')[:-1] if request is not None else ''
+
+    def file_url(self, name):
+        if not name:
+            return None
+        url = self.storage.url(name)
+        return self.url_prefix + url if url.startswith('/') else url
+
+    def to_representation(self, row):
+        return {
+            'id': row['id'],
+            'file': self.file_url(row['file']),
+            'uploaded_by': row['uploaded_by__email'],  # The uploader's string form is their email
+            'upload_date': self.date_field.to_representation(row['upload_date']),
+            'original_name': row['original_name'],
+            'size': row['size'],
+            'content_type': row['content_type'],
+            'extension': row['extension'],
+            'storage_mtime': self.date_field.to_representation(row['storage_mtime']),
+        }
+
+    def many(self, rows):
+        return [self.to_representation(row) for row in rows]
 
 class FileDownloadSerializer(serializers.ModelSerializer):
     class Meta:
@@ -0,0 +1,91 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import listing_cache, profiling
+from .models import Blob, File, FileChange, ProfilingSwitch, SearchIndexEntry, StorageQuota, User
+from .tokens import revoke_user_tokens
+
+
+@receiver(post_delete, sender=File)
+def release_blob(sender, instance, **kwargs):
+    # Files created before deduplication have no digest and own their storage outright
+    if instance.sha256:
+        Blob.objects.release(instance.sha256)
+
+
+@receiver(post_delete, sender=File)
+def release_storage_quota(sender, instance, **kwargs):
+    StorageQuota.objects.release(instance.uploaded_by_id, instance.size or 0)
+
+
+def record_file_change(instance, action):
+    # Written with the File, numbered once it has committed
+    FileChange.objects.create(file_id=instance.pk, uploader_id=instance.uploaded_by_id, action=action)
+    transaction.on_commit(FileChange.objects.sequence_pending)
+
+
+@receiver(post_save, sender=File)
+def record_file_added(sender, instance, created, **kwargs):
+    if created:
+        record_file_change(instance, FileChange.ADDED)
+
+
+@receiver(post_delete, sender=File)
+def record_file_deleted(sender, instance, **kwargs):
+    record_file_change(instance, FileChange.DELETED)
+
+
+def invalidate_listings(*audiences):
+    # Bump now so this process stops serving the old pages, and again after commit so no
+    # reader can cache pre-commit rows under the new version
+    def bump():
+        for audience in audiences:
+            listing_cache.bump_version(audience)
+    bump()
+    transaction.on_commit(bump)
+
+
+@receiver(post_save, sender=File)
+@receiver(post_delete, sender=File)
+def invalidate_file_listings(sender, instance, **kwargs):
+    invalidate_listings(listing_cache.CLIENT_AUDIENCE, listing_cache.ops_audience(instance.uploaded_by_id))
+
+
+@receiver(post_delete, sender=SearchIndexEntry)
+def remove_search_document(sender, instance, **kwargs):
+    # Runs for files deleted after they were indexed; search results are also filtered by visible files
+    from .search import get_backend
+    pk = instance.pk
+    transaction.on_commit(lambda: get_backend().remove([pk]))
+
+
+@receiver(post_save, sender=User)
+def invalidate_uploader_listings(sender, instance, created, **kwargs):
+    # Listings show the uploader's email, so a change to an ops user affects cached pages
+    if instance.user_type == 'ops_user' and not created:
+        invalidate_listings(listing_cache.CLIENT_AUDIENCE, listing_cache.ops_audience(instance.pk))
+
+
+@receiver(post_save, sender=User)
+def revoke_stale_tokens(sender, instance, created, **kwargs):
+    # Tokens carry user_type and is_verified as claims; changing those (or the password) invalidates them
+    loaded = getattr(instance, '_loaded_token_state', None)
+    if not created and loaded is not None and loaded != instance.token_state():
+        revoke_user_tokens(instance.pk)
+    instance._loaded_token_state = instance.token_state()
+
+
+@receiver(post_delete, sender=User)
+def revoke_deleted_user_tokens(sender, instance, **kwargs):
+    revoke_user_tokens(instance.pk)
+
+
+@receiver(post_save, sender=ProfilingSwitch)
+def publish_profiling_switch(sender, instance, **kwargs):
+    profiling.publish_switch(instance)
+
+
+@receiver(post_delete, sender=ProfilingSwitch)
+def withdraw_profiling_switch(sender, instance, **kwargs):
+    profiling.publish_switch(None)
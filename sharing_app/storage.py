@@ -0,0 +1,277 @@
+"""
+Storage for uploaded content.
+
+Stored names are content digests, so one flat directory would grow without bound. Both backends
+fan names out into prefix directories taken from the name itself: `uploads/3f/a9/3fa9…c2.docx`.
+With the default two levels of two hex characters, each directory holds 1/65536 of the files.
+The name a user uploaded is kept on File.original_name.
+
+Blob names are the SHA-256 of the content plus its extension (`DIGEST_NAME_RE`), and only
+those names rely on "same name, same content": a taken digest name needs no alternative, so it
+is never probed for and a second save of it leaves the stored file as it is. Any other name
+gets Django's usual handling: a taken name is given a random suffix, never written over.
+
+    ShardedFileSystemStorage  Local disk under MEDIA_ROOT (the default).
+    S3Storage                 Any S3-compatible object store. Needs boto3. Large files are sent
+                              as multipart uploads whose parts go out concurrently from a thread
+                              pool. Reads are ranged GETs, so seeking (byte ranges, zip members)
+                              never downloads the whole object. `presigned_url` backs the
+                              'redirect' delivery backend, so bytes can bypass Django entirely.
+"""
+import hashlib
+import io
+import mimetypes
+import os
+import posixpath
+import re
+import tempfile
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from urllib.parse import quote
+
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files import File
+from django.core.files.move import file_move_safe
+from django.core.files.storage import FileSystemStorage, Storage, storages
+from django.utils.http import content_disposition_header
+
+HEX_NAME_RE = re.compile(r'^[0-9a-f]{8,}', re.IGNORECASE)
+DIGEST_NAME_RE = re.compile(r'^[0-9a-f]{64}(\.\w+)?$', re.IGNORECASE)
+MIB = 1024 * 1024
+
+
+class ShardedNamesMixin:
+    """
+    Places every name in prefix directories and accepts taken digest names as they are.
+    """
+    depth = 2  # Directory levels below the upload directory
+    width = 2  # Characters of the key per level
+
+    def shard(self, basename):
+        # Digest names shard on their own leading characters; anything else on a hash of the name
+        key = basename.lower() if HEX_NAME_RE.match(basename) else hashlib.md5(basename.encode()).hexdigest()
+        return '/'.join(key[i * self.width:(i + 1) * self.width] for i in range(self.depth))
+
+    def shard_name(self, name):
+        # Idempotent: a name already in its shard is returned unchanged
+        dirname, basename = posixpath.split(name)
+        shard = self.shard(basename)
+        if dirname == shard or dirname.endswith('/' + shard):
+            return name
+        return posixpath.join(dirname, shard, basename)
+
+    def generate_filename(self, filename):
+        return self.shard_name(super().generate_filename(filename))
+
+    def is_digest_name(self, name):
+        return bool(DIGEST_NAME_RE.match(posixpath.basename(name)))
+
+    def is_name_available(self, name, max_length=None):
+        if max_length is not None and len(name) > max_length:
+            return False
+        # A taken digest name already holds the same content, so it is as good as a free one
+        if self.is_digest_name(name):
+            return True
+        return super().is_name_available(name, max_length)
+
+
+class ShardedFileSystemStorage(ShardedNamesMixin, FileSystemStorage):
+    def __init__(self, depth=2, width=2, **kwargs):
+        super().__init__(**kwargs)
+        self.depth = depth
+        self.width = width
+
+    def _save(self, name, content):
+        if not self.is_digest_name(name):
+            return super()._save(name, content)  # O_EXCL, and a new name if another save got there first
+        full_path = self.path(name)
+        try:
+            # Reused as is; made young again so the orphan scan's grace period covers the new row
+            os.utime(full_path)
+            return name
+        except FileNotFoundError:
+            pass
+        directory = os.path.dirname(full_path)
+        os.makedirs(directory, exist_ok=True)
+        if hasattr(content, 'temporary_file_path'):
+            file_move_safe(content.temporary_file_path(), full_path, allow_overwrite=True)
+        else:
+            # Written aside and renamed into place, so concurrent saves of one digest both succeed
+            # and a reader never sees a partial file
+            fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.', suffix='.part')
+            try:
+                with os.fdopen(fd, 'wb') as destination:
+                    for chunk in content.chunks():
+                        destination.write(chunk)
+                os.replace(temp_path, full_path)
+            except BaseException:
+                os.unlink(temp_path)
+                raise
+        if self.file_permissions_mode is not None:
+            os.chmod(full_path, self.file_permissions_mode)
+        return name
+
+
+class S3ObjectReader(io.RawIOBase):
+    """
+    Seekable, read-only view of one object. Every read is a ranged GET from the current position.
+    """
+    def __init__(self, client, bucket, key, size):
+        self.client = client
+        self.bucket = bucket
+        self.key = key
+        self.size = size
+        self.position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self.position, io.SEEK_END: self.size}[whence]
+        self.position = max(base + offset, 0)
+        return self.position
+
+    def readinto(self, buffer):
+        if self.position >= self.size or not len(buffer):
+            return 0
+        end = min(self.position + len(buffer), self.size) - 1
+        body = self.client.get_object(Bucket=self.bucket, Key=self.key, Range=f'bytes={self.position}-{end}')['Body']
+        data = body.read()
+        buffer[:len(data)] = data
+        self.position += len(data)
+        return len(data)
+
+
+class S3Storage(ShardedNamesMixin, Storage):
+    def __init__(
+        self, bucket, endpoint_url=None, region_name=None, access_key=None, secret_key=None, prefix='',
+        depth=2, width=2, multipart_threshold=16 * MIB, part_size=8 * MIB, max_workers=8,
+        read_buffer_size=MIB, presign_expiry=300,
+    ):
+        try:
+            import boto3
+            from botocore.config import Config
+        except ImportError:
+            raise ImproperlyConfigured("S3Storage needs boto3: pip install boto3")
+
+        self.bucket = bucket
+        self.prefix = prefix.strip('/')  # Key prefix inside the bucket, if it is shared
+        self.depth = depth
+        self.width = width
+        self.multipart_threshold = multipart_threshold  # Larger files are sent as multipart uploads
+        self.part_size = max(part_size, 5 * MIB)  # S3 rejects parts under 5 MiB, except the last
+        self.max_workers = max_workers  # Parts in flight at once; also bounds memory to that many parts
+        self.read_buffer_size = read_buffer_size  # Bytes fetched per ranged GET when reading
+        self.presign_expiry = presign_expiry
+        # One client for every thread: boto3 clients are thread-safe, and the pool must fit the uploaders
+        self.client = boto3.session.Session().client(
+            's3', endpoint_url=endpoint_url, region_name=region_name,
+            aws_access_key_id=access_key, aws_secret_access_key=secret_key,
+            config=Config(max_pool_connections=max(10, max_workers)),
+        )
+        self.client_error = self.client.exceptions.ClientError
+
+    def key(self, name):
+        return posixpath.join(self.prefix, name) if self.prefix else name
+
+    def head(self, name):
+        try:
+            return self.client.head_object(Bucket=self.bucket, Key=self.key(name))
+        except self.client_error as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                raise FileNotFoundError(name) from e
+            raise
+
+    def _open(self, name, mode='rb'):
+        if mode not in ('r', 'rb'):
+            raise ValueError("S3Storage files are read-only; use save().")
+        size = self.size(name)
+        reader = S3ObjectReader(self.client, self.bucket, self.key(name), size)
+        content = File(io.BufferedReader(reader, buffer_size=self.read_buffer_size), name)
+        content.size = size
+        return content
+
+    def _save(self, name, content):
+        content.seek(0)
+        extra = {'ContentType': mimetypes.guess_type(name)[0] or 'application/octet-stream'}
+        if content.size is not None and content.size <= self.multipart_threshold:
+            self.client.put_object(Bucket=self.bucket, Key=self.key(name), Body=content.read(), **extra)
+        else:
+            self.multipart_upload(self.key(name), content, extra)
+        return name
+
+    def multipart_upload(self, key, content, extra):
+        upload_id = self.client.create_multipart_upload(Bucket=self.bucket, Key=key, **extra)['UploadId']
+        try:
+            parts, pending, number = [], set(), 0
+            with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+                # Parts are read in order and sent concurrently; at most max_workers are held in memory
+                while chunk := content.read(self.part_size):
+                    if len(pending) >= self.max_workers:
+                        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        parts.extend(future.result() for future in done)
+                    number += 1
+                    pending.add(pool.submit(self.upload_part, key, upload_id, number, chunk))
+                parts.extend(future.result() for future in wait(pending).done)
+            if not parts:
+                raise ValueError("Multipart upload needs at least one part.")
+            self.client.complete_multipart_upload(
+                Bucket=self.bucket, Key=key, UploadId=upload_id,
+                MultipartUpload={'Parts': sorted(parts, key=lambda part: part['PartNumber'])},
+            )
+        except BaseException:
+            # Parts of an unfinished upload are billed until aborted
+            self.client.abort_multipart_upload(Bucket=self.bucket, Key=key, UploadId=upload_id)
+            raise
+
+    def upload_part(self, key, upload_id, number, chunk):
+        response = self.client.upload_part(
+            Bucket=self.bucket, Key=key, UploadId=upload_id, PartNumber=number, Body=chunk
+        )
+        return {'PartNumber': number, 'ETag': response['ETag']}
+
+    def delete(self, name):
+        self.client.delete_object(Bucket=self.bucket, Key=self.key(name))
+
+    def exists(self, name):
+        try:
+            self.head(name)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def size(self, name):
+        return self.head(name)['ContentLength']
+
+    def get_modified_time(self, name):
+        return self.head(name)['LastModified']
+
+    def listdir(self, path):
+        prefix = self.key(path).rstrip('/') + '/'
+        dirs, files = [], []
+        for page in self.client.get_paginator('list_objects_v2').paginate(Bucket=self.bucket, Prefix=prefix, Delimiter='/'):
+            dirs.extend(entry['Prefix'][len(prefix):].rstrip('/') for entry in page.get('CommonPrefixes', []))
+            files.extend(entry['Key'][len(prefix):] for entry in page.get('Contents', []))
+        if not dirs and not files:
+            raise FileNotFoundError(path)  # Same as a missing directory on disk
+        return dirs, files
+
+    def url(self, name):
+        # Plain object URL; the bucket is private, so downloads go through presigned_url
+        return f'{self.client.meta.endpoint_url}/{self.bucket}/{quote(self.key(name))}'
+
+    def presigned_url(self, name, expire=None, filename=None):
+        params = {'Bucket': self.bucket, 'Key': self.key(name)}
+        if filename:
+            params['ResponseContentDisposition'] = content_disposition_header(True, filename)
+        return self.client.generate_presigned_url('get_object', Params=params, ExpiresIn=expire or self.presign_expiry)
+
+
+def uploads_storage():
+    # Resolved through STORAGES['uploads'], so deployments can swap the backend
+    return storages['uploads']
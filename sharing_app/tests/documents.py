@@ -0,0 +1,35 @@
+"""
+Small Office Open XML documents for tests that upload or index files.
+"""
+import io
+import zipfile
+
+W = 'http://schemas.openxmlformats.org/wordprocessingml/2006/main'
+A = 'http://schemas.openxmlformats.org/drawingml/2006/main'
+S = 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'
+
+
+def ooxml(parts):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr('[Content_Types].xml', '<Types/>')
+        for name, xml in parts.items():
+            archive.writestr(name, xml)
+    return buffer.getvalue()
+
+
+def docx(*paragraphs):
+    body = ''.join(f'<w:p><w:r><w:t>{text}</w:t></w:r></w:p>' for text in paragraphs)
+    return ooxml({'word/document.xml': f'<w:document xmlns:w="{W}"><w:body>{body}</w:body></w:document>'})
+
+
+def pptx(*slides):
+    return ooxml({
+        f'ppt/slides/slide{i}.xml': f'<p:sld xmlns:p="p" xmlns:a="{A}"><a:p><a:r><a:t>{text}</a:t></a:r></a:p></p:sld>'
+        for i, text in enumerate(slides, 1)
+    })
+
+
+def xlsx(*strings):
+    items = ''.join(f'<si><t>{text}</t></si>' for text in strings)
+    return ooxml({'xl/sharedStrings.xml': f'<sst xmlns="{S}">{items}</sst>'})
@@ -0,0 +1,101 @@
+import io
+import os
+import shutil
+import tempfile
+import zipfile
+from unittest import mock
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APITestCase
+from sharing_app.archive import read_archive
+from sharing_app.delivery import BLOCK_SIZE
+from sharing_app.models import User
+from sharing_app.serializers import FileUploadSerializer
+
+
+class FileArchiveTests(APITestCase):
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        media_settings = override_settings(MEDIA_ROOT=self.media_root)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+
+        self.ops_user = User.objects.create_user(
+            username='opsuser',
+            email='ops@example.com',
+            password='securepassword',
+            user_type='ops_user'
+        )
+        self.client_user = User.objects.create_user(
+            username='client',
+            email='client@example.com',
+            password='securepassword',
+            user_type='client_user',
+            is_verified=True
+        )
+        self.large = os.urandom(3 * BLOCK_SIZE + 17)
+        self.deck = self.upload('deck.pptx', self.large)
+        self.report = self.upload('report.docx', b'quarterly numbers')
+        self.same_name = self.upload('deck.pptx', b'another deck')
+        self.client.force_authenticate(user=self.client_user)
+
+    def upload(self, name, content):
+        serializer = FileUploadSerializer(data={'file': SimpleUploadedFile(name, content)})
+        serializer.is_valid(raise_exception=True)
+        return serializer.save(uploaded_by=self.ops_user)
+
+    def request_archive(self, file_ids):
+        return self.client.post(reverse('file-archive'), {'file_ids': file_ids}, format='json')
+
+    def test_archive_contains_requested_files(self):
+        response = self.request_archive([self.deck.pk, self.report.pk, self.same_name.pk, self.deck.pk])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'application/zip')
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="files.zip"')
+
+        with zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content))) as archive:
+            self.assertIsNone(archive.testzip())
+            self.assertEqual(archive.namelist(), ['deck.pptx', 'report.docx', 'deck (2).pptx'])
+            self.assertEqual(archive.read('deck.pptx'), self.large)
+            self.assertEqual(archive.read('deck (2).pptx'), b'another deck')
+            self.assertTrue(all(info.compress_type == zipfile.ZIP_STORED for info in archive.infolist()))
+
+    def test_archive_streams_in_blocks(self):
+        chunks = list(read_archive([self.deck, self.report]))
+        self.assertGreater(len(chunks), 4)
+        self.assertLessEqual(max(len(chunk) for chunk in chunks), BLOCK_SIZE + 1024)
+
+    def test_large_entries_use_zip64(self):
+        with mock.patch('zipfile.ZIP64_LIMIT', BLOCK_SIZE):
+            body = b''.join(read_archive([self.deck]))
+            with zipfile.ZipFile(io.BytesIO(body)) as archive:
+                self.assertEqual(archive.read('deck.pptx'), self.large)
+        self.assertIn(b'PK\x06\x06', body)  # ZIP64 end of central directory record
+
+    def test_only_verified_client_users(self):
+        self.client.force_authenticate(user=self.ops_user)
+        self.assertEqual(self.request_archive([self.deck.pk]).status_code, status.HTTP_403_FORBIDDEN)
+
+        self.client_user.is_verified = False
+        self.client_user.save()
+        self.client.force_authenticate(user=self.client_user)
+        self.assertEqual(self.request_archive([self.deck.pk]).status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_missing_files_are_reported(self):
+        response = self.request_archive([self.deck.pk, 9999])
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(response.data['missing'], [9999])
+
+    def test_invalid_file_ids(self):
+        for file_ids in ([], 'all', [str(self.deck.pk)], [True]):
+            self.assertEqual(self.request_archive(file_ids).status_code, status.HTTP_400_BAD_REQUEST)
+
+    @override_settings(FILE_ARCHIVE_MAX_FILES=2)
+    def test_file_count_is_capped(self):
+        response = self.request_archive([self.deck.pk, self.report.pk, self.same_name.pk])
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
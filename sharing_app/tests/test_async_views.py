@@ -0,0 +1,177 @@
+import asyncio
+import shutil
+import tempfile
+
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.signals import request_finished, request_started
+from django.db import close_old_connections
+from django.test import override_settings
+from django.test.client import BOUNDARY, MULTIPART_CONTENT, encode_multipart
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APITestCase
+from sharing_app.asgi import StreamingBodyASGIHandler
+from sharing_app.models import User, File
+from sharing_app.serializers import FileUploadSerializer
+from sharing_app.tests.documents import docx
+from sharing_app.tokens import tokens_for_user
+
+
+class AsyncViewTests(APITestCase):
+    content = b'slide deck contents'
+
+    def setUp(self):
+        cache.clear()
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        media_settings = override_settings(MEDIA_ROOT=self.media_root)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+
+        self.ops_user = User.objects.create_user(
+            username='opsuser',
+            email='ops@example.com',
+            password='securepassword',
+            user_type='ops_user'
+        )
+        serializer = FileUploadSerializer(data={'file': SimpleUploadedFile('deck.pptx', self.content)})
+        serializer.is_valid(raise_exception=True)
+        self.file = serializer.save(uploaded_by=self.ops_user)
+
+        self.client_user = User.objects.create_user(
+            username='client',
+            email='client@example.com',
+            password='securepassword',
+            user_type='client_user',
+            is_verified=True
+        )
+        self.client.force_authenticate(user=self.client_user)
+        response = self.client.post(reverse('file-download', args=[self.file.pk]))
+        self.signed_url = response.data['download_link'].rsplit('/', 1)[-1]
+
+    def bearer(self, user):
+        return {'Authorization': f'Bearer {tokens_for_user(user).access_token}'}
+
+    async def test_async_download_streams_file(self):
+        url = reverse('async-secure-file-download', args=[self.signed_url])
+        response = await self.async_client.get(url, headers=self.bearer(self.client_user))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(b''.join([chunk async for chunk in response.streaming_content]), self.content)
+        self.assertEqual(response['Content-Length'], str(len(self.content)))
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="deck.pptx"')
+
+    async def test_async_download_range(self):
+        url = reverse('async-secure-file-download', args=[self.signed_url])
+        response = await self.async_client.get(url, headers={**self.bearer(self.client_user), 'Range': 'bytes=6-9'})
+        self.assertEqual(response.status_code, status.HTTP_206_PARTIAL_CONTENT)
+        self.assertEqual(b''.join([chunk async for chunk in response.streaming_content]), self.content[6:10])
+
+    async def test_async_download_requires_token(self):
+        url = reverse('async-secure-file-download', args=[self.signed_url])
+        response = await self.async_client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    async def test_async_download_rejects_ops_user(self):
+        url = reverse('async-secure-file-download', args=[self.signed_url])
+        response = await self.async_client.get(url, headers=self.bearer(self.ops_user))
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    async def test_async_download_rejects_malformed_link(self):
+        url = reverse('async-secure-file-download', args=['not-a-link'])
+        response = await self.async_client.get(url, headers=self.bearer(self.client_user))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    async def test_async_upload_creates_file(self):
+        upload = SimpleUploadedFile('report.docx', docx('quarterly numbers'))
+        response = await self.async_client.post(
+            reverse('async-file-upload'), {'file': upload}, headers=self.bearer(self.ops_user)
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.json()['file_name'], 'report.docx')
+        self.assertTrue(await File.objects.filter(original_name='report.docx', uploaded_by=self.ops_user).aexists())
+
+    async def test_async_upload_validates_file_type(self):
+        upload = SimpleUploadedFile('notes.txt', b'plain text')
+        response = await self.async_client.post(
+            reverse('async-file-upload'), {'file': upload}, headers=self.bearer(self.ops_user)
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('file', response.json())
+
+    async def test_async_upload_rejects_client_user(self):
+        upload = SimpleUploadedFile('report.docx', b'quarterly numbers')
+        response = await self.async_client.post(
+            reverse('async-file-upload'), {'file': upload}, headers=self.bearer(self.client_user)
+        )
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+class StreamingBodyTests(APITestCase):
+    message_size = 64 * 1024
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        media_settings = override_settings(MEDIA_ROOT=self.media_root)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+        # As the test client does: the test's connection stays open across these requests
+        for signal in (request_started, request_finished):
+            signal.disconnect(close_old_connections)
+            self.addCleanup(signal.connect, close_old_connections)
+
+        self.ops_user = User.objects.create_user(
+            username='opsuser', email='ops@example.com', password='securepassword', user_type='ops_user'
+        )
+        self.token = str(tokens_for_user(self.ops_user).access_token)
+
+    async def upload(self, content, content_length=None):
+        # Sends the body in messages and counts the ones the application asked for
+        body = encode_multipart(BOUNDARY, {'file': SimpleUploadedFile('report.docx', content)})
+        messages = [body[i:i + self.message_size] for i in range(0, len(body), self.message_size)]
+        path = reverse('async-file-upload')
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'POST',
+            'scheme': 'http', 'path': path, 'raw_path': path.encode(), 'query_string': b'',
+            'headers': [
+                (b'host', b'testserver'), (b'authorization', f'Bearer {self.token}'.encode()),
+                (b'content-type', MULTIPART_CONTENT.encode()),
+                (b'content-length', str(content_length or len(body)).encode()),
+            ],
+            'client': ('127.0.0.1', 0), 'server': ('testserver', 80),
+        }
+        received = 0
+        sent = []
+
+        async def receive():
+            nonlocal received
+            if received == len(messages):
+                await asyncio.Event().wait()  # The client stays connected until the response ends
+            received += 1
+            return {'type': 'http.request', 'body': messages[received - 1], 'more_body': received < len(messages)}
+
+        async def send(message):
+            sent.append(message)
+
+        # handle() rather than __call__, so the view's threads share the test's database connection
+        await StreamingBodyASGIHandler().handle(scope, receive, send)
+        return sent[0]['status'], received, len(messages)
+
+    async def test_body_read_as_it_arrives(self):
+        status_code, received, total = await self.upload(docx('quarterly numbers'))
+        self.assertEqual(status_code, status.HTTP_201_CREATED)
+        self.assertEqual(received, total)
+        self.assertTrue(await File.objects.filter(original_name='report.docx').aexists())
+
+    async def test_rejected_upload_not_received(self):
+        status_code, received, total = await self.upload(b'not a document' * 20000)
+        self.assertEqual(status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(received, 1)  # The first bytes were enough
+        self.assertGreater(total, 1)
+
+        with override_settings(FILE_UPLOAD_MAX_SIZE=1024):
+            status_code, received, _ = await self.upload(docx('x' * 4096), content_length=10 * 1024 * 1024)
+        self.assertEqual(status_code, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        self.assertEqual(received, 0)
+        self.assertFalse(await File.objects.aexists())
@@ -0,0 +1,127 @@
+import shutil
+import tempfile
+
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APITestCase
+from sharing_app.models import File, FileChange, User
+from sharing_app.tests.documents import docx
+
+
+class FileChangeFeedTests(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        media_settings = override_settings(MEDIA_ROOT=self.media_root)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+
+        self.ops_user = User.objects.create_user(
+            username='opsuser', email='ops@example.com', password='securepassword', user_type='ops_user'
+        )
+        self.other_ops = User.objects.create_user(
+            username='otherops', email='other@example.com', password='securepassword', user_type='ops_user'
+        )
+        self.client_user = User.objects.create_user(
+            username='client', email='client@example.com', password='securepassword',
+            user_type='client_user', is_verified=True
+        )
+
+    def upload(self, user, name, commit=True):
+        self.client.force_authenticate(user=user)
+        with self.captureOnCommitCallbacks(execute=commit):  # Changes are numbered after commit
+            response = self.client.post(
+                reverse('file-upload'), {'file': SimpleUploadedFile(name, docx(name))}, format='multipart'
+            )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        return File.objects.get(original_name=name)
+
+    def changes(self, user, since=None):
+        self.client.force_authenticate(user=user)
+        response = self.client.get(reverse('file-changes'), {} if since is None else {'since': since})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+
+    def summary(self, data):
+        return [(change['action'], change['file']['original_name'] if 'file' in change else change['file_id']) for change in data['changes']]
+
+    def test_adds_and_tombstones_since_cursor(self):
+        kept = self.upload(self.ops_user, 'kept.docx')
+        cursor = self.changes(self.client_user, since=0)['cursor']
+
+        removed = self.upload(self.ops_user, 'removed.docx')
+        removed_id = removed.pk
+        with self.captureOnCommitCallbacks(execute=True):
+            removed.delete()
+        added = self.upload(self.other_ops, 'added.docx')
+
+        data = self.changes(self.client_user, since=cursor)
+        self.assertEqual(data['changes'][-1]['file']['id'], added.pk)
+        # The removed file was deleted before the poll, so only its tombstone is sent
+        self.assertEqual(self.summary(data), [('delete', removed_id), ('add', 'added.docx')])
+        self.assertEqual(data['cursor'], FileChange.objects.latest('seq').seq)
+        self.assertFalse(data['more'])
+        self.assertEqual(self.changes(self.client_user, since=data['cursor'])['changes'], [])
+        self.assertTrue(File.objects.filter(pk=kept.pk).exists())
+
+    def test_ops_users_see_only_their_files(self):
+        self.upload(self.ops_user, 'mine.docx')
+        self.upload(self.other_ops, 'theirs.docx')
+        self.assertEqual(self.summary(self.changes(self.ops_user, since=0)), [('add', 'mine.docx')])
+
+        unverified = User.objects.create_user(
+            username='unverified', email='u@example.com', password='securepassword', user_type='client_user'
+        )
+        self.assertEqual(self.changes(unverified, since=0), {'changes': [], 'cursor': 0, 'more': False})
+
+    def test_cursor_without_since(self):
+        self.upload(self.ops_user, 'first.docx')
+        data = self.changes(self.client_user)
+        self.assertEqual(data, {'changes': [], 'cursor': FileChange.objects.latest('seq').seq, 'more': False})
+
+    def test_poll_without_changes_is_one_query(self):
+        self.upload(self.ops_user, 'first.docx')
+        for user in (self.client_user, self.ops_user):
+            cursor = self.changes(user, since=0)['cursor']
+            with self.assertNumQueries(1):
+                self.changes(user, since=cursor)
+
+    @override_settings(FILE_CHANGES_PAGE_SIZE=2)
+    def test_pages_until_caught_up(self):
+        for name in ('a.docx', 'b.docx', 'c.docx'):
+            self.upload(self.ops_user, name)
+        first = self.changes(self.client_user, since=0)
+        self.assertEqual(self.summary(first), [('add', 'a.docx'), ('add', 'b.docx')])
+        self.assertTrue(first['more'])
+        second = self.changes(self.client_user, since=first['cursor'])
+        self.assertEqual(self.summary(second), [('add', 'c.docx')])
+        self.assertFalse(second['more'])
+
+    def test_change_committed_late_served_after_cursor(self):
+        self.upload(self.ops_user, 'first.docx')
+        self.upload(self.ops_user, 'slow.docx', commit=False)  # Inserted, but its transaction has not committed
+        cursor = self.changes(self.client_user, since=0)['cursor']
+        self.assertEqual(self.changes(self.client_user)['cursor'], cursor)
+
+        self.upload(self.ops_user, 'fast.docx')
+        data = self.changes(self.client_user, since=cursor)
+        # However long it took to commit, the slow change is numbered above the cursor already handed out
+        self.assertEqual(self.summary(data), [('add', 'slow.docx'), ('add', 'fast.docx')])
+
+    def test_changes_numbered_once(self):
+        self.upload(self.ops_user, 'first.docx')
+        self.assertEqual(FileChange.objects.sequence_pending(), 0)
+        self.upload(self.ops_user, 'second.docx', commit=False)
+        self.assertEqual(FileChange.objects.sequence_pending(), 1)
+        self.assertEqual(list(FileChange.objects.order_by('id').values_list('seq', flat=True)), [1, 2])
+
+    def test_invalid_cursor_rejected(self):
+        self.client.force_authenticate(user=self.client_user)
+        for since in ('abc', '-1'):
+            response = self.client.get(reverse('file-changes'), {'since': since})
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
@@ -0,0 +1,125 @@
+from io import StringIO
+import hashlib
+import os
+import shutil
+import tempfile
+from unittest import mock
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APITestCase
+from sharing_app.models import User, File, Blob
+from sharing_app.tests.documents import pptx
+
+
+class DeduplicationTests(APITestCase):
+
+    def setUp(self):
+        # Each test gets its own media directory so stored blobs do not leak between tests
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        media_settings = override_settings(MEDIA_ROOT=self.media_root)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+
+        self.user = User.objects.create_user(
+            username='opsuser',
+            email='ops@example.com',
+            password='securepassword',
+            user_type='ops_user'
+        )
+        self.client.force_authenticate(user=self.user)
+
+    def upload(self, content, name='deck.pptx'):
+        response = self.client.post(
+            reverse('file-upload'),
+            {'file': SimpleUploadedFile(name, content)},
+            format='multipart'
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        return File.objects.latest('id')
+
+    def test_digest_recorded_on_upload(self):
+        content = pptx('quarterly numbers')
+        file_instance = self.upload(content)
+        self.assertEqual(file_instance.sha256, hashlib.sha256(content).hexdigest())
+        self.assertEqual(file_instance.original_name, 'deck.pptx')
+
+    def test_identical_uploads_share_one_blob(self):
+        deck = pptx('same deck')
+        first = self.upload(deck, name='a.pptx')
+        second = self.upload(deck, name='b.pptx')
+
+        self.assertEqual(first.file.name, second.file.name)
+        blob = Blob.objects.get()
+        self.assertEqual(blob.ref_count, 2)
+        stored = [name for _, _, names in os.walk(os.path.join(self.media_root, 'uploads')) for name in names]
+        self.assertEqual(stored, [os.path.basename(blob.file.name)])
+
+    def test_blob_deleted_with_last_reference(self):
+        deck = pptx('same deck')
+        first = self.upload(deck)
+        second = self.upload(deck)
+        path = first.file.path
+
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.assertEqual(Blob.objects.get().ref_count, 1)
+        self.assertTrue(os.path.exists(path))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            second.delete()
+        self.assertFalse(Blob.objects.exists())
+        self.assertFalse(os.path.exists(path))
+
+    def test_blob_reused_before_purge_is_kept(self):
+        deck = pptx('same deck')
+        first = self.upload(deck)
+        path = first.file.path
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            first.delete()
+        second = self.upload(deck)  # Arrives between the release committing and the purge running
+        for callback in callbacks:
+            callback()
+
+        self.assertEqual(second.file.name, first.file.name)
+        self.assertEqual(Blob.objects.get().ref_count, 1)
+        self.assertTrue(os.path.exists(path))
+
+    def test_purge_deletes_bytes_inside_row_delete(self):
+        first = self.upload(pptx('same deck'))
+        blob = Blob.objects.get()
+        Blob.objects.filter(pk=blob.pk).update(ref_count=0)
+        rows_seen = []
+
+        def delete(name):
+            rows_seen.append(Blob.objects.filter(pk=blob.pk).exists())
+            raise OSError("Storage unavailable")
+
+        with mock.patch.object(blob.file.storage, 'delete', side_effect=delete):
+            with self.assertRaises(OSError):
+                Blob.objects.purge(blob.pk)
+
+        # The row was gone when the bytes went, and came back when deleting them failed
+        self.assertEqual(rows_seen, [False])
+        self.assertTrue(Blob.objects.filter(pk=blob.pk).exists())
+        self.assertTrue(os.path.exists(first.file.path))
+
+    def test_dedup_command_collapses_existing_files(self):
+        names = [default_storage.save(f'uploads/legacy{i}.docx', ContentFile(b'old report')) for i in range(3)]
+        for name in names:
+            File.objects.create(file=name, uploaded_by=self.user)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('dedup_uploads', stdout=StringIO())
+
+        blob = Blob.objects.get()
+        self.assertEqual(blob.ref_count, 3)
+        self.assertEqual(set(File.objects.values_list('file', flat=True)), {blob.file.name})
+        self.assertEqual([name for name in names if default_storage.exists(name)], [blob.file.name])
@@ -0,0 +1,144 @@
+import shutil
+import tempfile
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APITestCase
+from sharing_app.models import User
+from sharing_app.serializers import FileUploadSerializer
+
+
+class DownloadTestCase(APITestCase):
+    content = b'slide deck contents'
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        media_settings = override_settings(MEDIA_ROOT=self.media_root)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+
+        ops_user = User.objects.create_user(
+            username='opsuser',
+            email='ops@example.com',
+            password='securepassword',
+            user_type='ops_user'
+        )
+        serializer = FileUploadSerializer(data={'file': SimpleUploadedFile('deck.pptx', self.content)})
+        serializer.is_valid(raise_exception=True)
+        self.file = serializer.save(uploaded_by=ops_user)
+
+        self.client_user = User.objects.create_user(
+            username='client',
+            email='client@example.com',
+            password='securepassword',
+            user_type='client_user',
+            is_verified=True
+        )
+        self.client.force_authenticate(user=self.client_user)
+
+    def download_link(self):
+        response = self.client.post(reverse('file-download', args=[self.file.pk]))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data['download_link'] + '/'
+
+
+class FileDeliveryTests(DownloadTestCase):
+
+    def test_direct_delivery_streams_file(self):
+        response = self.client.get(self.download_link())
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(b''.join(response.streaming_content), self.content)
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="deck.pptx"')
+
+    @override_settings(FILE_DELIVERY_BACKEND='x-accel-redirect')
+    def test_x_accel_redirect_returns_headers_only(self):
+        response = self.client.get(self.download_link())
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['X-Accel-Redirect'], '/protected/' + self.file.file.name)
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="deck.pptx"')
+        self.assertEqual(response.content, b'')
+
+    @override_settings(FILE_DELIVERY_BACKEND='x-sendfile')
+    def test_x_sendfile_returns_absolute_path(self):
+        response = self.client.get(self.download_link())
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['X-Sendfile'], self.file.file.path)
+        self.assertEqual(response.content, b'')
+
+    @override_settings(FILE_DELIVERY_BACKEND='x-accel-redirect')
+    def test_unverified_user_gets_no_redirect_header(self):
+        link = self.download_link()
+        self.client_user.is_verified = False
+        self.client_user.save()
+
+        response = self.client.get(link)
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        self.assertNotIn('X-Accel-Redirect', response)
+
+
+class RangeAndConditionalTests(DownloadTestCase):
+    content = bytes(range(256)) * 4
+
+    def test_full_download_advertises_ranges_and_validators(self):
+        response = self.client.get(self.download_link())
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertTrue(response['ETag'].startswith('"'))
+        self.assertIn('Last-Modified', response)
+
+    def test_single_range(self):
+        response = self.client.get(self.download_link(), HTTP_RANGE='bytes=100-199')
+        self.assertEqual(response.status_code, status.HTTP_206_PARTIAL_CONTENT)
+        self.assertEqual(response['Content-Range'], f'bytes 100-199/{len(self.content)}')
+        self.assertEqual(b''.join(response.streaming_content), self.content[100:200])
+
+    def test_open_ended_and_suffix_ranges(self):
+        link = self.download_link()
+        response = self.client.get(link, HTTP_RANGE='bytes=1000-')
+        self.assertEqual(b''.join(response.streaming_content), self.content[1000:])
+
+        response = self.client.get(link, HTTP_RANGE='bytes=-24')
+        self.assertEqual(b''.join(response.streaming_content), self.content[-24:])
+
+    def test_multiple_ranges(self):
+        response = self.client.get(self.download_link(), HTTP_RANGE='bytes=0-9,500-509')
+        self.assertEqual(response.status_code, status.HTTP_206_PARTIAL_CONTENT)
+        content_type = response['Content-Type']
+        self.assertTrue(content_type.startswith('multipart/byteranges; boundary='))
+        boundary = content_type.split('boundary=')[1].encode()
+
+        body = b''.join(response.streaming_content)
+        self.assertEqual(len(body), int(response['Content-Length']))
+        parts = body.split(b'--' + boundary)[1:-1]
+        self.assertEqual(len(parts), 2)
+        self.assertTrue(parts[0].endswith(b'\r\n\r\n' + self.content[0:10] + b'\r\n'))
+        self.assertIn(f'Content-Range: bytes 500-509/{len(self.content)}'.encode(), parts[1])
+        self.assertTrue(parts[1].endswith(self.content[500:510] + b'\r\n'))
+
+    def test_unsatisfiable_range(self):
+        response = self.client.get(self.download_link(), HTTP_RANGE='bytes=5000-6000')
+        self.assertEqual(response.status_code, status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+        self.assertEqual(response['Content-Range'], f'bytes */{len(self.content)}')
+
+    def test_if_none_match_returns_not_modified(self):
+        link = self.download_link()
+        etag = self.client.get(link)['ETag']
+
+        response = self.client.get(link, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response['ETag'], etag)
+
+    def test_if_modified_since_returns_not_modified(self):
+        link = self.download_link()
+        last_modified = self.client.get(link)['Last-Modified']
+
+        response = self.client.get(link, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_stale_if_range_serves_whole_file(self):
+        response = self.client.get(self.download_link(), HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE='"stale"')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(b''.join(response.streaming_content), self.content)
@@ -0,0 +1,194 @@
+from datetime import timedelta
+
+from django.core.cache import cache
+from django.test import override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APITestCase
+from sharing_app.models import User, File
+from sharing_app.serializers import FileListSerializer
+
+
+class FileListPaginationTests(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.ops_user = User.objects.create_user(
+            username='opsuser',
+            email='ops@example.com',
+            password='securepassword',
+            user_type='ops_user'
+        )
+        self.other_ops_user = User.objects.create_user(
+            username='otherops',
+            email='otherops@example.com',
+            password='securepassword',
+            user_type='ops_user'
+        )
+        self.client_user = User.objects.create_user(
+            username='client',
+            email='client@example.com',
+            password='securepassword',
+            user_type='client_user',
+            is_verified=True
+        )
+
+        # Pairs of files share a timestamp so the id tie-breaker is exercised
+        now = timezone.now()
+        for i in range(25):
+            uploader = self.ops_user if i % 5 else self.other_ops_user
+            File.objects.create(file=f'uploads/file{i}.pptx', uploaded_by=uploader, upload_date=now - timedelta(minutes=i // 2))
+
+    def collect_pages(self, url):
+        ids = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            ids.extend(row['id'] for row in response.data['files'])
+            url = response.data['next']
+        return ids
+
+    def test_pages_cover_every_file_once_in_order(self):
+        self.client.force_authenticate(user=self.client_user)
+        ids = self.collect_pages(reverse('file-list') + '?page_size=4')
+
+        expected = list(File.objects.order_by('-upload_date', '-id').values_list('id', flat=True))
+        self.assertEqual(ids, expected)
+
+    def test_cursor_is_stable_when_new_files_arrive(self):
+        self.client.force_authenticate(user=self.client_user)
+        first_page = self.client.get(reverse('file-list') + '?page_size=10')
+        File.objects.create(file='uploads/new.pptx', uploaded_by=self.ops_user)
+
+        second_page = self.client.get(first_page.data['next'])
+        seen = [row['id'] for row in first_page.data['files']]
+        self.assertFalse(set(seen) & {row['id'] for row in second_page.data['files']})
+
+    def test_ops_user_pages_through_own_files(self):
+        self.client.force_authenticate(user=self.ops_user)
+        ids = self.collect_pages(reverse('file-list') + '?page_size=7')
+        self.assertEqual(set(ids), set(File.objects.filter(uploaded_by=self.ops_user).values_list('id', flat=True)))
+
+    @override_settings(FILE_LIST_PAGE_SIZE=5, FILE_LIST_MAX_PAGE_SIZE=10)
+    def test_page_size_default_and_cap(self):
+        self.client.force_authenticate(user=self.client_user)
+        self.assertEqual(len(self.client.get(reverse('file-list')).data['files']), 5)
+        self.assertEqual(len(self.client.get(reverse('file-list') + '?page_size=500').data['files']), 10)
+
+    def test_invalid_cursor(self):
+        self.client.force_authenticate(user=self.client_user)
+        response = self.client.get(reverse('file-list') + '?cursor=not-a-cursor')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class FileListQueryTests(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.client_user = User.objects.create_user(
+            username='client',
+            email='client@example.com',
+            password='securepassword',
+            user_type='client_user',
+            is_verified=True
+        )
+        self.client.force_authenticate(user=self.client_user)
+        self.uploaders = [
+            User.objects.create_user(
+                username=f'ops{i}',
+                email=f'ops{i}@example.com',
+                password='securepassword',
+                user_type='ops_user'
+            )
+            for i in range(3)
+        ]
+
+    def add_files(self, count):
+        for i in range(count):
+            File.objects.create(file=f'uploads/file{i}.docx', uploaded_by=self.uploaders[i % len(self.uploaders)])
+
+    def test_query_count_constant_as_rows_grow(self):
+        self.add_files(1)
+        with self.assertNumQueries(1):
+            self.client.get(reverse('file-list'))
+
+        self.add_files(30)
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('file-list'))
+        self.assertEqual(len(response.data['files']), 31)
+
+    def test_fast_rows_match_model_serializer(self):
+        self.add_files(5)
+        response = self.client.get(reverse('file-list'))
+
+        request = response.wsgi_request
+        files = File.objects.order_by('-upload_date', '-id')
+        expected = FileListSerializer(files, many=True, context={'request': request}).data
+        self.assertEqual(response.data['files'], expected)
+
+
+class FileListCacheTests(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.ops_user = User.objects.create_user(
+            username='opsuser',
+            email='ops@example.com',
+            password='securepassword',
+            user_type='ops_user'
+        )
+        self.other_ops_user = User.objects.create_user(
+            username='otherops',
+            email='otherops@example.com',
+            password='securepassword',
+            user_type='ops_user'
+        )
+        self.client_user = User.objects.create_user(
+            username='client',
+            email='client@example.com',
+            password='securepassword',
+            user_type='client_user',
+            is_verified=True
+        )
+        File.objects.create(file='uploads/first.pptx', uploaded_by=self.ops_user)
+
+    def test_repeat_request_served_from_cache(self):
+        self.client.force_authenticate(user=self.client_user)
+        first = self.client.get(reverse('file-list'))
+        with self.assertNumQueries(0):
+            second = self.client.get(reverse('file-list'))
+        self.assertEqual(first.data, second.data)
+        self.assertEqual(first['ETag'], second['ETag'])
+
+    def test_matching_etag_returns_not_modified_without_queries(self):
+        self.client.force_authenticate(user=self.client_user)
+        etag = self.client.get(reverse('file-list'))['ETag']
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('file-list'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_new_file_invalidates_client_listing(self):
+        self.client.force_authenticate(user=self.client_user)
+        etag = self.client.get(reverse('file-list'))['ETag']
+
+        with self.captureOnCommitCallbacks(execute=True):
+            File.objects.create(file='uploads/second.pptx', uploaded_by=self.other_ops_user)
+
+        response = self.client.get(reverse('file-list'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(len(response.data['files']), 2)
+
+    def test_ops_audiences_are_separate(self):
+        self.client.force_authenticate(user=self.ops_user)
+        etag = self.client.get(reverse('file-list'))['ETag']
+
+        # Another uploader's file leaves this ops user's cached page valid
+        File.objects.create(file='uploads/other.pptx', uploaded_by=self.other_ops_user)
+        response = self.client.get(reverse('file-list'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        self.client.force_authenticate(user=self.other_ops_user)
+        response = self.client.get(reverse('file-list'))
+        self.assertEqual([row['file'].rsplit('/', 1)[-1] for row in response.data['files']], ['other.pptx'])
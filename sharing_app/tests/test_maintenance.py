@@ -0,0 +1,162 @@
+import os
+import shutil
+import tempfile
+import time
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from sharing_app.maintenance import Maintenance, RateLimiter, walk_storage
+from sharing_app.models import Blob, File, MaintenanceCursor, User, VerificationToken
+
+
+@override_settings(MAINTENANCE_MAX_OPS_PER_SECOND=0)
+class MaintenanceTestCase(TestCase):
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        media_settings = override_settings(MEDIA_ROOT=self.media_root)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+
+        self.user = User.objects.create_user(
+            username='opsuser',
+            email='ops@example.com',
+            password='securepassword',
+            user_type='ops_user'
+        )
+
+    def store(self, name, age=timedelta(days=1)):
+        name = default_storage.save(name, ContentFile(b'data'))
+        stamp = time.time() - age.total_seconds()
+        os.utime(default_storage.path(name), (stamp, stamp))
+        return name
+
+
+class ExpiredTokenTests(MaintenanceTestCase):
+
+    def setUp(self):
+        super().setUp()
+        for i in range(5):
+            user = User.objects.create_user(username=f'user{i}', email=f'user{i}@example.com', password='x')
+            VerificationToken.objects.create(user=user, created_at=timezone.now() - timedelta(days=2))
+        self.fresh = VerificationToken.objects.create(user=self.user)
+
+    def test_expired_tokens_deleted_in_batches(self):
+        report = Maintenance(batch_size=2).run(['tokens'])
+        self.assertEqual(report['expired_tokens'], 5)
+        self.assertEqual(list(VerificationToken.objects.all()), [self.fresh])
+
+    def test_dry_run_only_counts(self):
+        self.assertEqual(Maintenance(dry_run=True).run(['tokens'])['expired_tokens'], 5)
+        self.assertEqual(VerificationToken.objects.count(), 6)
+
+
+class OrphanScanTests(MaintenanceTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.file_name = self.store('uploads/listed.docx')
+        File.objects.create(file=self.file_name, uploaded_by=self.user)
+        self.blob_name = self.store('uploads/blob.pptx')
+        Blob.objects.create(sha256='a' * 64, file=self.blob_name, size=4, ref_count=1)
+        self.orphan = self.store('uploads/orphan.xlsx')
+        self.young = self.store('uploads/young.xlsx', age=timedelta(minutes=1))
+
+    def test_only_old_unreferenced_files_deleted(self):
+        report = Maintenance().run(['orphans'])
+        self.assertEqual(report['orphaned_files'], [(self.orphan, 4)])
+        self.assertFalse(default_storage.exists(self.orphan))
+        for name in (self.file_name, self.blob_name, self.young):
+            self.assertTrue(default_storage.exists(name))
+
+    def test_file_claimed_during_scan_kept(self):
+        maintenance = Maintenance()
+        size = maintenance.storage.size
+
+        def claim(name):
+            # An upload commits a row for the file after its batch was checked
+            File.objects.create(file=name, uploaded_by=self.user)
+            return size(name)
+
+        with mock.patch.object(maintenance.storage, 'size', side_effect=claim):
+            report = maintenance.run(['orphans'])
+        self.assertEqual(report['orphaned_files'], [])
+        self.assertTrue(default_storage.exists(self.orphan))
+
+    def test_file_reused_during_scan_kept(self):
+        maintenance = Maintenance()
+        size = maintenance.storage.size
+
+        def reuse(name):
+            os.utime(default_storage.path(name))  # As saving the same digest again does
+            return size(name)
+
+        with mock.patch.object(maintenance.storage, 'size', side_effect=reuse):
+            report = maintenance.run(['orphans'])
+        self.assertEqual(report['orphaned_files'], [])
+        self.assertTrue(default_storage.exists(self.orphan))
+
+    def test_released_blobs_purged(self):
+        released = self.store('uploads/released.pptx')
+        Blob.objects.create(sha256='c' * 64, file=released, size=4, ref_count=0)  # Its purge never ran
+        report = Maintenance().run(['orphans'])
+        self.assertEqual(report['orphaned_files'], [(released, 4), (self.orphan, 4)])
+        self.assertFalse(default_storage.exists(released))
+        self.assertFalse(Blob.objects.filter(file=released).exists())
+
+    def test_dry_run_keeps_files_and_cursor(self):
+        out = StringIO()
+        call_command('maintenance', '--dry-run', '--task', 'orphans', '--verbosity', '2', stdout=out)
+        self.assertIn(f'orphaned: {self.orphan}', out.getvalue())
+        self.assertIn('Would delete 0 expired token(s) and 1 orphaned file(s) (4 bytes)', out.getvalue())
+        self.assertTrue(default_storage.exists(self.orphan))
+        self.assertFalse(MaintenanceCursor.objects.exists())
+
+    def test_scan_resumes_from_cursor(self):
+        maintenance = lambda: Maintenance(batch_size=1, scan_limit=2).run(['orphans'])
+        self.assertEqual(maintenance()['orphaned_files'], [])  # blob.pptx, listed.docx
+        self.assertEqual(MaintenanceCursor.objects.get(name='orphans').position, self.file_name)
+        self.assertEqual(maintenance()['orphaned_files'], [(self.orphan, 4)])  # orphan.xlsx, young.xlsx
+        maintenance()  # Nothing left: the pass is complete
+        cursor = MaintenanceCursor.objects.get(name='orphans')
+        self.assertEqual((cursor.position, cursor.passes), ('', 1))
+
+    def test_walk_skips_directories_before_cursor(self):
+        names = [self.store(f'uploads/{shard}/file.docx') for shard in ('aa', 'bb', 'cc')]
+        walked = list(walk_storage(default_storage, 'uploads', after=names[1]))
+        self.assertEqual(walked, [self.blob_name, names[2], self.file_name, self.orphan, self.young])
+
+
+class DanglingRowTests(MaintenanceTestCase):
+
+    def test_rows_with_missing_files_reported_not_deleted(self):
+        present = File.objects.create(file=self.store('uploads/present.docx'), uploaded_by=self.user)
+        missing = File.objects.create(file='uploads/missing.docx', uploaded_by=self.user)
+        blob = Blob.objects.create(sha256='b' * 64, file='uploads/gone.pptx', size=4, ref_count=1)
+
+        report = Maintenance().run(['dangling'])
+        self.assertEqual(report['dangling_files'], [missing.pk])
+        self.assertEqual(report['dangling_blobs'], [blob.pk])
+        self.assertTrue(File.objects.filter(pk__in=[present.pk, missing.pk]).count() == 2)
+
+
+class RateLimiterTests(TestCase):
+
+    def test_operations_are_spaced(self):
+        now, slept = [100.0], []
+
+        def sleep(seconds):
+            slept.append(round(seconds, 3))
+            now[0] += seconds
+
+        limiter = RateLimiter(10, clock=lambda: now[0], sleep=sleep)
+        for _ in range(3):
+            limiter.wait()
+        self.assertEqual(slept, [0.1, 0.1])
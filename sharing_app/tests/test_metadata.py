@@ -0,0 +1,146 @@
+import shutil
+import tempfile
+from io import StringIO
+
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APITestCase
+from sharing_app.models import User, File
+from sharing_app.serializers import FileUploadSerializer
+from sharing_app.tests.documents import docx, pptx
+
+
+class FileMetadataTestCase(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        media_settings = override_settings(MEDIA_ROOT=self.media_root)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+
+        self.ops_user = User.objects.create_user(
+            username='opsuser',
+            email='ops@example.com',
+            password='securepassword',
+            user_type='ops_user'
+        )
+        self.client_user = User.objects.create_user(
+            username='client',
+            email='client@example.com',
+            password='securepassword',
+            user_type='client_user',
+            is_verified=True
+        )
+
+    def upload(self, name, content):
+        self.client.force_authenticate(user=self.ops_user)
+        response = self.client.post(reverse('file-upload'), {'file': SimpleUploadedFile(name, content)}, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        return response
+
+    def list_files(self, query=''):
+        self.client.force_authenticate(user=self.client_user)
+        return self.client.get(reverse('file-list') + query)
+
+
+class UploadMetadataTests(FileMetadataTestCase):
+
+    def test_upload_records_metadata(self):
+        content = docx('quarterly numbers')
+        response = self.upload('Q3 Report.docx', content)
+        self.assertEqual(response.data['file_type'], 'docx')
+        self.assertEqual(response.data['file_size'], len(content))
+
+        file_instance = File.objects.get()
+        self.assertEqual(file_instance.original_name, 'Q3 Report.docx')
+        self.assertEqual(file_instance.size, len(content))
+        self.assertEqual(file_instance.extension, 'docx')
+        self.assertEqual(file_instance.content_type, 'application/vnd.openxmlformats-officedocument.wordprocessingml.document')
+        self.assertEqual(file_instance.storage_mtime, default_storage.get_modified_time(file_instance.file.name))
+
+    def test_listing_exposes_metadata(self):
+        content = pptx('slides')
+        self.upload('deck.pptx', content)
+        row = self.list_files().data['files'][0]
+        self.assertEqual(row['original_name'], 'deck.pptx')
+        self.assertEqual(row['size'], len(content))
+        self.assertEqual(row['extension'], 'pptx')
+        self.assertIsNotNone(row['storage_mtime'])
+
+
+class FilterAndSortTests(FileMetadataTestCase):
+
+    def setUp(self):
+        super().setUp()
+        # Saved directly: these tiny bodies are not real documents and would be refused over HTTP
+        for i in range(9):
+            extension = ('docx', 'pptx', 'xlsx')[i % 3]
+            upload = SimpleUploadedFile(f'file{i}.{extension}', b'x' * (i % 4 + 1) + bytes([i]))
+            serializer = FileUploadSerializer(data={'file': upload})
+            serializer.is_valid(raise_exception=True)
+            serializer.save(uploaded_by=self.ops_user)
+
+    def collect(self, query):
+        rows, url = [], reverse('file-list') + query
+        self.client.force_authenticate(user=self.client_user)
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            rows.extend(response.data['files'])
+            url = response.data['next']
+        return rows
+
+    def test_filter_by_type(self):
+        rows = self.collect('?type=docx,.PPTX')
+        self.assertEqual(len(rows), 6)
+        self.assertEqual({row['extension'] for row in rows}, {'docx', 'pptx'})
+
+    def test_filter_by_size(self):
+        rows = self.collect('?min_size=3&max_size=4')
+        self.assertEqual(sorted(row['size'] for row in rows), [3, 3, 4, 4])
+
+    def test_invalid_size_filter(self):
+        self.assertEqual(self.list_files('?min_size=big').status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_sort_by_size_pages_in_order(self):
+        expected = list(File.objects.order_by('size', 'id').values_list('id', flat=True))
+        self.assertEqual([row['id'] for row in self.collect('?ordering=size&page_size=2')], expected)
+        self.assertEqual([row['id'] for row in self.collect('?ordering=-size&page_size=2')], expected[::-1])
+
+    def test_sort_by_size_skips_unknown_sizes(self):
+        File.objects.create(file='uploads/legacy.docx', uploaded_by=self.ops_user)
+        self.assertEqual(len(self.collect('?ordering=size&page_size=4')), 9)
+
+    def test_invalid_ordering(self):
+        self.assertEqual(self.list_files('?ordering=uploaded_by').status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class BackfillMetadataTests(FileMetadataTestCase):
+
+    def test_backfill_fills_missing_metadata(self):
+        name = default_storage.save('uploads/legacy.xlsx', ContentFile(b'old sheet'))
+        legacy = File.objects.create(file=name, uploaded_by=self.ops_user)
+        missing = File.objects.create(file='uploads/gone.docx', uploaded_by=self.ops_user)
+        cached = self.list_files().data['files']
+
+        out, err = StringIO(), StringIO()
+        call_command('backfill_file_metadata', '--batch-size', '1', '--workers', '2', stdout=out, stderr=err)
+        self.assertIn('Updated 1 file(s), 1 missing', out.getvalue())
+        self.assertIn(str(missing.pk), err.getvalue())
+
+        legacy.refresh_from_db()
+        self.assertEqual(legacy.original_name, 'legacy.xlsx')
+        self.assertEqual(legacy.size, 9)
+        self.assertEqual(legacy.extension, 'xlsx')
+        self.assertEqual(legacy.storage_mtime, default_storage.get_modified_time(name))
+
+        # Cached listings are dropped so the new metadata shows up
+        self.assertNotEqual(self.list_files().data['files'], cached)
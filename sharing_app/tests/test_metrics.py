@@ -0,0 +1,151 @@
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import SimpleTestCase, override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APITestCase
+from sharing_app import metrics
+from sharing_app.models import File, User
+from sharing_app.tests.documents import docx
+
+
+class RegistryTests(SimpleTestCase):
+
+    def test_histogram_buckets_are_cumulative(self):
+        registry = metrics.Registry()
+        for value in (0, 1, 4, 500):
+            registry.observe('http_request_queries', value, endpoint='file-list')
+        text = metrics.render([registry.snapshot()])
+        self.assertIn('http_request_queries_bucket{endpoint="file-list",le="0"} 1', text)
+        self.assertIn('http_request_queries_bucket{endpoint="file-list",le="5"} 3', text)
+        self.assertIn('http_request_queries_bucket{endpoint="file-list",le="100"} 3', text)
+        self.assertIn('http_request_queries_bucket{endpoint="file-list",le="+Inf"} 4', text)
+        self.assertIn('http_request_queries_sum{endpoint="file-list"} 505', text)
+        self.assertIn('http_request_queries_count{endpoint="file-list"} 4', text)
+
+    def test_snapshots_of_several_processes_are_added_up(self):
+        first, second = metrics.Registry(), metrics.Registry()
+        first.inc('downloads_total', backend='direct')
+        second.inc('downloads_total', 2, backend='direct')
+        second.inc('downloads_total', backend='archive')
+        second.observe('email_send_duration_seconds', 0.2, result='sent')
+        # Snapshots are read back from JSON files
+        snapshots = [json.loads(json.dumps(registry.snapshot())) for registry in (first, second)]
+        text = metrics.render(snapshots)
+        self.assertIn('downloads_total{backend="direct"} 3', text)
+        self.assertIn('downloads_total{backend="archive"} 1', text)
+        self.assertIn('email_send_duration_seconds_count{result="sent"} 1', text)
+
+    def test_label_values_are_escaped(self):
+        self.assertEqual(metrics.format_labels({'path': 'a"b\\c\n'}), '{path="a\\"b\\\\c\\n"}')
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class MetricsEndpointTests(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        self.metrics_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.metrics_dir, ignore_errors=True)
+        test_settings = override_settings(MEDIA_ROOT=self.media_root, METRICS_DIR=self.metrics_dir)
+        test_settings.enable()
+        self.addCleanup(test_settings.disable)
+        # Start every test from an empty registry writing into its own directory
+        metrics.process_metrics.pid = None
+        self.addCleanup(setattr, metrics.process_metrics, 'pid', None)
+
+        self.ops_user = User.objects.create_user(
+            username='opsuser',
+            email='ops@example.com',
+            password='securepassword',
+            user_type='ops_user'
+        )
+        self.client_user = User.objects.create_user(
+            username='client',
+            email='client@example.com',
+            password='securepassword',
+            user_type='client_user',
+            is_verified=True
+        )
+
+    def scrape(self, **headers):
+        response = self.client.get(reverse('metrics'), **headers)
+        return response, response.content.decode()
+
+    def test_upload_and_download_are_counted(self):
+        self.client.force_authenticate(user=self.ops_user)
+        content = docx('quarterly numbers')
+        upload = SimpleUploadedFile('report.docx', content)
+        response = self.client.post(reverse('file-upload'), {'file': upload}, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        self.client.force_authenticate(user=self.client_user)
+        file_id = File.objects.get().pk
+        link = self.client.post(reverse('file-download', args=[file_id])).data['download_link'] + '/'
+        response = self.client.get(link)
+        self.assertEqual(b''.join(response.streaming_content), content)
+        response.close()
+
+        response, text = self.scrape()
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        self.assertIn(f'upload_bytes_total {len(content)}', text)
+        self.assertIn('upload_throughput_bytes_per_second_count 1', text)
+        self.assertIn('downloads_total{backend="direct"} 1', text)
+        self.assertIn(f'download_bytes_total {len(content)}', text)
+        self.assertIn('storage_operation_duration_seconds_count{operation="save"} 1', text)
+        self.assertIn(
+            'http_request_duration_seconds_count{endpoint="file-upload",method="POST",status="201"} 1', text
+        )
+
+    def test_queries_counted_per_request(self):
+        self.client.force_authenticate(user=self.client_user)
+        self.client.get(reverse('file-list'))
+        _, text = self.scrape()
+        count = next(
+            line for line in text.splitlines() if line.startswith('http_request_queries_count{endpoint="file-list"}')
+        )
+        self.assertEqual(count.split()[-1], '1')
+        self.assertNotIn('http_request_queries_sum{endpoint="file-list"} 0\n', text)
+
+    def test_includes_snapshots_written_by_other_processes(self):
+        other = metrics.Registry()
+        other.inc('downloads_total', 5, backend='x-accel-redirect')
+        with open(os.path.join(self.metrics_dir, 'metrics-1-deadbeef.json'), 'w') as snapshot:
+            json.dump(other.snapshot(), snapshot)
+        _, text = self.scrape()
+        self.assertIn('downloads_total{backend="x-accel-redirect"} 5', text)
+
+    def test_snapshots_of_exited_processes_are_retired(self):
+        exited = subprocess.Popen([sys.executable, '-c', ''])
+        exited.wait()
+        other = metrics.Registry()
+        other.inc('downloads_total', 5, backend='x-accel-redirect')
+        for suffix in ('deadbeef', 'feedface'):
+            metrics.write_snapshot(os.path.join(self.metrics_dir, f'metrics-{exited.pid}-{suffix}.json'), other.snapshot())
+
+        for _ in range(2):  # Folded in once, then neither lost nor counted again
+            _, text = self.scrape()
+            self.assertIn('downloads_total{backend="x-accel-redirect"} 10', text)
+            names = os.listdir(self.metrics_dir)
+            self.assertIn(metrics.RETIRED_NAME, names)
+            self.assertIn(os.path.basename(metrics.process_metrics.path), names)
+            self.assertFalse([name for name in names if name.startswith(f'metrics-{exited.pid}-')])
+
+    @override_settings(METRICS_TOKEN='scrape-secret')
+    def test_token_required_when_configured(self):
+        response, _ = self.scrape()
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        response, _ = self.scrape(HTTP_AUTHORIZATION='Bearer wrong')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        response, _ = self.scrape(HTTP_AUTHORIZATION='Bearer scrape-secret')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
@@ -0,0 +1,206 @@
+from io import StringIO
+from smtplib import SMTPException
+import socketserver
+import threading
+
+from django.conf import settings
+from django.core import mail
+from django.core.mail.backends.locmem import EmailBackend
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APITestCase
+from sharing_app.models import OutgoingEmail, VerificationToken
+from sharing_app.outbox import OutboxWorker
+
+
+class CountingBackend(EmailBackend):
+    """
+    locmem backend that records how many connections were opened.
+    """
+    opened = 0
+
+    def open(self):
+        if not getattr(self, 'is_open', False):
+            CountingBackend.opened += 1
+            self.is_open = True
+        return True
+
+    def close(self):
+        self.is_open = False
+
+
+class FailingBackend(EmailBackend):
+    def send_messages(self, messages):
+        raise SMTPException("Service unavailable")
+
+
+class SMTPHandler(socketserver.StreamRequestHandler):
+    """
+    Just enough SMTP for smtplib. Records the recipients of each message the server accepts.
+    """
+    def reply(self, line):
+        self.wfile.write(f'{line}\r\n'.encode())
+
+    def handle(self):
+        self.server.connections += 1
+        self.reply('220 localhost ESMTP')
+        recipients = []
+        for line in self.rfile:
+            verb = line[:4].decode().upper()
+            if verb in ('EHLO', 'HELO'):
+                self.reply('250 localhost')
+            elif verb == 'MAIL':
+                recipients = []
+                self.reply(self.server.mail_reply)
+            elif verb == 'RCPT':
+                recipients.append(line.decode().split(':', 1)[1].strip().strip('<>'))
+                self.reply('250 OK')
+            elif verb == 'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                for data in self.rfile:
+                    if data == b'.\r\n':
+                        break
+                self.server.received.append(recipients)
+                self.reply('250 OK')
+            elif verb == 'QUIT':
+                self.reply('221 Bye')
+                return
+            else:
+                self.reply('250 OK')  # RSET, NOOP
+
+
+class SMTPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+
+    def __init__(self, mail_reply='250 OK'):
+        super().__init__(('127.0.0.1', 0), SMTPHandler)
+        self.mail_reply = mail_reply  # Answer to MAIL FROM; a 4xx refuses every message
+        self.connections = 0
+        self.received = []
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class OutboxTestCase(TestCase):
+
+    def queue(self, count):
+        OutgoingEmail.objects.bulk_create([
+            OutgoingEmail(to=f'user{i}@example.com', subject='Verify Your Email', body='link')
+            for i in range(count)
+        ])
+
+    def start_smtp_server(self, **kwargs):
+        # An SMTP server on a local port, in a thread, with the SMTP backend pointed at it
+        server = SMTPServer(**kwargs)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        smtp_settings = override_settings(
+            EMAIL_BACKEND='django.core.mail.backends.smtp.EmailBackend',
+            EMAIL_HOST='127.0.0.1',
+            EMAIL_PORT=server.server_address[1],
+            EMAIL_USE_TLS=False,
+            EMAIL_HOST_USER='noreply@example.com',
+            EMAIL_HOST_PASSWORD='',
+            EMAIL_TIMEOUT=5,
+        )
+        smtp_settings.enable()
+        self.addCleanup(smtp_settings.disable)
+        return server
+
+
+class SignupQueuesEmailTests(APITestCase):
+
+    def test_signup_queues_instead_of_sending(self):
+        response = self.client.post(reverse('user-signup'), {
+            'username': 'client',
+            'email': 'client@example.com',
+            'password': 'securepassword',
+            'user_type': 'client_user'
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(mail.outbox), 0)
+
+        email = OutgoingEmail.objects.get()
+        self.assertEqual(email.to, 'client@example.com')
+        token = VerificationToken.objects.get(user__email='client@example.com').token
+        self.assertIn(reverse('email-verification', args=[token]), email.body)
+
+
+class OutboxWorkerTests(OutboxTestCase):
+
+    @override_settings(EMAIL_BACKEND='sharing_app.tests.test_outbox.CountingBackend', EMAIL_OUTBOX_BATCH_SIZE=4)
+    def test_batches_share_one_connection(self):
+        CountingBackend.opened = 0
+        self.queue(10)
+
+        call_command('send_queued_email', stdout=StringIO())
+
+        self.assertEqual(len(mail.outbox), 10)
+        self.assertEqual(CountingBackend.opened, 1)
+        self.assertFalse(OutgoingEmail.objects.exclude(status='sent').exists())
+
+    @override_settings(EMAIL_BACKEND='sharing_app.tests.test_outbox.FailingBackend', EMAIL_OUTBOX_MAX_ATTEMPTS=2)
+    def test_failures_back_off_then_give_up(self):
+        self.queue(1)
+        worker = OutboxWorker()
+
+        self.assertEqual(worker.run_batch(), (0, 1))
+        email = OutgoingEmail.objects.get()
+        self.assertEqual(email.status, 'pending')
+        self.assertGreater(email.next_attempt_at, timezone.now())
+        self.assertEqual(email.last_error, 'Service unavailable')
+
+        # Not due yet, so nothing is retried
+        self.assertEqual(worker.run_batch(), (0, 0))
+
+        OutgoingEmail.objects.update(next_attempt_at=timezone.now())
+        worker.run_batch()
+        self.assertEqual(OutgoingEmail.objects.get().status, 'failed')
+
+
+
+class OutboxSMTPTests(OutboxTestCase):
+
+    @override_settings(EMAIL_OUTBOX_BATCH_SIZE=4)
+    def test_delivered_over_one_smtp_connection(self):
+        server = self.start_smtp_server()
+        self.queue(10)
+
+        call_command('send_queued_email', stdout=StringIO())
+
+        self.assertEqual(sorted(to for to, in server.received), sorted(f'user{i}@example.com' for i in range(10)))
+        self.assertEqual(server.connections, 1)
+        self.assertFalse(OutgoingEmail.objects.exclude(status='sent').exists())
+
+    def test_refused_messages_back_off(self):
+        self.start_smtp_server(mail_reply='451 Try again later')
+        self.queue(2)
+        worker = OutboxWorker()
+        self.addCleanup(worker.close)
+
+        self.assertEqual(worker.run_batch(), (0, 2))
+        for email in OutgoingEmail.objects.all():
+            self.assertEqual((email.status, email.attempts), ('pending', 1))
+            self.assertIn('Try again later', email.last_error)
+            self.assertGreater(email.next_attempt_at, timezone.now())
+
+    def test_unreachable_server_backs_off_leased_messages(self):
+        self.start_smtp_server().stop()  # Nothing listens on its port any more
+        self.queue(3)
+        output = StringIO()
+
+        call_command('send_queued_email', stdout=output)  # Returns instead of raising
+
+        self.assertIn("Sent 0 email(s), 3 failed attempt(s).", output.getvalue())
+        for email in OutgoingEmail.objects.all():
+            self.assertEqual((email.status, email.attempts), ('pending', 1))
+            self.assertIn('Connection refused', email.last_error)
+            # The retry delay replaces the lease
+            self.assertGreater(email.next_attempt_at, timezone.now())
+            self.assertLess(email.next_attempt_at, timezone.now() + settings.EMAIL_OUTBOX_RETRY_DELAY)
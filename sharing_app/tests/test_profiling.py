@@ -0,0 +1,146 @@
+import marshal
+import os
+import pstats
+import shutil
+import tempfile
+from io import StringIO
+from unittest import mock
+
+from django.core import signing
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import DatabaseError, transaction
+from django.test import override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APITestCase
+from sharing_app import profiling
+from sharing_app.models import ProfilingSwitch, RequestProfile, User
+
+
+class RequestProfilingTests(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        profiling.switch_state.reset()
+        self.addCleanup(profiling.switch_state.reset)
+        self.addCleanup(cache.clear)  # Do not leave a published switch behind for other tests
+        self.user = User.objects.create_user(
+            username='client',
+            email='client@example.com',
+            password='securepassword',
+            user_type='client_user',
+            is_verified=True
+        )
+        self.client.force_authenticate(user=self.user)
+
+    def list_files(self, **headers):
+        return self.client.get(reverse('file-list'), **headers)
+
+    def save_switch(self, **fields):
+        with self.captureOnCommitCallbacks(execute=True):  # Published once the save commits
+            return ProfilingSwitch.objects.create(pk=1, **fields)
+
+    def test_requests_not_profiled_by_default(self):
+        response = self.list_files()
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn('X-Profile-Id', response)
+        self.assertFalse(RequestProfile.objects.exists())
+
+    def test_signed_header_profiles_request(self):
+        response = self.list_files(HTTP_X_PROFILE_TOKEN=profiling.make_token())
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        profile = RequestProfile.objects.get(pk=response['X-Profile-Id'])
+        self.assertEqual((profile.method, profile.path, profile.view_name), ('GET', '/api/files/', 'file-list'))
+        self.assertEqual((profile.status_code, profile.trigger), (200, 'header'))
+        self.assertGreaterEqual(profile.query_count, 1)
+        self.assertEqual(len(profile.queries), profile.query_count)
+        self.assertTrue(any('sharing_app_file' in sql for alias, sql, ms in profile.queries))
+        self.assertIn('cumulative', profile.report)
+        self.assertIn('views.py', profile.report)
+
+    def test_forged_or_expired_tokens_ignored(self):
+        self.list_files(HTTP_X_PROFILE_TOKEN='profile:forged:signature')
+        forged = signing.TimestampSigner(salt='another-salt').sign(profiling.TOKEN_VALUE)
+        self.list_files(HTTP_X_PROFILE_TOKEN=forged)
+        with override_settings(PROFILING_TOKEN_MAX_AGE=-1):
+            self.list_files(HTTP_X_PROFILE_TOKEN=profiling.make_token())
+        self.assertFalse(RequestProfile.objects.exists())
+
+    def test_admin_switch_samples_matching_paths(self):
+        self.save_switch(enabled=True, sample_rate=0.5, path_prefix='/api/files/')
+        with mock.patch('sharing_app.profiling.random.random', side_effect=[0.2, 0.7]):
+            self.assertIn('X-Profile-Id', self.list_files())
+            self.assertNotIn('X-Profile-Id', self.list_files())
+        self.client.post(reverse('user-login'), {'email': 'client@example.com', 'password': 'x'}, format='json')
+        self.assertEqual(list(RequestProfile.objects.values_list('trigger', flat=True)), ['sampled'])
+
+    def test_switch_change_applies_at_once(self):
+        switch = self.save_switch(enabled=True, sample_rate=1)
+        self.assertIn('X-Profile-Id', self.list_files())
+        with self.captureOnCommitCallbacks(execute=True):
+            switch.enabled = False
+            switch.save()
+        self.assertNotIn('X-Profile-Id', self.list_files())
+
+    def test_switch_checked_without_queries(self):
+        with override_settings(PROFILING_SWITCH_REFRESH=0), self.assertNumQueries(0):
+            self.client.get(reverse('metrics'))
+        self.save_switch(enabled=True, sample_rate=0)
+        with override_settings(PROFILING_SWITCH_REFRESH=0), self.assertNumQueries(0):
+            self.client.get(reverse('metrics'))
+
+    def test_missing_switch_is_off_until_published(self):
+        self.save_switch(enabled=True, sample_rate=1)
+        cache.clear()  # As after a cache flush
+        profiling.switch_state.reset()
+        self.assertNotIn('X-Profile-Id', self.list_files())
+
+        output = StringIO()
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('request_profiles', publish_switch=True, stdout=output)
+        self.assertEqual(output.getvalue().strip(), "Published the profiling switch.")
+        self.assertIn('X-Profile-Id', self.list_files())
+
+    def test_rolled_back_switch_not_published(self):
+        self.assertNotIn('X-Profile-Id', self.list_files())
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            try:
+                with transaction.atomic():
+                    ProfilingSwitch.objects.create(pk=1, enabled=True, sample_rate=1)
+                    raise DatabaseError
+            except DatabaseError:
+                pass
+        self.assertEqual(callbacks, [])
+        self.assertNotIn('X-Profile-Id', self.list_files())
+        self.assertIsNone(cache.get(profiling.SWITCH_KEY))
+
+    @override_settings(PROFILING_BUFFER_SIZE=2)
+    def test_only_newest_profiles_kept(self):
+        ids = [self.list_files(HTTP_X_PROFILE_TOKEN=profiling.make_token())['X-Profile-Id'] for _ in range(3)]
+        self.assertEqual(sorted(RequestProfile.objects.values_list('pk', flat=True)), [int(pk) for pk in ids[1:]])
+
+    def test_command_lists_shows_and_dumps_profiles(self):
+        profile_id = int(self.list_files(HTTP_X_PROFILE_TOKEN=profiling.make_token())['X-Profile-Id'])
+
+        output = StringIO()
+        call_command('request_profiles', stdout=output)
+        self.assertIn('GET /api/files/  (header)', output.getvalue())
+
+        output = StringIO()
+        call_command('request_profiles', profile_id, stdout=output)
+        self.assertIn('GET /api/files/ -> 200', output.getvalue())
+        self.assertIn('sharing_app_file', output.getvalue())
+
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        path = os.path.join(directory, 'list.prof')
+        call_command('request_profiles', profile_id, dump=path, stdout=StringIO())
+        stats = pstats.Stats(path)
+        self.assertEqual(stats.stats, marshal.loads(RequestProfile.objects.get().stats))
+
+    def test_command_token_is_accepted(self):
+        output = StringIO()
+        call_command('request_profiles', token=True, stdout=output)
+        self.assertIn('X-Profile-Id', self.list_files(HTTP_X_PROFILE_TOKEN=output.getvalue().strip()))
@@ -0,0 +1,160 @@
+from io import StringIO
+import json
+import os
+import tempfile
+from unittest import mock
+
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APITestCase
+from sharing_app.models import User, VerificationToken, OutgoingEmail
+from sharing_app import provisioning
+from sharing_app.provisioning import provision_users
+
+FAST_HASHERS = ['django.contrib.auth.hashers.MD5PasswordHasher']
+
+
+def user_rows(count, start=0, user_type='client_user'):
+    return [
+        {'username': f'user{i}', 'email': f'user{i}@example.com', 'password': 'securepassword', 'user_type': user_type}
+        for i in range(start, start + count)
+    ]
+
+
+@override_settings(PASSWORD_HASHERS=FAST_HASHERS)
+class ProvisionUsersTests(TestCase):
+
+    def test_creates_users_tokens_and_emails(self):
+        created, errors = provision_users(user_rows(3) + user_rows(2, start=3, user_type='ops_user'), workers=0)
+
+        self.assertEqual(errors, [])
+        self.assertEqual(len(created), 5)
+        self.assertTrue(User.objects.get(email='user0@example.com').check_password('securepassword'))
+        self.assertEqual(VerificationToken.objects.count(), 3)
+        self.assertEqual(OutgoingEmail.objects.count(), 3)
+
+    def test_bad_rows_reported_without_aborting_batch(self):
+        User.objects.create_user(username='taken', email='user1@example.com', password='securepassword', user_type='client_user')
+        rows = user_rows(4)
+        rows[2]['user_type'] = 'admin'
+        rows.append(dict(rows[0]))  # Duplicate inside the batch
+
+        created, errors = provision_users(rows, workers=0)
+
+        self.assertEqual({user.email for user in created}, {'user0@example.com', 'user3@example.com'})
+        self.assertEqual([number for number, _ in errors], [2, 3, 5])
+        self.assertIn('email', errors[0][1])
+        self.assertIn('user_type', errors[1][1])
+
+    def test_signups_racing_both_attempts_reported(self):
+        for i in (1, 2):
+            User.objects.create_user(username='racer', email=f'user{i}@example.com', password='securepassword', user_type='client_user')
+        # Neither is visible to the check, and the second only appears after the first retry
+        seen = [set(), {'user1@example.com'}, {'user2@example.com'}]
+        with mock.patch.object(provisioning, 'existing_emails', side_effect=seen):
+            created, errors = provision_users(user_rows(4), workers=0)
+
+        self.assertEqual({user.email for user in created}, {'user0@example.com', 'user3@example.com'})
+        self.assertEqual([number for number, _ in errors], [2, 3])
+        self.assertEqual(errors[1][1], {'email': ["A user with the email 'user2@example.com' already exists."]})
+        self.assertEqual(VerificationToken.objects.filter(user__in=created).count(), 2)
+
+    def test_unexplained_conflict_reported_per_row(self):
+        User.objects.create_user(username='racer', email='user1@example.com', password='securepassword', user_type='client_user')
+        with mock.patch.object(provisioning, 'existing_emails', return_value=set()):
+            created, errors = provision_users(user_rows(3), workers=0)
+
+        self.assertEqual({user.email for user in created}, {'user0@example.com', 'user2@example.com'})
+        self.assertEqual(errors, [(2, {'non_field_errors': ["This user conflicts with an existing user."]})])
+
+    def test_rows_that_are_not_objects_reported(self):
+        created, errors = provision_users([1, user_rows(1)[0], ['user1@example.com']], workers=0)
+        self.assertEqual(len(created), 1)
+        self.assertEqual([number for number, _ in errors], [1, 3])
+        self.assertEqual(errors[0][1], {'non_field_errors': ["Each row must be an object."]})
+
+    @mock.patch('sharing_app.provisioning.EXISTING_EMAIL_CHUNK', 2)
+    def test_ids_fetched_in_chunks_when_bulk_insert_returns_none(self):
+        with mock.patch.object(type(connection.features), 'can_return_rows_from_bulk_insert', False), \
+                CaptureQueriesContext(connection) as queries:
+            created, errors = provision_users(user_rows(5), workers=0)
+        self.assertEqual(sorted(user.email for user in created), [f'user{i}@example.com' for i in range(5)])
+        self.assertEqual(VerificationToken.objects.count(), 5)
+        lookups = [q['sql'] for q in queries if q['sql'].startswith('SELECT') and '"email" IN' in q['sql']]
+        self.assertEqual(len(lookups), 6)  # Three chunks to check for existing emails, three to fetch the ids
+
+    def test_query_count_independent_of_batch_size(self):
+        with CaptureQueriesContext(connection) as small:
+            provision_users(user_rows(5), workers=0)
+        with CaptureQueriesContext(connection) as large:
+            provision_users(user_rows(50, start=5), workers=0)
+        self.assertEqual(len(small), len(large))
+
+    @override_settings(BULK_PROVISIONING_POOL_THRESHOLD=2)
+    def test_passwords_hashed_in_process_pool(self):
+        created, errors = provision_users(user_rows(6), workers=2)
+        self.assertEqual(len(created), 6)
+        self.assertTrue(all(User.objects.get(pk=user.pk).check_password('securepassword') for user in created))
+
+
+@override_settings(PASSWORD_HASHERS=FAST_HASHERS)
+class ImportUsersCommandTests(TestCase):
+
+    def write_file(self, suffix, content):
+        with tempfile.NamedTemporaryFile('w', suffix=suffix, delete=False) as f:
+            f.write(content)
+        self.addCleanup(os.remove, f.name)
+        return f.name
+
+    def test_import_csv(self):
+        path = self.write_file('.csv', 'username,email,password,user_type\n'
+                                       'ann,ann@example.com,securepassword,client_user\n'
+                                       'bob,not-an-email,securepassword,client_user\n')
+        stdout, stderr = StringIO(), StringIO()
+        call_command('import_users', path, workers=0, stdout=stdout, stderr=stderr)
+
+        self.assertTrue(User.objects.filter(email='ann@example.com').exists())
+        self.assertIn('Created 1 user(s); 1 row(s) rejected.', stdout.getvalue())
+        self.assertIn('Row 2: email', stderr.getvalue())
+
+    def test_import_jsonl(self):
+        path = self.write_file('.jsonl', '\n'.join(json.dumps(row) for row in user_rows(3)) + '\n{broken\n')
+        stderr = StringIO()
+        call_command('import_users', path, workers=0, stdout=StringIO(), stderr=stderr)
+
+        self.assertEqual(User.objects.count(), 3)
+        self.assertIn('Row 4', stderr.getvalue())
+
+
+@override_settings(PASSWORD_HASHERS=FAST_HASHERS, BULK_PROVISIONING_HASH_WORKERS=0)
+class BulkProvisioningViewTests(APITestCase):
+
+    def setUp(self):
+        self.admin = User.objects.create_user(
+            username='admin', email='admin@example.com', password='securepassword', user_type='ops_user', is_staff=True
+        )
+
+    def test_staff_can_post_csv(self):
+        self.client.force_authenticate(user=self.admin)
+        body = 'username,email,password,user_type\n' + '\n'.join(
+            f"{row['username']},{row['email']},{row['password']},{row['user_type']}" for row in user_rows(3)
+        )
+        response = self.client.post(reverse('user-bulk-provision'), body, content_type='text/csv')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['created'], 3)
+
+    def test_json_array_with_non_object_row(self):
+        self.client.force_authenticate(user=self.admin)
+        response = self.client.post(reverse('user-bulk-provision'), [1] + user_rows(1), format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['errors'], [{'row': 1, 'errors': {'non_field_errors': ["Each row must be an object."]}}])
+
+    def test_non_staff_rejected(self):
+        user = User.objects.create_user(username='ops', email='ops@example.com', password='securepassword', user_type='ops_user')
+        self.client.force_authenticate(user=user)
+        response = self.client.post(reverse('user-bulk-provision'), user_rows(1), format='json')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
@@ -0,0 +1,130 @@
+import os
+import shutil
+import tempfile
+from io import StringIO
+
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APITestCase
+from sharing_app.models import Blob, File, StorageQuota, User
+from sharing_app.quotas import QuotaExceeded
+from sharing_app.serializers import FileUploadSerializer
+from sharing_app.tests.documents import docx
+from sharing_app.tests.test_upload_validation import counting_body_reads, package
+
+
+class StorageQuotaTests(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        media_settings = override_settings(MEDIA_ROOT=self.media_root)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+
+        self.user = User.objects.create_user(
+            username='opsuser',
+            email='ops@example.com',
+            password='securepassword',
+            user_type='ops_user'
+        )
+        self.client.force_authenticate(user=self.user)
+
+    def upload(self, content, name='report.docx'):
+        return self.client.post(reverse('file-upload'), {'file': SimpleUploadedFile(name, content)}, format='multipart')
+
+    def counters(self):
+        quota = StorageQuota.objects.get(user=self.user)
+        return quota.used_bytes, quota.file_count
+
+    def test_upload_and_delete_keep_counter(self):
+        first, second = docx('first'), docx('second report')
+        self.upload(first)
+        self.upload(second, name='second.docx')
+        self.assertEqual(self.counters(), (len(first) + len(second), 2))
+
+        File.objects.get(original_name='report.docx').delete()
+        self.assertEqual(self.counters(), (len(second), 1))
+
+    def test_identical_uploads_each_charged(self):
+        content = docx('same')
+        self.upload(content, name='a.docx')
+        self.upload(content, name='b.docx')
+        self.assertEqual(self.counters(), (2 * len(content), 2))
+
+    def test_upload_over_quota_reads_nothing(self):
+        StorageQuota.objects.create(user=self.user, limit_bytes=100 * 1024)
+        content = package(('[Content_Types].xml', b'<Types/>'), ('word/media/image.bin', os.urandom(200 * 1024)))
+        with counting_body_reads() as counter:
+            response = self.upload(content)
+        self.assertEqual(response.status_code, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        self.assertIn('storage quota', response.data['file'][0])
+        self.assertEqual(counter['bytes'], 0)
+        self.assertEqual(self.counters(), (0, 0))
+
+    @override_settings(STORAGE_QUOTA_DEFAULT=1000)
+    def test_default_quota_applies_without_limit(self):
+        StorageQuota.objects.create(user=self.user, used_bytes=990)
+        response = self.upload(docx('too much'))
+        self.assertEqual(response.status_code, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+
+    def test_charge_refused_when_quota_filled_meanwhile(self):
+        # The guard passed, but another upload took the space before this one was saved
+        content = docx('late')
+        StorageQuota.objects.create(user=self.user, limit_bytes=len(content), used_bytes=1, file_count=1)
+        serializer = FileUploadSerializer(data={'file': SimpleUploadedFile('late.docx', content)})
+        serializer.is_valid(raise_exception=True)
+        with self.assertRaises(QuotaExceeded):
+            serializer.save(uploaded_by_id=self.user.id)
+        self.assertEqual(self.counters(), (1, 1))
+        self.assertFalse(File.objects.exists())
+        self.assertFalse(Blob.objects.exists())
+
+    def test_charge_fills_quota_exactly(self):
+        StorageQuota.objects.create(user=self.user, limit_bytes=100)
+        self.assertTrue(StorageQuota.objects.charge(self.user.id, 60))
+        self.assertTrue(StorageQuota.objects.charge(self.user.id, 40))
+        self.assertFalse(StorageQuota.objects.charge(self.user.id, 1))
+        self.assertEqual(self.counters(), (100, 2))
+
+    def test_reconcile_fixes_drift(self):
+        content = docx('counted')
+        self.upload(content)
+        other = User.objects.create_user(username='other', email='other@example.com', password='x', user_type='ops_user')
+        StorageQuota.objects.filter(user=self.user).update(used_bytes=5, file_count=7)
+        StorageQuota.objects.create(user=other, used_bytes=50, file_count=1)  # No files left
+
+        output = StringIO()
+        call_command('reconcile_storage_usage', dry_run=True, stdout=output)
+        self.assertEqual(output.getvalue().strip(), "Would correct 2 user(s).")
+        self.assertEqual(self.counters(), (5, 7))
+
+        output = StringIO()
+        call_command('reconcile_storage_usage', batch_size=1, verbosity=2, stdout=output)
+        self.assertIn(f"User {self.user.id}: 5 bytes in 7 file(s) -> {len(content)} bytes in 1 file(s)", output.getvalue())
+        self.assertIn("Corrected 2 user(s).", output.getvalue())
+        self.assertEqual(self.counters(), (len(content), 1))
+        self.assertEqual(StorageQuota.objects.get(user=other).used_bytes, 0)
+
+    @override_settings(STORAGE_QUOTA_DEFAULT=10000)
+    def test_usage_endpoint(self):
+        content = docx('usage')
+        self.upload(content)
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('storage-usage'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, {
+            'used_bytes': len(content), 'file_count': 1, 'limit_bytes': 10000, 'available_bytes': 10000 - len(content),
+        })
+
+    def test_usage_endpoint_for_ops_users_only(self):
+        client_user = User.objects.create_user(
+            username='client', email='client@example.com', password='x', user_type='client_user', is_verified=True
+        )
+        self.client.force_authenticate(user=client_user)
+        self.assertEqual(self.client.get(reverse('storage-usage')).status_code, status.HTTP_403_FORBIDDEN)
@@ -0,0 +1,107 @@
+import shutil
+import tempfile
+
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import RequestFactory, override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APITestCase
+from sharing_app.models import User, File
+from sharing_app.routers import PrimaryReplicaRouter, RoutingState, routing_state, sticky_key
+from sharing_app.tests.documents import docx
+from sharing_app.tokens import tokens_for_user
+
+
+@override_settings(
+    DATABASE_REPLICAS=['replica'],
+    PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'],
+)
+class ReplicaRoutingTests(APITestCase):
+    """
+    'replica' is a second SQLite database that only receives the rows a test copies into it, so
+    what a request returns shows which database it read.
+    """
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        cache.clear()
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        media_settings = override_settings(MEDIA_ROOT=self.media_root)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+
+        self.ops_user = User.objects.create_user(
+            username='opsuser',
+            email='ops@example.com',
+            password='securepassword',
+            user_type='ops_user'
+        )
+        self.client_user = User.objects.create_user(
+            username='client',
+            email='client@example.com',
+            password='securepassword',
+            user_type='client_user',
+            is_verified=True
+        )
+        self.replicate(self.ops_user, self.client_user)
+
+    def replicate(self, *objects):
+        for obj in objects:
+            obj.save(using='replica')
+
+    def authenticate(self, user):
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {tokens_for_user(user).access_token}')
+
+    def listed_names(self, user):
+        self.authenticate(user)
+        response = self.client.get(reverse('file-list'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [row['original_name'] for row in response.data['files']]
+
+    def test_request_reads_go_to_replica(self):
+        replicated = File.objects.create(file='uploads/replicated.docx', original_name='replicated.docx', uploaded_by=self.ops_user)
+        self.replicate(replicated)
+        File.objects.create(file='uploads/lagging.docx', original_name='lagging.docx', uploaded_by=self.ops_user)
+        cache.clear()  # Forget that the listing just changed
+
+        self.assertEqual(self.listed_names(self.client_user), ['replicated.docx'])
+
+    def test_login_reads_replica(self):
+        User.objects.db_manager('replica').create_user(
+            username='newclient', email='new@example.com', password='securepassword',
+            user_type='client_user', is_verified=True,
+        )
+        response = self.client.post(reverse('user-login'), {'email': 'new@example.com', 'password': 'securepassword'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_reads_outside_requests_use_primary(self):
+        self.assertEqual(File.objects.all().db, 'default')
+
+    def test_uploader_reads_own_writes(self):
+        self.authenticate(self.ops_user)
+        response = self.client.post(reverse('file-upload'), {'file': SimpleUploadedFile('new.docx', docx('content'))}, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertTrue(cache.get(sticky_key(self.ops_user.pk)))
+
+        # The replica has not caught up, but the uploader reads the primary
+        self.assertEqual(self.listed_names(self.ops_user), ['new.docx'])
+
+        cache.clear()  # Stickiness and the listing's change marker have expired
+        self.assertEqual(self.listed_names(self.ops_user), [])
+
+    def test_changed_listing_is_built_from_primary(self):
+        File.objects.create(file='uploads/new.docx', original_name='new.docx', uploaded_by=self.ops_user)
+
+        # A page cached from the lagging replica would hide the file until the next change
+        self.assertEqual(self.listed_names(self.client_user), ['new.docx'])
+
+    def test_write_pins_rest_of_request(self):
+        router = PrimaryReplicaRouter()
+        token = routing_state.set(RoutingState(RequestFactory().get('/')))
+        self.addCleanup(routing_state.reset, token)
+
+        self.assertEqual(router.db_for_read(File), 'replica')
+        self.assertEqual(router.db_for_write(File), 'default')
+        self.assertEqual(router.db_for_read(File), 'default')
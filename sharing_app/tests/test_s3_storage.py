@@ -0,0 +1,118 @@
+import hashlib
+import io
+import os
+import zipfile
+from unittest import mock, skipUnless
+
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from sharing_app.delivery import serve_file
+from sharing_app.models import File, User
+
+try:
+    import boto3
+    from moto import mock_aws
+except ImportError:
+    boto3 = None
+
+    def mock_aws(cls):
+        return cls
+
+MIB = 1024 * 1024
+
+
+@skipUnless(boto3, "boto3 and moto are needed for the S3 storage tests")
+@mock_aws
+class S3StorageTests(TestCase):
+
+    def setUp(self):
+        from sharing_app.storage import S3Storage
+
+        boto3.client('s3', region_name='us-east-1').create_bucket(Bucket='uploads')
+        self.storage = S3Storage(
+            'uploads', region_name='us-east-1', access_key='test', secret_key='test',
+            multipart_threshold=5 * MIB, part_size=5 * MIB, max_workers=3,
+        )
+
+    def save(self, content, extension='.docx'):
+        name = self.storage.generate_filename(f'uploads/{hashlib.sha256(content).hexdigest()}{extension}')
+        return self.storage.save(name, ContentFile(content))
+
+    def test_small_file_round_trip(self):
+        name = self.save(b'quarterly numbers')
+        self.assertTrue(self.storage.exists(name))
+        self.assertEqual(self.storage.size(name), 17)
+        with self.storage.open(name) as f:
+            f.seek(10)
+            self.assertEqual(f.read(), b'numbers')
+        self.storage.delete(name)
+        self.assertFalse(self.storage.exists(name))
+
+    def test_large_file_uses_concurrent_multipart_upload(self):
+        content = os.urandom(17 * MIB)
+        with mock.patch.object(self.storage, 'upload_part', wraps=self.storage.upload_part) as upload_part:
+            name = self.save(content)
+        self.assertEqual(upload_part.call_count, 4)
+        with self.storage.open(name) as f:
+            self.assertEqual(hashlib.sha256(f.read()).digest(), hashlib.sha256(content).digest())
+
+    def test_failed_multipart_upload_is_aborted(self):
+        with mock.patch.object(self.storage, 'upload_part', side_effect=RuntimeError('network down')):
+            with self.assertRaises(RuntimeError):
+                self.save(os.urandom(11 * MIB))
+        uploads = self.storage.client.list_multipart_uploads(Bucket='uploads')
+        self.assertEqual(uploads.get('Uploads', []), [])
+
+    def test_zip_members_are_read_with_ranges(self):
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, 'w') as archive:
+            archive.writestr('word/document.xml', '<w:document/>')
+        name = self.save(buffer.getvalue())
+        with self.storage.open(name) as f, zipfile.ZipFile(f) as archive:
+            self.assertEqual(archive.read('word/document.xml'), b'<w:document/>')
+
+    def test_listdir_matches_sharded_layout(self):
+        name = self.save(b'slides', '.pptx')
+        shard, basename = os.path.split(name)
+        self.assertEqual(self.storage.listdir('uploads'), ([shard.split('/')[1]], []))
+        self.assertEqual(self.storage.listdir(shard), ([], [basename]))
+
+    def test_shard_uploads_copies_objects(self):
+        boto3.client('s3', region_name='us-east-1').put_object(Bucket='uploads', Key='uploads/legacy.docx', Body=b'old report')
+        user = User.objects.create_user(username='ops', email='ops@example.com', password='securepassword', user_type='ops_user')
+        legacy = File.objects.create(file='uploads/legacy.docx', uploaded_by=user)
+
+        with mock.patch.object(File._meta.get_field('file'), 'storage', self.storage):
+            out = io.StringIO()
+            call_command('shard_uploads', '--unlink-delay', '0', '--max-ops', '0', stdout=out)
+
+        self.assertIn('Moved 1 file(s)', out.getvalue())
+        legacy.refresh_from_db()
+        self.assertEqual(legacy.file.name, self.storage.shard_name('uploads/legacy.docx'))
+        self.assertFalse(self.storage.exists('uploads/legacy.docx'))
+        with self.storage.open(legacy.file.name) as f:
+            self.assertEqual(f.read(), b'old report')
+
+    @override_settings(FILE_DELIVERY_BACKEND='redirect', FILE_DELIVERY_URL_EXPIRY=30)
+    def test_redirect_delivery_hands_out_presigned_url(self):
+        name = self.save(b'slides', '.pptx')
+        user = User.objects.create_user(username='ops', email='ops@example.com', password='x', user_type='ops_user')
+        with mock.patch.object(File._meta.get_field('file'), 'storage', self.storage):
+            file_instance = File.objects.create(file=name, original_name='deck.pptx', uploaded_by=user)
+            response = serve_file(None, File.objects.get(pk=file_instance.pk))
+        self.assertEqual(response.status_code, 302)
+        self.assertIn('Expires=', response['Location'])
+        self.assertIn('deck.pptx', response['Location'])
+        self.assertEqual(response['Cache-Control'], 'private, no-store')
+
+
+class RedirectDeliveryTests(TestCase):
+
+    @override_settings(FILE_DELIVERY_BACKEND='redirect')
+    def test_redirect_needs_presigning_storage(self):
+        user = User.objects.create_user(username='ops', email='ops@example.com', password='x', user_type='ops_user')
+        file_instance = File.objects.create(file='uploads/deck.pptx', uploaded_by=user)
+        with self.assertRaises(ImproperlyConfigured):
+            serve_file(None, file_instance)
@@ -0,0 +1,151 @@
+import io
+import shutil
+import tempfile
+from io import StringIO
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from unittest import mock
+from django.test import override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APITestCase
+from sharing_app.models import User, File, SearchIndexEntry
+from sharing_app.search import check_search_backend, extract_text, get_backend
+from sharing_app.serializers import FileUploadSerializer
+from sharing_app.tests.documents import W, docx, ooxml, pptx, xlsx
+
+class ExtractTextTests(APITestCase):
+
+    def test_docx_paragraphs(self):
+        text = extract_text(io.BytesIO(docx('Quarterly revenue', 'grew again')), 'docx')
+        self.assertEqual(text.split(), ['Quarterly', 'revenue', 'grew', 'again'])
+
+    def test_pptx_slides_and_xlsx_strings(self):
+        self.assertIn('Roadmap', extract_text(io.BytesIO(pptx('Intro', 'Roadmap')), 'pptx'))
+        self.assertIn('Forecast', extract_text(io.BytesIO(xlsx('Region', 'Forecast')), 'xlsx'))
+
+    def test_other_parts_are_skipped(self):
+        content = ooxml({
+            'word/document.xml': f'<w:document xmlns:w="{W}"><w:p><w:r><w:t>visible</w:t></w:r></w:p></w:document>',
+            'word/styles.xml': f'<w:styles xmlns:w="{W}"><w:t>hidden</w:t></w:styles>',
+        })
+        self.assertNotIn('hidden', extract_text(io.BytesIO(content), 'docx'))
+
+    def test_text_is_truncated(self):
+        self.assertEqual(len(extract_text(io.BytesIO(docx('a' * 50, 'b' * 50)), 'docx', max_chars=60)), 60)
+
+
+class FileSearchTests(APITestCase):
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        media_settings = override_settings(MEDIA_ROOT=self.media_root)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+
+        self.ops_user = User.objects.create_user(
+            username='opsuser',
+            email='ops@example.com',
+            password='securepassword',
+            user_type='ops_user'
+        )
+        self.other_ops_user = User.objects.create_user(
+            username='otherops',
+            email='otherops@example.com',
+            password='securepassword',
+            user_type='ops_user'
+        )
+        self.client_user = User.objects.create_user(
+            username='client',
+            email='client@example.com',
+            password='securepassword',
+            user_type='client_user',
+            is_verified=True
+        )
+        self.report = self.upload('report.docx', docx('Quarterly revenue grew', 'Revenue revenue revenue'), self.ops_user)
+        self.deck = self.upload('deck.pptx', pptx('Revenue roadmap'), self.other_ops_user)
+        self.sheet = self.upload('sheet.xlsx', xlsx('Headcount'), self.ops_user)
+
+    def upload(self, name, content, user):
+        serializer = FileUploadSerializer(data={'file': SimpleUploadedFile(name, content)})
+        serializer.is_valid(raise_exception=True)
+        return serializer.save(uploaded_by=user)
+
+    def index(self):
+        out = StringIO()
+        call_command('index_files', '--workers', '2', stdout=out)
+        return out.getvalue()
+
+    def search(self, user, query):
+        self.client.force_authenticate(user=user)
+        return self.client.get(reverse('file-search'), {'q': query})
+
+    def test_results_are_ranked_with_snippets(self):
+        self.index()
+        response = self.search(self.client_user, 'revenue')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        results = response.data['results']
+        self.assertEqual([row['id'] for row in results], [self.report.pk, self.deck.pk])
+        self.assertIn('[Revenue]', results[1]['snippet'])
+        self.assertEqual(results[0]['original_name'], 'report.docx')
+
+    def test_results_follow_listing_visibility(self):
+        self.index()
+        results = self.search(self.ops_user, 'revenue').data['results']
+        self.assertEqual([row['id'] for row in results], [self.report.pk])
+
+        self.client_user.is_verified = False
+        self.client_user.save()
+        self.assertEqual(self.search(self.client_user, 'revenue').data['results'], [])
+
+    def test_indexing_is_incremental(self):
+        self.assertIn('Indexed 3 file(s)', self.index())
+        self.assertIn('Indexed 0 file(s)', self.index())
+
+        self.upload('new.docx', docx('Revenue memo'), self.ops_user)
+        self.assertIn('Indexed 1 file(s)', self.index())
+
+        # Changed content is picked up again
+        File.objects.filter(pk=self.sheet.pk).update(sha256='0' * 64)
+        self.assertIn('Indexed 1 file(s)', self.index())
+
+    def test_unreadable_file_is_recorded_once(self):
+        File.objects.create(file='uploads/broken.docx', uploaded_by=self.ops_user, sha256='f' * 64)
+        self.assertIn('1 could not be read', self.index())
+        self.assertTrue(SearchIndexEntry.objects.exclude(error='').exists())
+        self.assertIn('Indexed 0 file(s)', self.index())
+
+    def test_query_syntax_is_not_interpreted(self):
+        self.index()
+        response = self.search(self.client_user, 'revenue AND "NEAR(')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_missing_query(self):
+        self.assertEqual(self.search(self.client_user, ' ').status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_deleted_file_leaves_index(self):
+        self.index()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.deck.delete()
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT count(*) FROM sharing_app_file_fts WHERE rowid = %s", [self.deck.pk])
+            self.assertEqual(cursor.fetchone()[0], 0)
+
+    def test_search_runs_no_ddl(self):
+        self.index()
+        with CaptureQueriesContext(connection) as queries:
+            self.search(self.client_user, 'revenue')
+        self.assertFalse([q['sql'] for q in queries if q['sql'].startswith('CREATE')])
+
+    def test_other_databases_fall_back_to_file_names(self):
+        with mock.patch.object(connection, 'vendor', 'mysql'):
+            self.assertEqual([warning.id for warning in check_search_backend(None)], ['sharing_app.W001'])
+            response = self.search(self.client_user, 'deck')
+            get_backend().remove([self.sheet.pk])  # Nothing to remove, and no error
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([row['id'] for row in response.data['results']], [self.deck.pk])
+        self.assertEqual(check_search_backend(None), [])
@@ -0,0 +1,135 @@
+import hashlib
+import os
+import posixpath
+import shutil
+import tempfile
+import time
+from io import StringIO
+
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APITestCase
+from sharing_app.models import Blob, File, User
+from sharing_app.tests.documents import pptx
+
+
+class ShardedStorageTestCase(APITestCase):
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        media_settings = override_settings(MEDIA_ROOT=self.media_root)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+
+        self.storage = File._meta.get_field('file').storage
+        self.user = User.objects.create_user(
+            username='opsuser',
+            email='ops@example.com',
+            password='securepassword',
+            user_type='ops_user'
+        )
+
+
+class ShardedStorageTests(ShardedStorageTestCase):
+
+    def test_uploads_are_stored_under_digest_prefix(self):
+        self.client.force_authenticate(user=self.user)
+        content = pptx('slides')
+        response = self.client.post(reverse('file-upload'), {'file': SimpleUploadedFile('deck.pptx', content)}, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        digest = hashlib.sha256(content).hexdigest()
+        file_instance = File.objects.get()
+        self.assertEqual(file_instance.file.name, f'uploads/{digest[:2]}/{digest[2:4]}/{digest}.pptx')
+        self.assertEqual(file_instance.original_name, 'deck.pptx')
+        self.assertTrue(os.path.exists(file_instance.file.path))
+
+    def test_taken_name_is_reused_not_probed(self):
+        name = self.storage.generate_filename('uploads/' + 'ab' * 32 + '.docx')
+        self.assertEqual(self.storage.save(name, ContentFile(b'same')), name)
+        self.assertEqual(self.storage.save(name, ContentFile(b'same')), name)
+        self.assertEqual(os.listdir(os.path.dirname(self.storage.path(name))), [posixpath.basename(name)])
+
+    def test_reused_name_is_touched(self):
+        name = self.storage.save(self.storage.generate_filename('uploads/' + 'ab' * 32 + '.docx'), ContentFile(b'same'))
+        os.utime(self.storage.path(name), (0, 0))
+        self.storage.save(name, ContentFile(b'same'))
+        self.assertGreater(os.path.getmtime(self.storage.path(name)), time.time() - 60)
+
+    def test_taken_other_name_gets_new_name(self):
+        name = self.storage.generate_filename('uploads/report.docx')
+        self.assertEqual(self.storage.save(name, ContentFile(b'first')), name)
+        other = self.storage.save(name, ContentFile(b'second'))
+        self.assertNotEqual(other, name)
+        self.assertEqual(posixpath.dirname(other), posixpath.dirname(name))
+        with self.storage.open(name) as first:
+            self.assertEqual(first.read(), b'first')
+        with self.storage.open(other) as second:
+            self.assertEqual(second.read(), b'second')
+
+    def test_shard_name_is_idempotent(self):
+        name = self.storage.shard_name('uploads/' + 'cd' * 32 + '.xlsx')
+        self.assertEqual(name, 'uploads/cd/cd/' + 'cd' * 32 + '.xlsx')
+        self.assertEqual(self.storage.shard_name(name), name)
+
+    def test_other_names_shard_on_their_hash(self):
+        key = hashlib.md5(b'report.docx').hexdigest()
+        self.assertEqual(self.storage.shard_name('uploads/report.docx'), f'uploads/{key[:2]}/{key[2:4]}/report.docx')
+
+
+class ShardUploadsCommandTests(ShardedStorageTestCase):
+
+    def setUp(self):
+        super().setUp()
+        # Flat names, as written before sharding
+        self.blob_name = self.write('uploads/' + 'ef' * 32 + '.pptx', b'shared deck')
+        self.blob = Blob.objects.create(sha256='ef' * 32, file=self.blob_name, size=11, ref_count=2)
+        self.shared = [File.objects.create(file=self.blob_name, sha256='ef' * 32, uploaded_by=self.user) for _ in range(2)]
+        self.legacy_name = self.write('uploads/legacy.docx', b'old report')
+        self.legacy = File.objects.create(file=self.legacy_name, uploaded_by=self.user)
+        self.mtime = os.stat(self.storage.path(self.blob_name)).st_mtime
+
+    def write(self, name, content):
+        path = os.path.join(self.media_root, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(content)
+        return name
+
+    def shard(self, *args):
+        out = StringIO()
+        call_command('shard_uploads', '--unlink-delay', '0', '--max-ops', '0', *args, stdout=out, stderr=StringIO())
+        return out.getvalue()
+
+    def test_files_and_rows_move_together(self):
+        self.assertIn('Moved 2 file(s)', self.shard('--batch-size', '1'))
+
+        new_blob_name = self.storage.shard_name(self.blob_name)
+        self.blob.refresh_from_db()
+        self.assertEqual(self.blob.file.name, new_blob_name)
+        self.assertEqual(set(File.objects.filter(sha256='ef' * 32).values_list('file', flat=True)), {new_blob_name})
+        self.legacy.refresh_from_db()
+        self.assertEqual(self.legacy.file.name, self.storage.shard_name(self.legacy_name))
+
+        self.assertFalse(self.storage.exists(self.blob_name))
+        self.assertFalse(self.storage.exists(self.legacy_name))
+        with self.storage.open(new_blob_name) as f:
+            self.assertEqual(f.read(), b'shared deck')
+        self.assertEqual(os.stat(self.storage.path(new_blob_name)).st_mtime, self.mtime)
+
+        self.assertIn('Moved 0 file(s)', self.shard())
+
+    def test_dry_run_moves_nothing(self):
+        self.assertIn('Would move 2 file(s)', self.shard('--dry-run'))
+        self.assertTrue(self.storage.exists(self.blob_name))
+        self.assertEqual(File.objects.get(pk=self.legacy.pk).file.name, self.legacy_name)
+
+    def test_missing_file_is_skipped(self):
+        os.remove(self.storage.path(self.legacy_name))
+        self.assertIn('Moved 1 file(s) into sharded directories; 1 missing', self.shard())
+        self.assertEqual(File.objects.get(pk=self.legacy.pk).file.name, self.legacy_name)
@@ -0,0 +1,145 @@
+import shutil
+import tempfile
+from unittest import mock
+
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import SimpleTestCase, override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APITestCase
+from sharing_app.models import User
+from sharing_app.serializers import FileUploadSerializer
+from sharing_app.throttling import TokenBucket, TokenBucketRateThrottle, paced
+
+RATES = {'login': '10/min', 'login_account': '2/min', 'download_link': '3/min', 'download': '3/min'}
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class TokenBucketTests(SimpleTestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.clock = FakeClock()
+
+    def bucket(self, capacity=3, rate=1):
+        return TokenBucket('test_bucket', capacity, rate, timer=self.clock)
+
+    def test_allows_burst_then_refills_at_rate(self):
+        bucket = self.bucket()
+        self.assertEqual([bucket.take() for _ in range(3)], [0, 0, 0])
+        self.assertEqual(bucket.take(), 1.0)
+
+        self.clock.now += 1
+        self.assertEqual(bucket.take(), 0)
+        self.assertEqual(bucket.take(), 1.0)
+
+    def test_refused_takes_do_not_extend_wait(self):
+        bucket = self.bucket()
+        for _ in range(3):
+            bucket.take()
+        self.assertEqual([bucket.take() for _ in range(5)], [1.0] * 5)
+
+    def test_idle_time_fills_at_most_one_bucket(self):
+        bucket = self.bucket()
+        bucket.take()
+        self.clock.now += 3600
+        self.assertEqual([bucket.take() for _ in range(4)], [0, 0, 0, 1.0])
+
+    def test_paced_blocks_keep_to_rate(self):
+        bucket = self.bucket(capacity=100, rate=100)
+        blocks = [b'x' * 150, b'y' * 50, b'z' * 200]
+        with mock.patch('sharing_app.throttling.time.sleep', self.clock.sleep):
+            sent = list(paced(iter(blocks), bucket))
+        self.assertEqual(sent, blocks)
+        # 400 bytes at 100/s with a 100-byte burst
+        self.assertAlmostEqual(self.clock.now - 1000.0, 3.0)
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class RequestThrottleTests(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        rates = mock.patch.object(TokenBucketRateThrottle, 'THROTTLE_RATES', RATES)
+        rates.start()
+        self.addCleanup(rates.stop)
+
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        media_settings = override_settings(MEDIA_ROOT=self.media_root)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+
+        ops_user = User.objects.create_user(
+            username='opsuser',
+            email='ops@example.com',
+            password='securepassword',
+            user_type='ops_user'
+        )
+        serializer = FileUploadSerializer(data={'file': SimpleUploadedFile('deck.pptx', b'slide deck contents')})
+        serializer.is_valid(raise_exception=True)
+        self.file = serializer.save(uploaded_by=ops_user)
+        self.client_user = User.objects.create_user(
+            username='client',
+            email='client@example.com',
+            password='securepassword',
+            user_type='client_user',
+            is_verified=True
+        )
+
+    def login(self, email, password='wrongpassword'):
+        return self.client.post(reverse('user-login'), {'email': email, 'password': password}, format='json')
+
+    def test_login_attempts_limited_per_account(self):
+        self.assertEqual(self.login('client@example.com').status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.login('Client@Example.com').status_code, status.HTTP_400_BAD_REQUEST)
+
+        response = self.login('client@example.com', 'securepassword')
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(response['Retry-After'], '30')
+
+        # Other accounts are unaffected
+        self.assertEqual(self.login('ops@example.com').status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_download_links_limited_per_user(self):
+        self.client.force_authenticate(user=self.client_user)
+        url = reverse('file-download', args=[self.file.pk])
+        for _ in range(3):
+            self.assertEqual(self.client.post(url).status_code, status.HTTP_200_OK)
+        response = self.client.post(url)
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(response['Retry-After'], '20')
+
+    def test_links_and_downloads_have_separate_buckets(self):
+        self.client.force_authenticate(user=self.client_user)
+        link = self.client.post(reverse('file-download', args=[self.file.pk])).data['download_link'] + '/'
+        for _ in range(3):
+            self.assertEqual(self.client.get(link).status_code, status.HTTP_200_OK)
+        self.assertEqual(self.client.get(link).status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(self.client.post(reverse('file-download', args=[self.file.pk])).status_code, status.HTTP_200_OK)
+
+    @override_settings(FILE_DOWNLOAD_BANDWIDTH=1024)
+    def test_bandwidth_cap_streams_through_python(self):
+        self.client.force_authenticate(user=self.client_user)
+        link = self.client.post(reverse('file-download', args=[self.file.pk])).data['download_link'] + '/'
+        response = self.client.get(link)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Length'], '19')
+        self.assertEqual(b''.join(response.streaming_content), b'slide deck contents')
+
+    @override_settings(FILE_DOWNLOAD_BANDWIDTH=1024, FILE_DELIVERY_BACKEND='x-accel-redirect')
+    def test_bandwidth_cap_passed_to_nginx(self):
+        self.client.force_authenticate(user=self.client_user)
+        link = self.client.post(reverse('file-download', args=[self.file.pk])).data['download_link'] + '/'
+        self.assertEqual(self.client.get(link)['X-Accel-Limit-Rate'], '1024')
@@ -0,0 +1,96 @@
+from django.core.cache import cache
+from django.test import override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APITestCase
+from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
+from sharing_app.models import User, File
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class ClaimsTokenTests(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(
+            username='client',
+            email='client@example.com',
+            password='securepassword',
+            user_type='client_user',
+            is_verified=True
+        )
+        ops_user = User.objects.create_user(
+            username='opsuser',
+            email='ops@example.com',
+            password='securepassword',
+            user_type='ops_user'
+        )
+        File.objects.create(file='uploads/deck.pptx', uploaded_by=ops_user)
+
+    def login(self):
+        response = self.client.post(reverse('user-login'), {'email': 'client@example.com', 'password': 'securepassword'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+
+    def test_login_embeds_user_claims(self):
+        access = AccessToken(self.login()['access'])
+        self.assertEqual(access['user_type'], 'client_user')
+        self.assertTrue(access['is_verified'])
+        self.assertEqual(access['email'], 'client@example.com')
+
+    def test_listing_makes_no_user_query(self):
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + self.login()['access'])
+        with self.assertNumQueries(1):  # The page itself
+            response = self.client.get(reverse('file-list'))
+        self.assertEqual(len(response.data['files']), 1)
+
+    def test_download_link_permission_from_claims(self):
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + self.login()['access'])
+        file_id = File.objects.get().pk
+        with self.assertNumQueries(1):  # The file lookup
+            response = self.client.post(reverse('file-download', args=[file_id]))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_token_without_claims_rejected(self):
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(self.user).access_token}')
+        response = self.client.get(reverse('file-list'))
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_changing_user_type_revokes_tokens(self):
+        tokens = self.login()
+        self.user.user_type = 'ops_user'
+        self.user.save()
+
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + tokens['access'])
+        self.assertEqual(self.client.get(reverse('file-list')).status_code, status.HTTP_401_UNAUTHORIZED)
+
+        self.client.credentials()
+        response = self.client.post(reverse('token-refresh'), {'refresh': tokens['refresh']}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_login_right_after_revocation_accepted(self):
+        old = self.login()
+        self.user.set_password('securepassword')
+        self.user.save()  # Revokes the old tokens
+        tokens = self.login()  # Usually within the same second
+
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + tokens['access'])
+        self.assertEqual(self.client.get(reverse('file-list')).status_code, status.HTTP_200_OK)
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + old['access'])
+        self.assertEqual(self.client.get(reverse('file-list')).status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_unrelated_change_keeps_tokens(self):
+        tokens = self.login()
+        self.user.first_name = 'Ann'
+        self.user.save()
+
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + tokens['access'])
+        self.assertEqual(self.client.get(reverse('file-list')).status_code, status.HTTP_200_OK)
+
+    def test_refresh_issues_current_claims(self):
+        tokens = self.login()
+        User.objects.filter(pk=self.user.pk).update(email='renamed@example.com')  # Bypasses revocation
+
+        response = self.client.post(reverse('token-refresh'), {'refresh': tokens['refresh']}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(AccessToken(response.data['access'])['email'], 'renamed@example.com')
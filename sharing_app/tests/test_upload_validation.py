@@ -0,0 +1,197 @@
+import io
+import os
+import shutil
+import tempfile
+import zipfile
+from contextlib import contextmanager
+from unittest import mock
+
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.handlers.wsgi import LimitedStream
+from django.test import SimpleTestCase, override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APITestCase
+from sharing_app.models import File, User
+from sharing_app.tests.documents import docx
+from sharing_app.tokens import tokens_for_user
+from sharing_app.uploadhandlers import find_content_types, lists_content_types
+
+MiB = 1024 * 1024
+
+
+class Unseekable(io.RawIOBase):
+    def __init__(self):
+        self.buffer = io.BytesIO()
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        return self.buffer.write(data)
+
+
+def package(*entries, stream=False):
+    # entries are (name, data); stream=True writes data descriptors, as zipfile does when it cannot seek
+    sink = Unseekable() if stream else io.BytesIO()
+    with zipfile.ZipFile(sink, 'w', zipfile.ZIP_STORED) as archive:
+        for name, data in entries:
+            archive.writestr(name, data)
+    return (sink.buffer if stream else sink).getvalue()
+
+
+@contextmanager
+def counting_body_reads():
+    # Counts the request body bytes the view pulls from the server
+    counter = {'bytes': 0}
+    read = LimitedStream.read
+
+    def counted(stream, size=-1):
+        data = read(stream, size)
+        counter['bytes'] += len(data)
+        return data
+
+    with mock.patch.object(LimitedStream, 'read', counted):
+        yield counter
+
+
+class SniffTests(SimpleTestCase):
+
+    def test_content_types_found_in_head(self):
+        self.assertIs(find_content_types(docx('hello')[:100]), True)
+
+    def test_non_zip_rejected(self):
+        self.assertIs(find_content_types(b'%PDF-1.7\n' + b'x' * 100), False)
+
+    def test_package_without_content_types_rejected(self):
+        self.assertIs(find_content_types(package(('word/document.xml', b'<w:document/>'))), False)
+
+    def test_undecided_until_enough_bytes(self):
+        data = package(('word/media/image.bin', b'x' * 1000), ('[Content_Types].xml', b'<Types/>'))
+        self.assertIsNone(find_content_types(data[:500]))
+        self.assertIs(find_content_types(data), True)
+
+    def test_central_directory_checked_when_head_undecided(self):
+        data = package(('word/document.xml', b'x' * 100), ('[Content_Types].xml', b'<Types/>'), stream=True)
+        self.assertIsNone(find_content_types(data))
+        self.assertIs(lists_content_types(data), True)
+        self.assertIs(lists_content_types(package(('word/document.xml', b'x'), stream=True)), False)
+        self.assertIs(lists_content_types(b'x' * 100), False)
+
+
+@override_settings(FILE_UPLOAD_SNIFF_SIZE=4096)
+class UploadGuardTests(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        media_settings = override_settings(MEDIA_ROOT=self.media_root)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+
+        self.user = User.objects.create_user(
+            username='opsuser',
+            email='ops@example.com',
+            password='securepassword',
+            user_type='ops_user',
+            upload_size_limit=MiB
+        )
+        self.client.force_authenticate(user=self.user)
+
+    def upload(self, name, content):
+        with counting_body_reads() as counter:
+            response = self.client.post(reverse('file-upload'), {'file': SimpleUploadedFile(name, content)}, format='multipart')
+        return response, counter['bytes']
+
+    def test_valid_document_accepted(self):
+        content = docx('quarterly numbers')
+        response, read = self.upload('report.docx', content)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertGreater(read, len(content))
+
+    def test_content_length_over_limit_reads_nothing(self):
+        content = package(('[Content_Types].xml', b'<Types/>'), ('ppt/media/video.bin', os.urandom(2 * MiB)))
+        response, read = self.upload('deck.pptx', content)
+        self.assertEqual(response.status_code, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        self.assertEqual(read, 0)
+        self.assertFalse(File.objects.exists())
+
+    def test_size_enforced_while_streaming(self):
+        # A large allowance lets the body past the Content-Length check; the running size stops it
+        content = package(('[Content_Types].xml', b'<Types/>'), ('ppt/media/video.bin', b'v' * 3 * MiB))
+        with mock.patch('sharing_app.uploadhandlers.ENVELOPE_ALLOWANCE', 4 * MiB):
+            response, read = self.upload('deck.pptx', content)
+        self.assertEqual(response.status_code, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        self.assertLessEqual(read, MiB + 2 * 64 * 1024)
+        self.assertFalse(File.objects.exists())
+
+    def test_non_zip_rejected_after_first_chunk(self):
+        response, read = self.upload('report.docx', b'%PDF-1.7\n' + b'x' * (MiB - 100))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['file'], ["File is not a valid Office Open XML document."])
+        self.assertLessEqual(read, 2 * 64 * 1024)
+
+    def test_wrong_extension_rejected_before_file_data(self):
+        response, read = self.upload('notes.txt', docx('x') + b'x' * (MiB - 10000))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('Only .pptx, .docx, and .xlsx', str(response.data['file']))
+        self.assertLessEqual(read, 2 * 64 * 1024)
+
+    def test_content_types_written_last_accepted(self):
+        # Some writers put [Content_Types].xml after the parts; the central directory lists it
+        content = package(('xl/worksheets/sheet1.xml', b's' * 200 * 1024), ('[Content_Types].xml', b'<Types/>'), stream=True)
+        response, _ = self.upload('sheet.xlsx', content)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        content = package(('xl/worksheets/sheet1.xml', b's' * 200 * 1024), stream=True)
+        response, _ = self.upload('other.xlsx', content)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    @override_settings(FILE_UPLOAD_MAX_SIZE=1000)
+    def test_default_limit_applies_without_user_limit(self):
+        self.user.upload_size_limit = None
+        self.user.save()
+        response, read = self.upload('deck.pptx', package(('[Content_Types].xml', b'<Types/>'), ('a', b'a' * 100 * 1024)))
+        self.assertEqual(response.status_code, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        self.assertEqual(read, 0)
+
+    async def test_async_upload_rejected(self):
+        token = str(tokens_for_user(self.user).access_token)
+        response = await self.async_client.post(
+            reverse('async-file-upload'),
+            {'file': SimpleUploadedFile('report.docx', b'not a document')},
+            headers={'Authorization': f'Bearer {token}'},
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.json(), {'file': ["File is not a valid Office Open XML document."]})
+
+    def test_resumable_chunks_limited(self):
+        with self.settings(UPLOAD_SESSION_DIR=os.path.join(self.media_root, 'sessions')):
+            session_id = self.client.post(reverse('upload-session-create'), {'file_name': 'deck.pptx'}, format='json').data['id']
+            response = self.client.put(
+                reverse('upload-session-chunk', args=[session_id, 0]),
+                b'x' * (MiB + 1),
+                content_type='application/octet-stream',
+                HTTP_UPLOAD_OFFSET='0',
+            )
+        self.assertEqual(response.status_code, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+
+    def test_resumable_non_package_rejected_at_completion(self):
+        content = package(('word/document.xml', b'<w:document/>'))  # A zip, but no [Content_Types].xml
+        with self.settings(UPLOAD_SESSION_DIR=os.path.join(self.media_root, 'sessions')):
+            session_id = self.client.post(
+                reverse('upload-session-create'), {'file_name': 'report.docx', 'total_size': len(content)}, format='json'
+            ).data['id']
+            response = self.client.put(
+                reverse('upload-session-chunk', args=[session_id, 0]),
+                content,
+                content_type='application/octet-stream',
+                HTTP_UPLOAD_OFFSET='0',
+            )
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            response = self.client.post(reverse('upload-session-complete', args=[session_id]))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data, {'file': ["File is not a valid Office Open XML document."]})
+        self.assertFalse(File.objects.exists())
@@ -0,0 +1,179 @@
+from datetime import timedelta
+from io import StringIO
+import os
+import shutil
+import tempfile
+from unittest import mock
+
+from django.core.management import call_command
+from django.test import override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APITestCase
+from sharing_app.models import User, File, UploadSession
+from sharing_app.tests.documents import pptx
+from sharing_app.utils import spool_chunk
+from sharing_app.views import UploadSessionCompleteView
+
+TEMP_DIR = tempfile.mkdtemp()
+
+
+@override_settings(MEDIA_ROOT=os.path.join(TEMP_DIR, 'media'), UPLOAD_SESSION_DIR=os.path.join(TEMP_DIR, 'sessions'))
+class ResumableUploadTests(APITestCase):
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_DIR, ignore_errors=True)
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='opsuser',
+            email='ops@example.com',
+            password='securepassword',
+            user_type='ops_user'
+        )
+        self.client.force_authenticate(user=self.user)
+
+    def start_session(self, file_name='deck.pptx', total_size=None):
+        data = {'file_name': file_name}
+        if total_size is not None:
+            data['total_size'] = total_size
+        return self.client.post(reverse('upload-session-create'), data, format='json')
+
+    def send_chunk(self, session_id, index, offset, data):
+        return self.client.put(
+            reverse('upload-session-chunk', args=[session_id, index]),
+            data,
+            content_type='application/octet-stream',
+            HTTP_UPLOAD_OFFSET=str(offset),
+        )
+
+    def test_chunked_upload_creates_file(self):
+        content = pptx('Roadmap')
+        session_id = self.start_session(total_size=len(content)).data['id']
+
+        for index, offset in enumerate(range(0, len(content), 30)):
+            response = self.send_chunk(session_id, index, offset, content[offset:offset + 30])
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Upload-Offset'], str(len(content)))
+
+        response = self.client.post(reverse('upload-session-complete', args=[session_id]))
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['file_type'], 'pptx')
+
+        file_instance = File.objects.get(uploaded_by=self.user)
+        with file_instance.file.open('rb') as f:
+            self.assertEqual(f.read(), content)
+        self.assertFalse(UploadSession.objects.exists())
+
+    def test_resume_after_interrupted_chunk(self):
+        session_id = self.start_session().data['id']
+        self.send_chunk(session_id, 0, 0, b'a' * 10)
+
+        # A retried chunk at a stale offset is refused and the client is told where to resume
+        response = self.send_chunk(session_id, 0, 0, b'a' * 10)
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(response.data['offset'], 10)
+        self.assertEqual(response.data['next_chunk'], 1)
+
+        response = self.client.get(reverse('upload-session', args=[session_id]))
+        self.assertEqual(response['Upload-Offset'], '10')
+
+        response = self.send_chunk(session_id, 1, 10, b'b' * 5)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['offset'], 15)
+
+    def test_concurrent_chunks_for_one_offset_write_once(self):
+        session_id = self.start_session().data['id']
+        responses = []
+
+        def spool_while_another_request_wins(*args):
+            spooled = spool_chunk(*args)
+            if not responses:  # The competing request arrives while this body is still being received
+                responses.append(None)
+                responses[0] = self.send_chunk(session_id, 0, 0, b'a' * 10)
+            return spooled
+
+        with mock.patch('sharing_app.views.spool_chunk', side_effect=spool_while_another_request_wins):
+            response = self.send_chunk(session_id, 0, 0, b'b' * 10)
+
+        self.assertEqual(responses[0].status_code, status.HTTP_200_OK)
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        session = UploadSession.objects.get(pk=session_id)
+        self.assertEqual((session.offset, session.chunk_count), (10, 1))
+        with open(session.part_path, 'rb') as part:
+            self.assertEqual(part.read(), b'a' * 10)
+        self.assertEqual([name for name in os.listdir(os.path.dirname(session.part_path)) if name.endswith('.chunk')], [])
+
+    def test_concurrent_completes_create_one_file(self):
+        content = pptx('Roadmap')
+        session_id = self.start_session(total_size=len(content)).data['id']
+        self.send_chunk(session_id, 0, 0, content)
+        get_object = UploadSessionCompleteView.get_object
+        responses = []
+
+        def read_while_another_request_completes(view):
+            session = get_object(view)
+            if not responses:  # The competing request completes between this one's read and its lock
+                responses.append(None)
+                responses[0] = self.client.post(reverse('upload-session-complete', args=[session_id]))
+            return session
+
+        with mock.patch.object(
+            UploadSessionCompleteView, 'get_object', autospec=True, side_effect=read_while_another_request_completes
+        ):
+            response = self.client.post(reverse('upload-session-complete', args=[session_id]))
+
+        self.assertEqual(responses[0].status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(File.objects.count(), 1)
+
+    def test_lost_partial_data_restarts_upload(self):
+        session_id = self.start_session().data['id']
+        self.send_chunk(session_id, 0, 0, b'a' * 10)
+        os.remove(UploadSession.objects.get(pk=session_id).part_path)
+
+        response = self.send_chunk(session_id, 1, 10, b'b' * 10)
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual((response.data['offset'], response.data['next_chunk']), (0, 0))
+        self.assertEqual(response['Upload-Offset'], '0')
+
+        self.assertEqual(self.send_chunk(session_id, 0, 0, b'a' * 10).status_code, status.HTTP_200_OK)
+        self.assertEqual(self.send_chunk(session_id, 1, 10, b'b' * 10).data['offset'], 20)
+
+    def test_incomplete_upload_cannot_be_completed(self):
+        session_id = self.start_session(total_size=20).data['id']
+        self.send_chunk(session_id, 0, 0, b'a' * 10)
+
+        response = self.client.post(reverse('upload-session-complete', args=[session_id]))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(File.objects.exists())
+
+    def test_invalid_file_type_rejected_up_front(self):
+        response = self.start_session(file_name='notes.txt')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('file_name', response.data)
+
+    def test_client_user_cannot_start_session(self):
+        client_user = User.objects.create_user(
+            username='client',
+            email='client@example.com',
+            password='securepassword',
+            user_type='client_user',
+            is_verified=True
+        )
+        self.client.force_authenticate(user=client_user)
+        response = self.start_session()
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_purge_removes_expired_sessions(self):
+        session_id = self.start_session().data['id']
+        self.send_chunk(session_id, 0, 0, b'a' * 10)
+        session = UploadSession.objects.get(pk=session_id)
+        UploadSession.objects.filter(pk=session_id).update(expires_at=timezone.now() - timedelta(minutes=1))
+
+        call_command('purge_upload_sessions', stdout=StringIO())
+        self.assertFalse(UploadSession.objects.exists())
+        self.assertFalse(os.path.exists(session.part_path))
@@ -0,0 +1,150 @@
+"""
+Token-bucket rate limits shared by every worker through the cache.
+
+A bucket holds up to `capacity` tokens and refills continuously at `rate` tokens per second. It
+lives in two cache entries: the time it was last refilled from (`epoch`) and the number of tokens
+taken since then (`taken`). Taking tokens is one atomic incr, so concurrent workers never
+overwrite each other's counts, and there are no database writes. A refused take is handed back,
+so clients that keep retrying while over the limit do not push their wait further out.
+When a bucket has been idle long enough to fill up, its epoch moves forward so unused time never
+adds up to more than one full bucket. Racing workers move it to nearly the same place, so the
+race can cost at most a token or two.
+
+Request limits are DRF throttles, so over-limit requests get 429 with a Retry-After header. Rates
+use DRF's "<count>/<period>" form in REST_FRAMEWORK['DEFAULT_THROTTLE_RATES']. A count of N per
+period allows a burst of N, then N per period.
+
+    ScopedBucketThrottle  Per user (per client IP when anonymous), for the view's `throttle_scope`.
+    LoginAccountThrottle  Per email address tried at login, whichever IP it comes from.
+
+Download bandwidth is also a bucket, with one token per byte (FILE_DOWNLOAD_BANDWIDTH). The
+response body takes tokens before each block, so one user's downloads share the cap.
+"""
+import asyncio
+import hashlib
+import math
+import time
+
+from django.conf import settings
+from django.core.cache import cache as default_cache
+from rest_framework.throttling import ScopedRateThrottle, SimpleRateThrottle
+
+IDLE_TIMEOUT = 3600  # Seconds an idle bucket is kept beyond the time it takes to refill
+
+
+class TokenBucket:
+    def __init__(self, key, capacity, rate, cache=default_cache, timer=time.time):
+        self.key = key
+        self.capacity = capacity
+        self.rate = rate  # Tokens per second
+        self.cache = cache
+        self.timer = timer
+        self.timeout = math.ceil(capacity / rate) + IDLE_TIMEOUT
+
+    def take(self, tokens=1):
+        """
+        Takes `tokens` if the bucket holds them and returns 0, or returns the seconds until it will.
+        """
+        now = self.timer()
+        epoch_key, taken_key = f'{self.key}:epoch', f'{self.key}:taken'
+        epoch = self.cache.get(epoch_key)
+        if epoch is None:
+            self.cache.add(epoch_key, now, self.timeout)
+            epoch = self.cache.get(epoch_key, now)
+        try:
+            taken = self.cache.incr(taken_key, tokens)
+        except ValueError:
+            # Created on first use, or evicted; an evicted bucket starts full again
+            self.cache.add(taken_key, 0, self.timeout)
+            taken = self.cache.incr(taken_key, tokens)
+
+        refilled = (now - epoch) * self.rate
+        remaining = self.capacity + refilled - taken
+        if remaining < 0:
+            self.cache.decr(taken_key, tokens)
+            return -remaining / self.rate
+        if refilled > taken - tokens:
+            # The bucket was full before this take; refill from now on
+            self.cache.set(epoch_key, now - (taken - tokens) / self.rate, self.timeout)
+        return 0
+
+    def consume(self, tokens):
+        # Waits until `tokens` were taken, in pieces no larger than the bucket can hold
+        while tokens > 0:
+            piece = min(tokens, self.capacity)
+            wait = self.take(piece)
+            if wait:
+                time.sleep(wait)
+            else:
+                tokens -= piece
+
+    async def aconsume(self, tokens):
+        while tokens > 0:
+            piece = min(tokens, self.capacity)
+            wait = await asyncio.to_thread(self.take, piece)  # Cache calls may block on the network
+            if wait:
+                await asyncio.sleep(wait)
+            else:
+                tokens -= piece
+
+
+class TokenBucketRateThrottle(SimpleRateThrottle):
+    """
+    SimpleRateThrottle backed by a TokenBucket instead of a list of request times.
+    """
+    def allow_request(self, request, view):
+        if self.rate is None:
+            return True
+        key = self.get_cache_key(request, view)
+        if key is None:
+            return True
+        bucket = TokenBucket(key, self.num_requests, self.num_requests / self.duration, self.cache, self.timer)
+        self.wait_time = bucket.take()
+        return not self.wait_time
+
+    def wait(self):
+        return self.wait_time
+
+
+class ScopedBucketThrottle(ScopedRateThrottle, TokenBucketRateThrottle):
+    """
+    Limits each user, or each client IP when anonymous, per the view's `throttle_scope`.
+    """
+
+
+class LoginAccountThrottle(TokenBucketRateThrottle):
+    """
+    Limits login attempts per email address, so guessing one account's password from many IPs
+    is slowed too.
+    """
+    scope = 'login_account'
+
+    def get_cache_key(self, request, view):
+        email = request.data.get('email')
+        if not isinstance(email, str) or not email.strip():
+            return None  # Rejected by the serializer before any password is checked
+        ident = hashlib.md5(email.strip().lower().encode()).hexdigest()
+        return self.cache_format % {'scope': self.scope, 'ident': ident}
+
+
+def bandwidth_bucket(user):
+    """
+    Returns the bucket that paces `user`'s downloads, or None when there is no cap.
+    """
+    limit = settings.FILE_DOWNLOAD_BANDWIDTH
+    if not limit:
+        return None
+    # Bursts of up to one second's worth of bytes
+    return TokenBucket(f'throttle_bandwidth_{user.pk}', limit, limit)
+
+
+def paced(blocks, bucket):
+    for block in blocks:
+        bucket.consume(len(block))
+        yield block
+
+
+async def apaced(blocks, bucket):
+    async for block in blocks:
+        await bucket.aconsume(len(block))
+        yield block
@@ -0,0 +1,86 @@
+"""
+JWTs that carry the user attributes permission checks need, so most requests never load the
+`User` row.
+
+Claims go stale when the user changes. Access tokens are short-lived, and a user whose
+type, verification, active flag or password changes is put on a small denylist in the cache
+until their existing tokens would have expired anyway. Revocation compares sub-second issue
+times, so a token issued right after it, in the same second, is still accepted. The denylist
+is only seen by processes sharing the cache; with several workers, use a shared cache backend.
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.translation import gettext_lazy as _
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTStatelessUserAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.serializers import TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from .models import User
+
+USER_CLAIMS = ('email', 'user_type', 'is_verified')  # Copied from the user into every token
+ISSUED_CLAIM = 'issued'  # Issue time with sub-second precision; 'iat' is whole seconds
+
+
+def stamp_claims(token, user):
+    for claim in USER_CLAIMS:
+        token[claim] = getattr(user, claim)
+    return token
+
+
+def tokens_for_user(user):
+    # Access tokens derived from this refresh token inherit its claims
+    refresh = RefreshToken.for_user(user)
+    refresh[ISSUED_CLAIM] = time.time()
+    return stamp_claims(refresh, user)
+
+
+def issued_at(token):
+    # Tokens issued before ISSUED_CLAIM existed fall back to 'iat'
+    return token.get(ISSUED_CLAIM, token['iat'])
+
+
+def denylist_key(user_id):
+    return f'jwt:revoked:{user_id}'
+
+
+def revoke_user_tokens(user_id):
+    # Every token issued up to now is rejected; the entry outlives the longest-lived token
+    timeout = int(settings.SIMPLE_JWT['REFRESH_TOKEN_LIFETIME'].total_seconds())
+    cache.set(denylist_key(user_id), time.time(), timeout)
+
+
+def is_revoked(user_id, issued):
+    revoked_at = cache.get(denylist_key(user_id))
+    return revoked_at is not None and issued < revoked_at
+
+
+class ClaimsJWTAuthentication(JWTStatelessUserAuthentication):
+    """
+    Authenticates from the token alone. `request.user` is a TokenUser whose `email`, `user_type`
+    and `is_verified` come from the claims, so no user query is made.
+    """
+    def get_user(self, validated_token):
+        if any(claim not in validated_token for claim in USER_CLAIMS):
+            raise InvalidToken(_("Token is missing user claims; please log in again."))
+        user = super().get_user(validated_token)
+        if is_revoked(user.id, issued_at(validated_token)):
+            raise AuthenticationFailed(_("Token has been revoked."), code='token_revoked')
+        return user
+
+
+class ClaimsTokenRefreshSerializer(TokenRefreshSerializer):
+    """
+    Issues a new access token with claims read fresh from the database, once per refresh.
+    """
+    def validate(self, attrs):
+        refresh = self.token_class(attrs['refresh'])
+        user_id = refresh[api_settings.USER_ID_CLAIM]
+        user = User.objects.filter(pk=user_id, is_active=True).first()
+        if user is None or is_revoked(user_id, issued_at(refresh)):
+            raise AuthenticationFailed(_("Token has been revoked."), code='token_revoked')
+        return {'access': str(stamp_claims(refresh.access_token, user))}
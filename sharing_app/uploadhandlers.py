@@ -0,0 +1,193 @@
+import hashlib
+import struct
+from collections import deque
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.uploadhandler import FileUploadHandler, MemoryFileUploadHandler, TemporaryFileUploadHandler
+from rest_framework import serializers, status
+from rest_framework.exceptions import APIException
+
+from .quotas import upload_allowance
+from .serializers import FileUploadSerializer
+
+ENVELOPE_ALLOWANCE = 64 * 1024  # Content-Length beyond the file: multipart boundaries, part headers, small fields
+CONTENT_TYPES_PART = b'[Content_Types].xml'  # Present in every Office Open XML package
+LOCAL_HEADER = struct.Struct('<4sHHHHHIIIHH')
+CENTRAL_HEADER = struct.Struct('<4sHHHHHHIIIHHHHHII')
+END_OF_CENTRAL_DIRECTORY = struct.Struct('<4sHHHHIIH')
+NOT_A_PACKAGE = "File is not a valid Office Open XML document."
+
+
+class DigestMixin:
+    """
+    Computes the SHA-256 of an uploaded file while it streams in, so storage can be keyed by
+    content without reading the file a second time. The digest ends up on `file.sha256`.
+    """
+    def new_file(self, *args, **kwargs):
+        self.digest = hashlib.sha256()  # Set first: the memory handler stops the chain from new_file
+        super().new_file(*args, **kwargs)
+
+    def receive_data_chunk(self, raw_data, start):
+        passed_on = super().receive_data_chunk(raw_data, start)
+        if passed_on is None:
+            self.digest.update(raw_data)  # Only the handler that keeps the data hashes it
+        return passed_on
+
+    def file_complete(self, file_size):
+        file = super().file_complete(file_size)
+        if file is not None:
+            file.sha256 = self.digest.hexdigest()
+        return file
+
+
+class HashingMemoryFileUploadHandler(DigestMixin, MemoryFileUploadHandler):
+    pass
+
+
+class HashingTemporaryFileUploadHandler(DigestMixin, TemporaryFileUploadHandler):
+    pass
+
+
+class UploadRejected(APIException):
+    """
+    Raised by UploadGuardHandler to stop reading the request body. The response has the shape of
+    a serializer error on `file`.
+    """
+    status_code = status.HTTP_400_BAD_REQUEST
+    default_code = 'upload_rejected'
+
+    def __init__(self, message, status_code=None):
+        super().__init__({'file': [message]})
+        if status_code is not None:
+            self.status_code = status_code
+
+
+def find_content_types(head):
+    """
+    Walks the zip entries at the start of a file. Returns True once the content types part is
+    found, False if `head` is not the start of a zip archive or its entries end without one, or
+    None if undecided: `head` ran out, or an entry's size is only written after its data.
+    """
+    offset = 0
+    while offset + LOCAL_HEADER.size <= len(head):
+        signature, _, flags, _, _, _, _, compressed_size, _, name_length, extra_length = LOCAL_HEADER.unpack_from(head, offset)
+        if signature != b'PK\x03\x04':
+            return False  # Not a zip, or the central directory follows the last entry
+        name_start = offset + LOCAL_HEADER.size
+        name = head[name_start:name_start + name_length]
+        if len(name) < name_length:
+            return None
+        if name == CONTENT_TYPES_PART:
+            return True
+        if flags & 0x08 or compressed_size == 0xFFFFFFFF:
+            return None  # Data descriptor or ZIP64; the next entry cannot be located from here
+        offset = name_start + name_length + extra_length + compressed_size
+    return None
+
+
+def lists_content_types(tail):
+    """
+    Looks for the content types part in the central directory at the end of a zip archive.
+    Returns None if the directory does not fit in `tail` or is ZIP64.
+    """
+    end = tail.rfind(b'PK\x05\x06')
+    if end < 0 or end + END_OF_CENTRAL_DIRECTORY.size > len(tail):
+        return False
+    _, _, _, _, entries, directory_size, _, _ = END_OF_CENTRAL_DIRECTORY.unpack_from(tail, end)
+    if entries == 0xFFFF or directory_size == 0xFFFFFFFF or directory_size > end:
+        return None
+    offset = end - directory_size
+    for _ in range(entries):
+        if offset + CENTRAL_HEADER.size > end or tail[offset:offset + 4] != b'PK\x01\x02':
+            return False
+        name_length, extra_length, comment_length = CENTRAL_HEADER.unpack_from(tail, offset)[10:13]
+        name_start = offset + CENTRAL_HEADER.size
+        if tail[name_start:name_start + name_length] == CONTENT_TYPES_PART:
+            return True
+        offset = name_start + name_length + extra_length + comment_length
+    return False
+
+
+def is_office_package(file, size):
+    """
+    The content check UploadGuardHandler applies while a body streams in, for a file that is
+    already stored: the head is walked first, and the central directory only if that is undecided.
+    """
+    sniff_size = settings.FILE_UPLOAD_SNIFF_SIZE
+    file.seek(0)
+    found = find_content_types(file.read(sniff_size))
+    if found is None:
+        file.seek(max(size - sniff_size, 0))
+        found = lists_content_types(file.read(sniff_size))
+    file.seek(0)
+    return found is not False
+
+
+class UploadGuardHandler(FileUploadHandler):
+    """
+    First of a view's upload handlers. Refuses an upload the moment it is known to be too large
+    or not an Office Open XML document, so the rest of the body is never read or spooled:
+
+    - from Content-Length, before any of the body is read;
+    - from the file name, before any of the file's bytes;
+    - from the running size of each chunk;
+    - from the first FILE_UPLOAD_SNIFF_SIZE bytes, which must start a zip archive that holds
+      [Content_Types].xml. When that part is not found there, the central directory at the end
+      of the file is checked instead.
+    """
+    def __init__(self, request, limit, too_large_message):
+        super().__init__(request)
+        self.limit = limit
+        self.too_large_message = too_large_message
+
+    def too_large(self):
+        return UploadRejected(self.too_large_message, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+
+    def handle_raw_input(self, input_data, META, content_length, boundary, encoding=None):
+        if content_length > self.limit + ENVELOPE_ALLOWANCE:
+            raise self.too_large()
+
+    def new_file(self, field_name, file_name, *args, **kwargs):
+        super().new_file(field_name, file_name, *args, **kwargs)
+        # Same rule as FileUploadSerializer, applied before the file's data arrives
+        try:
+            FileUploadSerializer().validate_file(ContentFile(b'', name=file_name))
+        except serializers.ValidationError as e:
+            raise UploadRejected(e.detail[0])
+        self.head = b''
+        self.found = None
+        self.tail = deque()
+        self.tail_size = 0
+
+    def receive_data_chunk(self, raw_data, start):
+        if start + len(raw_data) > self.limit:
+            raise self.too_large()
+        sniff_size = settings.FILE_UPLOAD_SNIFF_SIZE
+        if self.found is None and start < sniff_size:
+            self.head += raw_data[:sniff_size - start]
+            self.found = find_content_types(self.head)
+            if self.found is False:
+                raise UploadRejected(NOT_A_PACKAGE)
+        if self.found is None:
+            # Keep just enough of the end of the file for its central directory
+            self.tail.append(raw_data)
+            self.tail_size += len(raw_data)
+            while self.tail_size - len(self.tail[0]) >= sniff_size:
+                self.tail_size -= len(self.tail.popleft())
+        return raw_data
+
+    def file_complete(self, file_size):
+        if self.found is None and lists_content_types(b''.join(self.tail)) is False:
+            raise UploadRejected(NOT_A_PACKAGE)
+        return None  # The handlers after this one store the file
+
+
+def guard_upload(request, user_id):
+    """
+    Installs UploadGuardHandler with the user's size limit, or what is left of their storage quota
+    if that is less. Call before the request body is parsed. Refusing an upload early only saves
+    receiving its body where the body is still being received while it is parsed: under WSGI,
+    and for views with `stream_request_body` under StreamingBodyASGIHandler.
+    """
+    request.upload_handlers.insert(0, UploadGuardHandler(request, *upload_allowance(user_id)))
@@ -1,24 +1,41 @@
 from django.urls import path
-from rest_framework_simplejwt.views import TokenRefreshView
 from .views import (
     UserSignupView, UserLoginView, FileUploadView, FileListView, FileDownloadView,
-    EmailVerificationView,
+    EmailVerificationView, UploadSessionCreateView, UploadSessionView, UploadChunkView,
+    UploadSessionCompleteView, BulkUserProvisioningView, ClaimsTokenRefreshView, FileSearchView,
+    FileArchiveView, MetricsView, StorageUsageView, FileChangesView,
 )
+from .async_views import AsyncFileUploadView, AsyncFileDownloadView
 from django.conf import settings
 from django.conf.urls.static import static
 
 
 urlpatterns = [
     path('api/signup/', UserSignupView.as_view(), name='user-signup'),
+    path('api/users/bulk/', BulkUserProvisioningView.as_view(), name='user-bulk-provision'),
     path('api/login/', UserLoginView.as_view(), name='user-login'),  # JWT login
-    path('api/token/refresh/',TokenRefreshView.as_view(), name='token-refresh'),
+    path('api/token/refresh/',ClaimsTokenRefreshView.as_view(), name='token-refresh'),
 
     path('api/upload/', FileUploadView.as_view(), name='file-upload'),
+    path('api/upload/sessions/', UploadSessionCreateView.as_view(), name='upload-session-create'),
+    path('api/upload/sessions/<uuid:pk>/', UploadSessionView.as_view(), name='upload-session'),
+    path('api/upload/sessions/<uuid:pk>/chunks/<int:index>/', UploadChunkView.as_view(), name='upload-session-chunk'),
+    path('api/upload/sessions/<uuid:pk>/complete/', UploadSessionCompleteView.as_view(), name='upload-session-complete'),
+    path('api/usage/', StorageUsageView.as_view(), name='storage-usage'),
     path('api/files/', FileListView.as_view(), name='file-list'),
+    path('api/files/search/', FileSearchView.as_view(), name='file-search'),
+    path('api/files/changes/', FileChangesView.as_view(), name='file-changes'),
     path('api/files/<int:pk>/download/', FileDownloadView.as_view(), name='file-download'),
+    path('api/files/archive/', FileArchiveView.as_view(), name='file-archive'),
 
     path('api/email/verify/<str:token>/', EmailVerificationView.as_view(), name='email-verification'),
     path('api/files/download/<str:signed_url>/', FileDownloadView.as_view(), name='secure-file-download'),
+
+    # Async equivalents for ASGI deployments; they accept the same tokens and download links
+    path('api/async/upload/', AsyncFileUploadView.as_view(), name='async-file-upload'),
+    path('api/async/files/download/<str:signed_url>/', AsyncFileDownloadView.as_view(), name='async-secure-file-download'),
+
+    path('metrics/', MetricsView.as_view(), name='metrics'),
 ]
 
 if settings.DEBUG:
@@ -1,25 +1,74 @@
+import hashlib
 import logging
-from django.core.mail import send_mail, BadHeaderError
-from django.urls import reverse
-from django.conf import settings
-from smtplib import SMTPException  # Import SMTPException from the smtplib module
+import mimetypes
+import os
+import tempfile
+from django.core.files import File
 
 logger = logging.getLogger(__name__)  # Set up logging
 
-def send_verification_email(user, token):
-    # Construct the verification link
-    verification_link = f"{settings.BACKEND_URL}{reverse('verify-email', args=[token])}"
-    
-    subject = "Verify Your Email"
-    message = f"Click the link to verify your email: {verification_link}"
-    from_email = settings.EMAIL_HOST_USER
-    recipient_list = [user.email]
-
-    try:
-        send_mail(subject, message, from_email, recipient_list)
-    except BadHeaderError:
-        logger.error(f"Invalid header found when sending email to {user.email}.")
-    except SMTPException as e:
-        logger.error(f"Failed to send email to {user.email} due to SMTP error: {str(e)}")
-    except Exception as e:
-        logger.error(f"An unexpected error occurred when sending email to {user.email}: {str(e)}")
+def file_digest(content):
+    # SHA-256 of a Django File, read chunk by chunk; used when no upload handler hashed it on the way in
+    digest = hashlib.sha256()
+    for chunk in content.chunks():
+        digest.update(chunk)
+    content.seek(0)
+    return digest.hexdigest()
+
+
+def name_metadata(name):
+    # Extension and MIME type as stored on File; both follow from the name the file was uploaded as
+    return {
+        'extension': os.path.splitext(name)[1].lstrip('.').lower(),
+        'content_type': mimetypes.guess_type(name)[0] or 'application/octet-stream',
+    }
+
+
+class MissingUploadData(IOError):
+    """
+    The partial upload on disk is missing or shorter than its session says.
+    """
+
+
+def copy_blocks(stream, destination, length, block_size=64 * 1024):
+    # Copy up to `length` bytes one block at a time, so a chunk is never held in memory.
+    # Returns the number of bytes actually copied.
+    remaining = length
+    while remaining > 0:
+        block = stream.read(min(block_size, remaining))
+        if not block:
+            break
+        destination.write(block)
+        remaining -= len(block)
+    return length - remaining
+
+
+def spool_chunk(directory, stream, length):
+    # Receive a chunk into a new private file in `directory`. Returns (path, bytes received);
+    # the caller removes the file.
+    os.makedirs(directory, exist_ok=True)
+    fd, path = tempfile.mkstemp(dir=directory, suffix='.chunk')
+    with os.fdopen(fd, 'wb') as destination:
+        return path, copy_blocks(stream, destination, length)
+
+
+def write_chunk(path, offset, stream, length):
+    # Write `length` bytes from `stream` into `path` starting at `offset`. Returns the number of
+    # bytes actually written. Callers must not write to the same `path` concurrently.
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if offset and (not os.path.exists(path) or os.path.getsize(path) < offset):
+        raise MissingUploadData(f"Partial upload {path} is missing data before offset {offset}.")
+
+    with open(path, 'r+b' if os.path.exists(path) else 'wb') as destination:
+        destination.seek(offset)
+        destination.truncate()  # Drop anything left behind by an interrupted chunk
+        return copy_blocks(stream, destination, length)
+
+
+class PartialUploadFile(File):
+    """
+    A finished resumable upload. Exposing the on-disk path lets file system storage move the
+    data into place instead of copying it.
+    """
+    def temporary_file_path(self):
+        return self.file.name
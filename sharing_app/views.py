@@ -1,18 +1,42 @@
 from rest_framework import generics, permissions, status
+from rest_framework.exceptions import NotFound
+from rest_framework.parsers import JSONParser
 from rest_framework.response import Response
-from .models import File, VerificationToken, User
+from .models import File, FileChange, VerificationToken, User, UploadSession
+from django.conf import settings
 from django.core.signing import BadSignature
-from .utils import send_verification_email
-from .serializers import UserSignupSerializer, FileUploadSerializer, FileListSerializer, UserLoginSerializer
-from rest_framework_simplejwt.tokens import RefreshToken
-from rest_framework_simplejwt.authentication import JWTAuthentication
+from django.http import HttpResponse
+from django.views import View
+from django.db import transaction
+from django.utils.cache import get_conditional_response
+from . import listing_cache, metrics
+from .archive import archive_response
+from .delivery import decode_download_link, serve_file
+from .filters import FileMetadataFilter
+from .pagination import FileCursorPagination
+from .parsers import CSVRowsParser, JSONLinesParser
+from .provisioning import provision_users
+from .quotas import upload_allowance, usage
+from .routers import pin_to_primary
+from .search import get_backend
+from .throttling import LoginAccountThrottle, ScopedBucketThrottle, bandwidth_bucket
+from .uploadhandlers import NOT_A_PACKAGE, UploadRejected, guard_upload, is_office_package
+from .outbox import queue_verification_email
+from .utils import MissingUploadData, PartialUploadFile, spool_chunk, write_chunk
+from .serializers import (
+    UserSignupSerializer, FileUploadSerializer, FileListSerializer, UserLoginSerializer,
+    UploadSessionSerializer, FileListRowSerializer,
+)
+from rest_framework_simplejwt.views import TokenRefreshView
+from .tokens import ClaimsJWTAuthentication, ClaimsTokenRefreshSerializer, tokens_for_user
 from django.utils import timezone
 from datetime import timedelta
 import uuid
 import base64
+import hmac
 import json
 import logging
-from django.http import FileResponse
+import os
 from rest_framework.permissions import IsAuthenticated
 
 # Logger for tracking events
@@ -49,7 +73,7 @@ class UserSignupView(generics.CreateAPIView):
         if user.user_type == 'client_user':
             token = str(uuid.uuid4())  # Generate a unique token for email verification
             VerificationToken.objects.create(user=user, token=token)
-            send_verification_email(user, token)  # Send verification email
+            queue_verification_email(user, token)  # Queue the verification email
 
         user.save()
         return Response({
@@ -57,9 +81,33 @@ class UserSignupView(generics.CreateAPIView):
         }, status=status.HTTP_201_CREATED)
 
 
+class BulkUserProvisioningView(generics.GenericAPIView):
+    """
+    Creates many users from one CSV, JSON Lines or JSON array body. Restricted to staff.
+    """
+    permission_classes = [permissions.IsAdminUser]
+    parser_classes = [JSONParser, CSVRowsParser, JSONLinesParser]
+
+    def post(self, request, *args, **kwargs):
+        rows = request.data
+        if not isinstance(rows, list):
+            return Response({"error": "Expected a list of users."}, status=status.HTTP_400_BAD_REQUEST)
+        if len(rows) > settings.BULK_PROVISIONING_MAX_ROWS:
+            return Response({"error": f"At most {settings.BULK_PROVISIONING_MAX_ROWS} users per request."}, status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+
+        created, errors = provision_users(rows)
+        return Response({
+            "message": f"{len(created)} user(s) created.",
+            "created": len(created),
+            "errors": [{"row": number, "errors": row_errors} for number, row_errors in errors],
+        }, status=status.HTTP_201_CREATED if created else status.HTTP_400_BAD_REQUEST)
+
+
 class UserLoginView(generics.GenericAPIView):
     permission_classes = [permissions.AllowAny]
     serializer_class = UserLoginSerializer  
+    throttle_classes = [ScopedBucketThrottle, LoginAccountThrottle]  # Every attempt costs a password hash
+    throttle_scope = 'login'
 
     def post(self, request, *args, **kwargs):
         # Validate login credentials
@@ -67,8 +115,8 @@ class UserLoginView(generics.GenericAPIView):
         serializer.is_valid(raise_exception=True)
         user = serializer.validated_data['user']  
 
-        # Generate JWT tokens for the logged-in user
-        refresh = RefreshToken.for_user(user)
+        # Generate JWT tokens for the logged-in user, carrying the claims permission checks need
+        refresh = tokens_for_user(user)
 
         return Response({
             "refresh": str(refresh),
@@ -77,56 +125,330 @@ class UserLoginView(generics.GenericAPIView):
         }, status=status.HTTP_200_OK)
 
 
+def upload_response_data(file_instance, user):
+    # Response body shared by direct and resumable uploads
+    return {
+        "message": "File uploaded successfully.",
+        "file_name": file_instance.original_name or file_instance.file.name,
+        "file_type": file_instance.extension,
+        "file_size": file_instance.size,
+        "content_type": file_instance.content_type,
+        "uploaded_by": user.email,
+        "upload_date": file_instance.upload_date.strftime("%Y-%m-%d %H:%M:%S"),
+    }
+
+
+class ClaimsTokenRefreshView(TokenRefreshView):
+    serializer_class = ClaimsTokenRefreshSerializer  # Re-reads the user so refreshed claims are current
+
+
 class FileUploadView(generics.CreateAPIView):
     serializer_class = FileUploadSerializer
     permission_classes = [permissions.IsAuthenticated, IsOpsUser]  # Restrict access to Ops Users
-    authentication_classes = [JWTAuthentication]  # Use JWT for authentication
+    authentication_classes = [ClaimsJWTAuthentication]  # Use JWT for authentication
 
     def create(self, request, *args, **kwargs):
+        guard_upload(request, request.user.id)  # Oversized or non-OOXML bodies are refused while they stream in
         # Validate and save the uploaded file
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
-        file_instance = serializer.save(uploaded_by=request.user)  # Save the file instance
-
-        # Prepare response data
-        response_data = {
-            "message": "File uploaded successfully.",
-            "file_name": file_instance.file.name,
-            "file_type": file_instance.file.name.split('.')[-1],
-            "uploaded_by": request.user.email,
-            "upload_date": file_instance.upload_date.strftime("%Y-%m-%d %H:%M:%S"),
-        }
+        file_instance = serializer.save(uploaded_by_id=request.user.id)  # Save the file instance
+
+        return Response(upload_response_data(file_instance, request.user), status=status.HTTP_201_CREATED)
+
+
+class UploadSessionCreateView(generics.CreateAPIView):
+    """
+    Starts a resumable upload. Chunks are then sent to the session until it is completed.
+    """
+    serializer_class = UploadSessionSerializer
+    permission_classes = [permissions.IsAuthenticated, IsOpsUser]  # Same audience as FileUploadView
+    authentication_classes = [ClaimsJWTAuthentication]
+
+    def perform_create(self, serializer):
+        serializer.save(uploaded_by_id=self.request.user.id)
+
+
+class UploadSessionView(generics.GenericAPIView):
+    """
+    Reports how far a resumable upload has got, or abandons it.
+    """
+    serializer_class = UploadSessionSerializer
+    permission_classes = [permissions.IsAuthenticated, IsOpsUser]
+    authentication_classes = [ClaimsJWTAuthentication]
+
+    def get_queryset(self):
+        return UploadSession.objects.filter(uploaded_by_id=self.request.user.id)  # Users only see their own sessions
+
+    def get_object(self):
+        session = super().get_object()
+        if session.is_expired():
+            session.discard()
+            raise NotFound("Upload session has expired.")
+        return session
+
+    def session_response(self, session, data=None, status_code=status.HTTP_200_OK):
+        # Always tell the client where to resume from
+        response = Response(data or self.get_serializer(session).data, status=status_code)
+        response['Upload-Offset'] = str(session.offset)
+        return response
+
+    def get(self, request, pk):
+        return self.session_response(self.get_object())
+
+    def delete(self, request, pk):
+        self.get_object().discard()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class UploadChunkView(UploadSessionView):
+    """
+    Appends one numbered chunk to a resumable upload. The request body is the raw chunk and the
+    `Upload-Offset` header must match the number of bytes the server already holds.
+    """
+    http_method_names = ['put', 'patch', 'options']
+
+    def put(self, request, pk, index):
+        session = self.get_object()
+        try:
+            offset = int(request.headers['Upload-Offset'])
+            length = int(request.META.get('CONTENT_LENGTH') or 0)
+        except (KeyError, ValueError):
+            return Response({"error": "Upload-Offset and Content-Length headers are required."}, status=status.HTTP_400_BAD_REQUEST)
+
+        # The chunk must continue exactly where the stored data ends
+        if offset != session.offset or index != session.chunk_count:
+            return self.session_response(session, {
+                "error": "Chunk does not continue the upload.",
+                "offset": session.offset,
+                "next_chunk": session.chunk_count,
+            }, status.HTTP_409_CONFLICT)
+
+        if length <= 0 or length > settings.UPLOAD_CHUNK_MAX_SIZE:
+            return Response({"error": f"Chunks must be between 1 and {settings.UPLOAD_CHUNK_MAX_SIZE} bytes."}, status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        if session.total_size is not None and offset + length > session.total_size:
+            return Response({"error": "Chunk goes past the declared file size."}, status=status.HTTP_400_BAD_REQUEST)
+        limit, message = upload_allowance(request.user.id)
+        if offset + length > limit:
+            return Response({"error": message}, status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+
+        # Receive the body into a private file first, so a slow client holds no lock
+        chunk_path, received = spool_chunk(settings.UPLOAD_SESSION_DIR, request.stream, length)
+        try:
+            if received != length:
+                return self.session_response(session, {"error": "Chunk was cut short.", "offset": session.offset}, status.HTTP_400_BAD_REQUEST)
+            return self.append_chunk(session.pk, offset, chunk_path, length)
+        finally:
+            os.remove(chunk_path)
+
+    def append_chunk(self, pk, offset, chunk_path, length):
+        with transaction.atomic():
+            # The lock makes requests for one session append one at a time, so only the first
+            # request for an offset writes there and the rest are refused
+            session = UploadSession.objects.select_for_update().filter(pk=pk).first()
+            if session is None:
+                raise NotFound("Upload session no longer exists.")
+            if session.offset != offset:
+                return self.session_response(session, {"error": "Upload session was modified concurrently.", "offset": session.offset}, status.HTTP_409_CONFLICT)
+
+            lost = False
+            try:
+                with open(chunk_path, 'rb') as chunk:
+                    write_chunk(session.part_path, offset, chunk, length)
+            except MissingUploadData as e:
+                # Nothing stored can be trusted any more; the client starts the upload again
+                logger.warning(f"Resetting upload session {session.pk}: {str(e)}")
+                lost = True
+                session.offset = session.chunk_count = 0
+            else:
+                session.offset += length
+                session.chunk_count += 1
+            session.touch(save=False)
+            session.save(update_fields=['offset', 'chunk_count', 'expires_at'])
+
+        if lost:
+            return self.session_response(session, {
+                "error": "Stored data for this upload was lost; send it again from the start.",
+                "offset": 0,
+                "next_chunk": 0,
+            }, status.HTTP_409_CONFLICT)
+        return self.session_response(session)
+
+    patch = put
+
+
+class UploadSessionCompleteView(UploadSessionView):
+    """
+    Turns a fully received resumable upload into a `File`, applying the same validation as FileUploadView.
+    """
+    http_method_names = ['post', 'options']
 
-        return Response(response_data, status=status.HTTP_201_CREATED)
+    def post(self, request, pk):
+        self.get_object()  # Not found or expired, as for the other session requests
+        with transaction.atomic():
+            # The lock makes a second complete for this session wait, then find it already completed
+            session = UploadSession.objects.select_for_update().filter(pk=pk).first()
+            if session is None:
+                raise NotFound("Upload session no longer exists.")
+            if not session.offset:
+                return Response({"error": "No data has been uploaded."}, status=status.HTTP_400_BAD_REQUEST)
+            if session.total_size is not None and session.offset != session.total_size:
+                return self.session_response(session, {"error": "Upload is incomplete.", "offset": session.offset}, status.HTTP_400_BAD_REQUEST)
+
+            with open(session.part_path, 'rb') as part:
+                # Chunks bypass UploadGuardHandler, so the finished file gets its content check here
+                if not is_office_package(part, session.offset):
+                    raise UploadRejected(NOT_A_PACKAGE)
+                serializer = FileUploadSerializer(data={'file': PartialUploadFile(part, name=session.file_name)})
+                serializer.is_valid(raise_exception=True)
+                file_instance = serializer.save(uploaded_by_id=request.user.id)
+
+            session.discard()
+        return Response(upload_response_data(file_instance, request.user), status=status.HTTP_201_CREATED)
 
 
 class FileListView(generics.ListAPIView):
     serializer_class = FileListSerializer
     permission_classes = [permissions.IsAuthenticated]  # Only authenticated users can list files
-    authentication_classes = [JWTAuthentication]
+    authentication_classes = [ClaimsJWTAuthentication]
+    pagination_class = FileCursorPagination
+    filter_backends = [FileMetadataFilter]  # ?type=docx,pptx&min_size=&max_size=; sorting is ?ordering=
 
     def get_queryset(self):
-        user = self.request.user
-        
         # Return files based on user type
-        if user.user_type == 'ops_user':
-            return File.objects.filter(uploaded_by=user)  # Ops Users see their own files
-        elif user.user_type == 'client_user' and user.is_verified:
-            return File.objects.all()  # Verified Client Users see all files
-        
-        return File.objects.none()  # If conditions are not met, return no files
+        return File.objects.visible_to(self.request.user).select_related('uploaded_by')  # Uploader emails come from the same query
 
     def list(self, request, *args, **kwargs):
-        response = super().list(request, *args, **kwargs)
-        response.data = {
+        audience = listing_cache.audience_for(request.user)
+        if audience is None:
+            return Response(self.build_page())
+
+        # Pages are cached per audience and version; a matching ETag needs no database work
+        version = listing_cache.get_version(audience)
+        etag = listing_cache.page_etag(audience, version, request)
+        not_modified = get_conditional_response(request, etag=etag)
+        if not_modified is not None:
+            not_modified['ETag'] = etag
+            return not_modified
+
+        key = listing_cache.page_key(audience, version, request)
+        data = listing_cache.get_page(key)
+        if data is None:
+            if listing_cache.recently_changed(audience):
+                pin_to_primary()  # A lagging replica would cache rows from before the change under the new version
+            data = self.build_page()
+            listing_cache.set_page(key, data)
+
+        response = Response(data)
+        response['ETag'] = etag
+        return response
+
+    def build_page(self):
+        # Always paginate; the cursor in "next" fetches the following page
+        queryset = self.filter_queryset(self.get_queryset()).values(*FileListRowSerializer.fields)
+        page = self.paginate_queryset(queryset)
+        return {
             "message": "Files listed successfully",
-            "files": response.data  # Include files in the response
+            "files": FileListRowSerializer(self.get_serializer_context()).many(page),  # Include files in the response
+            "next": self.paginator.get_next_link(),
         }
-        return Response(response.data)
+
+
+class StorageUsageView(generics.GenericAPIView):
+    """
+    The uploader's storage usage and quota, read from their counter.
+    """
+    permission_classes = [permissions.IsAuthenticated, IsOpsUser]  # Only Ops Users store files
+    authentication_classes = [ClaimsJWTAuthentication]
+
+    def get(self, request):
+        return Response(usage(request.user.id))
+
+
+class FileSearchView(generics.GenericAPIView):
+    """
+    Ranked full-text search over the files the user may list. `?q=` words must all appear.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    authentication_classes = [ClaimsJWTAuthentication]
+
+    def get(self, request):
+        query = request.query_params.get('q', '').strip()
+        if not query:
+            return Response({"error": "The q parameter is required."}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            limit = min(int(request.query_params.get('limit', settings.FILE_SEARCH_RESULTS_LIMIT)), settings.FILE_SEARCH_RESULTS_LIMIT)
+        except ValueError:
+            return Response({"error": "limit must be a number."}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Visibility is applied inside the ranked query, before the limit
+        visible = File.objects.visible_to(request.user)
+        hits = get_backend().search(query, visible, max(limit, 1))
+        rows = File.objects.filter(pk__in=[pk for pk, score, snippet in hits]).values(*FileListRowSerializer.fields)
+        rows = {row['id']: row for row in rows}
+        serializer = FileListRowSerializer(self.get_serializer_context())
+
+        results = []
+        for pk, score, snippet in hits:
+            if pk in rows:  # Deleted since the search ran
+                results.append({**serializer.to_representation(rows[pk]), "score": round(score, 4), "snippet": snippet})
+        return Response({"message": "Search completed successfully", "results": results})
+
+
+class FileChangesView(generics.GenericAPIView):
+    """
+    Files added and deleted after `?since=<cursor>`, among those the user may list, oldest first.
+    Without `since`, returns only the current cursor, to take before a full listing.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    authentication_classes = [ClaimsJWTAuthentication]
+
+    def get(self, request):
+        # Unnumbered changes are not served yet; they are numbered above every cursor handed out
+        changes = FileChange.objects.visible_to(request.user).filter(seq__isnull=False)
+        since = request.query_params.get('since')
+        if since is None:
+            latest = changes.order_by('-seq').values_list('seq', flat=True).first()
+            return Response({"changes": [], "cursor": latest or 0, "more": False})
+        try:
+            since = int(since)
+        except ValueError:
+            since = -1
+        if since < 0:
+            return Response({"error": "since must be a cursor returned by this endpoint."}, status=status.HTTP_400_BAD_REQUEST)
+
+        limit = settings.FILE_CHANGES_PAGE_SIZE
+        rows = list(changes.filter(seq__gt=since).order_by('seq').values('seq', 'file_id', 'action')[:limit + 1])
+        more = len(rows) > limit
+        rows = rows[:limit]
+
+        added = [row['file_id'] for row in rows if row['action'] == FileChange.ADDED]
+        files = {}
+        if added:
+            files = {
+                row['id']: row
+                for row in File.objects.visible_to(request.user).filter(pk__in=added).values(*FileListRowSerializer.fields)
+            }
+        serializer = FileListRowSerializer(self.get_serializer_context())
+
+        results = []
+        for row in rows:
+            if row['action'] == FileChange.DELETED:
+                results.append({"seq": row['seq'], "action": row['action'], "file_id": row['file_id']})
+            elif row['file_id'] in files:  # Otherwise deleted since, and its tombstone follows
+                results.append({"seq": row['seq'], "action": row['action'], "file": serializer.to_representation(files[row['file_id']])})
+        return Response({"changes": results, "cursor": rows[-1]['seq'] if rows else since, "more": more})
 
 
 class FileDownloadView(generics.GenericAPIView):
     permission_classes = [IsAuthenticated]
+    authentication_classes = [ClaimsJWTAuthentication]  # User type and verification come from the token
+    throttle_classes = [ScopedBucketThrottle]
+
+    @property
+    def throttle_scope(self):
+        # Link generation and downloads are limited separately
+        return 'download_link' if self.request.method == 'POST' else 'download'
 
     def post(self, request, pk):
         # Fetch the file instance based on the primary key
@@ -141,6 +463,7 @@ class FileDownloadView(generics.GenericAPIView):
 
         # Create a dictionary to store the file URL and its expiry time
         data = {
+            'file_id': instance.pk,
             'file_url': instance.file.url,
             'expiry_time': (timezone.now() + timedelta(minutes=5)).timestamp()  # Set expiry time to 5 minutes
         }
@@ -156,8 +479,7 @@ class FileDownloadView(generics.GenericAPIView):
     def get(self, request, signed_url):
         # Decode the signed URL
         try:
-            decoded_data = base64.urlsafe_b64decode(signed_url).decode()
-            data = json.loads(decoded_data)
+            data = decode_download_link(signed_url)
 
             # Check if the URL has expired
             if timezone.now().timestamp() > data['expiry_time']:
@@ -167,18 +489,47 @@ class FileDownloadView(generics.GenericAPIView):
             if request.user.user_type != 'client_user' or not request.user.is_verified:
                 return Response({"error": "Unauthorized access."}, status=status.HTTP_403_FORBIDDEN)
 
-            # Return the file response for download
-            file_path = data['file_url']
-            response = FileResponse(open(file_path, 'rb'), as_attachment=True)
+            try:
+                instance = File.objects.get(pk=data['file_id'])
+            except File.DoesNotExist:
+                return Response({"error": "File not found."}, status=status.HTTP_404_NOT_FOUND)
 
-            # Set the content disposition to make the file downloadable
-            response['Content-Disposition'] = f'attachment; filename="{file_path.split("/")[-1]}"'
-            return response
+            # Hand the transfer to the configured delivery backend
+            return serve_file(request, instance, bandwidth=bandwidth_bucket(request.user))
 
-        except (json.JSONDecodeError, ValueError) as e:
+        except (json.JSONDecodeError, ValueError, KeyError) as e:
             return Response({"error": "Invalid download link."}, status=status.HTTP_400_BAD_REQUEST)
 
 
+class FileArchiveView(generics.GenericAPIView):
+    """
+    Streams several files as one ZIP archive. Open to the same users as FileDownloadView.
+    """
+    permission_classes = [IsAuthenticated]
+    authentication_classes = [ClaimsJWTAuthentication]
+    throttle_classes = [ScopedBucketThrottle]
+    throttle_scope = 'download'
+
+    def post(self, request):
+        # Check if the user is a verified client user
+        if request.user.user_type != 'client_user' or not request.user.is_verified:
+            return Response({"error": "Only verified Client Users can download files."}, status=status.HTTP_403_FORBIDDEN)
+
+        file_ids = request.data.get('file_ids')
+        if not isinstance(file_ids, list) or not file_ids or not all(type(pk) is int for pk in file_ids):
+            return Response({"error": "file_ids must be a non-empty list of file IDs."}, status=status.HTTP_400_BAD_REQUEST)
+        file_ids = list(dict.fromkeys(file_ids))  # Each file once, in the order asked for
+        if len(file_ids) > settings.FILE_ARCHIVE_MAX_FILES:
+            return Response({"error": f"At most {settings.FILE_ARCHIVE_MAX_FILES} files per archive."}, status=status.HTTP_400_BAD_REQUEST)
+
+        files = File.objects.in_bulk(file_ids)
+        missing = [pk for pk in file_ids if pk not in files]
+        if missing:
+            return Response({"error": "File not found.", "missing": missing}, status=status.HTTP_404_NOT_FOUND)
+
+        return archive_response([files[pk] for pk in file_ids], bandwidth=bandwidth_bucket(request.user))
+
+
 class EmailVerificationView(generics.GenericAPIView):
     def get(self, request, token):
         # Verify the email using the provided token
@@ -200,3 +551,18 @@ class EmailVerificationView(generics.GenericAPIView):
 
         except VerificationToken.DoesNotExist:
             return Response({"error": "Invalid verification token."}, status=status.HTTP_400_BAD_REQUEST)
+
+
+class MetricsView(View):
+    """
+    Prometheus scrape target. Requires `Authorization: Bearer <METRICS_TOKEN>` when a token is set.
+    """
+    content_type = 'text/plain; version=0.0.4; charset=utf-8'
+
+    def get(self, request):
+        token = settings.METRICS_TOKEN
+        if token:
+            supplied = request.headers.get('Authorization', '')
+            if not hmac.compare_digest(supplied.encode(), f'Bearer {token}'.encode()):
+                return HttpResponse("Invalid metrics token.", status=401, content_type='text/plain')
+        return HttpResponse(metrics.render(metrics.collect()), content_type=self.content_type)